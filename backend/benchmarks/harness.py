@@ -0,0 +1,86 @@
+"""
+Shared plumbing for the benchmarks that drive a real server process
+Starts the stub NAS and one uvicorn worker on free local ports, each with its
+own scratch cache directory, and tears both down afterwards.
+"""
+
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import aiohttp
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(url, timeout=20):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def read_rss_mb(pid):
+    """Resident set size of a process in MiB, or None where /proc is not available"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+@asynccontextmanager
+async def server_stack(nas_args=(), env=None):
+    """Run the stub NAS and the API; yield (api_url, api_process)
+
+    nas_args are extra stub_nas command line options, env extra server settings.
+    """
+    nas_port, api_port = free_port(), free_port()
+    cache_dir = tempfile.mkdtemp(prefix="nas-bench-")
+    nas_url = f"http://127.0.0.1:{nas_port}"
+    server_env = dict(os.environ, NAS_BASE_URL=nas_url, CACHE_DIR=cache_dir, MEDIA_PROBE_WORKERS="0")
+    server_env.update(env or {})
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.stub_nas", "--port", str(nas_port), *nas_args],
+            cwd=BACKEND_DIR, env=server_env,
+        ),
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(api_port),
+             "--workers", "1", "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=server_env,
+        ),
+    ]
+    api_url = f"http://127.0.0.1:{api_port}/api"
+    try:
+        await wait_until_up(nas_url)
+        await wait_until_up(f"{api_url}/")
+        yield api_url, processes[1]
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(cache_dir, ignore_errors=True)
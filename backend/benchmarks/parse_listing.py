@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for NAS directory listing parsing
+Compares the original three-pass regex parser with the single-pass
+ListingParser, both on a fully buffered page and fed incrementally from
+64 KiB chunks the way fetch_nas_listing reads a streamed response.
+
+Usage (from backend/):
+    python -m benchmarks.parse_listing --sizes 10000,50000,100000
+"""
+
+import argparse
+import json
+import re
+import time
+import tracemalloc
+
+from benchmarks.stub_nas import listing_rows
+from server import Movie, ListingParser, parse_file_list
+
+CHUNK_SIZE = 64 * 1024
+
+
+def legacy_parse_file_list(html_content, folder_path):
+    """The parser as it was before the single-pass rewrite, kept as the baseline"""
+    movies = []
+    video_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v']
+    patterns = [
+        r'href="([^"]*\.(?:mp4|mkv|avi|mov|wmv|flv|webm|m4v))"',
+        r'>([^<]*\.(?:mp4|mkv|avi|mov|wmv|flv|webm|m4v))<',
+        r'name="([^"]*\.(?:mp4|mkv|avi|mov|wmv|flv|webm|m4v))"'
+    ]
+    for pattern in patterns:
+        matches = re.findall(pattern, html_content, re.IGNORECASE)
+        for match in matches:
+            if any(match.lower().endswith(ext) for ext in video_extensions):
+                file_name = match.split('/')[-1]
+                movies.append(Movie(
+                    name=file_name,
+                    path=f"/{folder_path}/{file_name}",
+                    format=file_name.split('.')[-1].lower()
+                ))
+    return movies
+
+
+def chunked(rows, size):
+    buffer = ""
+    for row in rows:
+        buffer += row
+        if len(buffer) >= size:
+            yield buffer
+            buffer = ""
+    if buffer:
+        yield buffer
+
+
+def measure(func, repeat=3):
+    # Time without tracemalloc (it slows allocation-heavy code several-fold),
+    # then trace one more run for the peak
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = func()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(min(timings), 4), "peak_mib": round(peak / 2 ** 20, 2), "movies": count}
+
+
+def run(entries):
+    def legacy():
+        page = "".join(listing_rows(entries))
+        return len(legacy_parse_file_list(page, "Films"))
+
+    def single_pass():
+        page = "".join(listing_rows(entries))
+        return len(parse_file_list(page, "Films"))
+
+    def incremental():
+        parser = ListingParser("Films")
+        for chunk in chunked(listing_rows(entries), CHUNK_SIZE):
+            parser.feed(chunk)
+        return len(parser.close())
+
+    result = {"entries": entries}
+    for name, func in [("legacy", legacy), ("single_pass", single_pass), ("incremental", incremental)]:
+        result[name] = measure(func)
+        result[name]["entries_per_s"] = round(entries / result[name]["seconds"])
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Listing parser micro-benchmark")
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=[10000, 50000, 100000])
+    args = parser.parse_args()
+    print(json.dumps([run(entries) for entries in args.sizes], indent=2))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the catalog search index
+Builds a SearchIndex over synthetic release names and times type-ahead
+prefixes, whole words, typos and multi-word queries against the regex
+substring scan /api/movies?q= does.
+
+Usage (from backend/):
+    python -m benchmarks.search_index --sizes 10000,50000
+"""
+
+import argparse
+import json
+import random
+import re
+import time
+import tracemalloc
+
+from catalog_search import SearchIndex
+
+WORDS = [
+    "amélie", "poulain", "destin", "fabuleux", "intouchables", "cité", "peur", "haine", "misérables", "bienvenue",
+    "chtis", "taxi", "astérix", "obélix", "mission", "cléopâtre", "star", "wars", "empire", "retour", "jedi",
+    "seigneur", "anneaux", "communauté", "deux", "tours", "roi", "matrix", "reloaded", "revolutions", "alien",
+    "prédateur", "terminator", "jugement", "dernier", "retour", "futur", "parrain", "léon", "nikita", "subway",
+    "grand", "bleu", "cinquième", "élément", "diner", "cons", "visiteurs", "couloirs", "temps", "océan",
+]
+TAGS = ["1080p.x264", "720p.BluRay.x264", "2160p.HDR.x265", "MULTi.VFF.1080p.WEB-DL", "FRENCH.DVDRip.XviD"]
+QUERIES = {
+    "prefix": ["as", "ast", "seig", "inter", "mis"],
+    "word": ["amelie", "matrix", "seigneur", "cinquieme", "haine"],
+    "typo": ["amelei", "matirx", "seigenur", "terminatr", "intouchabels"],
+    "words": ["star wars empire", "seigneur anneaux tours", "retour futur", "grand bleu", "diner cons"],
+}
+
+
+def release_names(entries, seed=1):
+    rng = random.Random(seed)
+    for i in range(entries):
+        title = ".".join(rng.sample(WORDS, rng.randint(1, 4)))
+        yield f"{title}.{1950 + i % 75}.{rng.choice(TAGS)}.mkv"
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return result, sorted(timings)[len(timings) // 2]
+
+
+def run(entries, repeat):
+    names = list(release_names(entries))
+    docs = [{"id": str(i), "name": name, "folders": ["Films"]} for i, name in enumerate(names)]
+
+    def build():
+        index = SearchIndex()
+        for doc in docs:
+            index.add(doc)
+        return index
+
+    # Timed without tracemalloc, which slows allocation several-fold
+    index, build_seconds = timed(build, 1)
+    tracemalloc.start()
+    build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "entries": entries,
+        "words": len(index.vocabulary),
+        "build_seconds": round(build_seconds, 3),
+        "index_mib": round(peak / 2 ** 20, 1),
+        "queries": {},
+    }
+    for kind, queries in QUERIES.items():
+        ms, hits = [], []
+        for query in queries:
+            ids, seconds = timed(lambda: index.search(query, "Films"), repeat)
+            ms.append(seconds * 1000)
+            hits.append(len(ids))
+        result["queries"][kind] = {"median_ms": round(sorted(ms)[len(ms) // 2], 3), "max_ms": round(max(ms), 3), "hits": hits}
+
+    # What the regex filter of /api/movies?q= costs before MongoDB even pages it
+    pattern = re.compile(re.escape("seig"), re.IGNORECASE)
+    _, seconds = timed(lambda: [name for name in names if pattern.search(name)], repeat)
+    result["regex_scan_ms"] = round(seconds * 1000, 3)
+
+    started = time.perf_counter()
+    for doc in docs[:1000]:
+        index.remove(doc["id"])
+        index.add(doc)
+    result["update_us"] = round((time.perf_counter() - started) / 1000 * 1e6, 1)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalog search index micro-benchmark")
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=[10000, 50000])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per query, the median is reported")
+    args = parser.parse_args()
+    print(json.dumps([run(entries, args.repeat) for entries in args.sizes], indent=2))
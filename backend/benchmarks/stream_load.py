@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Concurrent stream load benchmark for /api/stream
+Runs one uvicorn worker against a local stub NAS and ramps up paced viewers
+until they can no longer sustain the target bitrate.
+
+Usage (from backend/):
+    python -m benchmarks.stream_load --levels 1,4,16,64 --bitrate 8 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+import aiohttp
+
+from benchmarks.harness import server_stack
+
+
+async def viewer(session, url, bytes_per_second, duration, chunk_size):
+    """Read one stream at a paced bitrate and return the achieved bytes/second"""
+    received = 0
+    started = time.monotonic()
+    async with session.get(url) as response:
+        response.raise_for_status()
+        async for chunk in response.content.iter_chunked(chunk_size):
+            received += len(chunk)
+            elapsed = time.monotonic() - started
+            if elapsed >= duration:
+                break
+            ahead = received / bytes_per_second - elapsed
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+    return received / (time.monotonic() - started)
+
+
+async def probe_latency(session, url, stop):
+    """Hit a cheap API route while streams run to check the event loop stays responsive"""
+    samples = []
+    while not stop.is_set():
+        started = time.monotonic()
+        async with session.get(url) as response:
+            await response.read()
+        samples.append((time.monotonic() - started) * 1000)
+        await asyncio.sleep(0.05)
+    return samples
+
+
+async def run_level(api_url, concurrency, bytes_per_second, duration, chunk_size):
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        stop = asyncio.Event()
+        prober = asyncio.create_task(probe_latency(session, f"{api_url}/", stop))
+        rates = await asyncio.gather(
+            *(viewer(session, f"{api_url}/stream/Films/movie-{i}.mp4", bytes_per_second, duration, chunk_size)
+              for i in range(concurrency)),
+            return_exceptions=True,
+        )
+        stop.set()
+        samples = await prober
+
+    ok_rates = [rate for rate in rates if not isinstance(rate, Exception)]
+    sustained = [rate for rate in ok_rates if rate >= 0.95 * bytes_per_second]
+    samples.sort()
+    return {
+        "concurrency": concurrency,
+        "errors": len(rates) - len(ok_rates),
+        "sustained": len(sustained),
+        "aggregate_mbit_s": round(sum(ok_rates) * 8 / 1e6, 1),
+        "min_stream_mbit_s": round(min(ok_rates) * 8 / 1e6, 2) if ok_rates else 0,
+        "probe_p50_ms": round(statistics.median(samples), 2) if samples else None,
+        "probe_p99_ms": round(samples[int(len(samples) * 0.99) - 1], 2) if samples else None,
+    }
+
+
+async def main(args):
+    env = {
+        "STREAM_CHUNK_SIZE": str(args.chunk_size),
+        "CHUNK_CACHE_MAX_BYTES": str(args.cache_mb * 1024 * 1024),
+    }
+    async with server_stack(env=env) as (api_url, _):
+        bytes_per_second = args.bitrate * 1e6 / 8
+        results = []
+        for level in args.levels:
+            result = await run_level(api_url, level, bytes_per_second, args.duration, args.chunk_size)
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+        capacity = max(
+            (r["concurrency"] for r in results if r["sustained"] == r["concurrency"]),
+            default=0,
+        )
+        report = {
+            "bitrate_mbit_s": args.bitrate,
+            "chunk_size": args.chunk_size,
+            "cache_mb": args.cache_mb,
+            "duration_s": args.duration,
+            "max_sustained_streams": capacity,
+            "levels": results,
+        }
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent /api/stream load benchmark")
+    parser.add_argument("--levels", type=lambda v: [int(x) for x in v.split(",")], default=[1, 4, 16, 32, 64])
+    parser.add_argument("--bitrate", type=float, default=8.0, help="per-viewer bitrate in Mbit/s")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--chunk-size", type=int, default=256 * 1024)
+    parser.add_argument("--cache-mb", type=int, default=0, help="range cache budget; 0 measures the plain proxy")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Stub Buffalo LinkStation for local benchmarks
+Serves synthetic func.cgi / share folder listings and movie files with HTTP
+Range support, with optional per-request latency and bandwidth limits.
+
+Usage (from backend/):
+    python -m benchmarks.stub_nas --listing-size 5000 --folders 4 --latency-ms 20 --bandwidth-mbit 100
+"""
+
+import argparse
+import asyncio
+import re
+import time
+
+from aiohttp import web
+
+BLOCK = bytes(range(256)) * 256  # 64 KiB repeating pattern
+LAST_MODIFIED = "Sat, 01 Jul 2023 20:15:00 GMT"
+VIDEO_EXTENSIONS = ("mp4", "mkv", "avi", "mov", "wmv", "flv", "webm", "m4v")
+
+
+def parse_range(range_header, size):
+    """Return (start, end) for a single 'bytes=' range, or None when absent/invalid"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header or "")
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last) if last else size - 1, size - 1)
+    if start > end:
+        return None
+    return start, end
+
+
+def listing_rows(entries, folder="Films", subfolders=()):
+    """Yield a synthetic func.cgi-style listing, one table row per file or folder"""
+    extensions = ["mkv", "mp4", "avi", "srt", "nfo"]
+    yield "<html><body><table>\n"
+    for name in subfolders:
+        yield f'<tr><td><a href="/share/{folder}/{name}/">{name}/</a></td><td>-</td><td>2023/07/01 20:15</td></tr>\n'
+    for i in range(entries):
+        name = f"Film {i:06d} (20{i % 25:02d}) 1080p.x264.{extensions[i % len(extensions)]}"
+        yield (
+            f'<tr><td><a href="/share/{folder}/{name}">{name}</a></td>'
+            f'<td>{700 + i % 4000} MB</td><td>2023/{1 + i % 12:02d}/{1 + i % 28:02d} 20:15</td></tr>\n'
+        )
+    yield "</table></body></html>\n"
+
+
+class Throttle:
+    """Paces writes to a byte rate, like a link of that bandwidth"""
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self.available_at = time.monotonic()
+
+    async def wait(self, nbytes):
+        now = time.monotonic()
+        self.available_at = max(self.available_at, now) + nbytes / self.bytes_per_second
+        delay = self.available_at - now - nbytes / self.bytes_per_second
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class StubNAS:
+    def __init__(self, file_size=512 * 1024 * 1024, listing_size=200, folders=0, depth=1,
+                 latency=0.0, bandwidth=None, total_bandwidth=None):
+        self.file_size = file_size
+        self.listing_size = listing_size
+        self.folders = folders
+        self.depth = depth
+        self.latency = latency
+        self.bandwidth = bandwidth  # bytes/s per response
+        self.link = Throttle(total_bandwidth) if total_bandwidth else None  # shared by all responses
+        self.listings = {}
+
+    def listing(self, folder):
+        """Return the (cached) listing page of a folder"""
+        folder = folder.strip("/")
+        page = self.listings.get(folder)
+        if page is None:
+            level = folder.count("/")
+            subfolders = [f"Folder {i:02d}" for i in range(self.folders)] if level < self.depth else []
+            page = self.listings[folder] = "".join(listing_rows(self.listing_size, folder, subfolders)).encode()
+        return page
+
+    async def send(self, request, response, body_length, chunks):
+        """Send chunks through the latency and bandwidth limits"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response.content_length = body_length
+        await response.prepare(request)
+        if request.method == "HEAD":
+            return response
+
+        own = Throttle(self.bandwidth) if self.bandwidth else None
+        try:
+            for chunk in chunks:
+                if own:
+                    await own.wait(len(chunk))
+                if self.link:
+                    await self.link.wait(len(chunk))
+                await response.write(chunk)
+            await response.write_eof()
+        except ConnectionError:
+            # The proxy hung up because its viewer went away
+            pass
+        return response
+
+    async def index(self, request):
+        return await self.send(request, web.StreamResponse(), 11, [b"LinkStation"])
+
+    async def send_listing(self, request, folder):
+        page = self.listing(folder)
+        response = web.StreamResponse()
+        response.content_type = "text/html"
+        return await self.send(request, response, len(page), self.page_chunks(page))
+
+    async def func_cgi(self, request):
+        if request.query.get("FUNC") != "dir":
+            raise web.HTTPNotFound()
+        return await self.send_listing(request, request.query.get("PATH", ""))
+
+    async def share(self, request):
+        path = request.match_info["path"]
+        if not path.lower().endswith(VIDEO_EXTENSIONS):
+            return await self.send_listing(request, path)
+
+        size = self.file_size
+        byte_range = parse_range(request.headers.get("Range"), size)
+        if byte_range:
+            start, end = byte_range
+            response = web.StreamResponse(status=206)
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        else:
+            start, end = 0, size - 1
+            response = web.StreamResponse(status=200)
+        response.content_type = "video/mp4"
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["Last-Modified"] = LAST_MODIFIED
+        return await self.send(request, response, end - start + 1, self.file_chunks(start, end))
+
+    @staticmethod
+    def page_chunks(page):
+        for offset in range(0, len(page), len(BLOCK)):
+            yield page[offset:offset + len(BLOCK)]
+
+    @staticmethod
+    def file_chunks(start, end):
+        offset = start
+        while offset <= end:
+            block_offset = offset % len(BLOCK)
+            length = min(len(BLOCK) - block_offset, end - offset + 1)
+            yield BLOCK[block_offset:block_offset + length]
+            offset += length
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get("/", self.index)
+        app.router.add_get("/cgi-bin/func.cgi", self.func_cgi)
+        app.router.add_get("/share/{path:.*}", self.share)
+        return app
+
+
+async def start_stub_nas(host="127.0.0.1", port=0, **options):
+    """Start the stub NAS in the running loop and return (runner, base_url)"""
+    runner = web.AppRunner(StubNAS(**options).make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub LinkStation for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--file-size", type=int, default=512 * 1024 * 1024)
+    parser.add_argument("--listing-size", type=int, default=200, help="files in every folder listing")
+    parser.add_argument("--folders", type=int, default=0, help="subfolders in every folder")
+    parser.add_argument("--depth", type=int, default=1, help="levels of subfolders below each share")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before every response")
+    parser.add_argument("--bandwidth-mbit", type=float, default=None, help="limit per response")
+    parser.add_argument("--total-bandwidth-mbit", type=float, default=None, help="limit shared by all responses")
+    args = parser.parse_args()
+    stub = StubNAS(
+        file_size=args.file_size,
+        listing_size=args.listing_size,
+        folders=args.folders,
+        depth=args.depth,
+        latency=args.latency_ms / 1000,
+        bandwidth=args.bandwidth_mbit * 1e6 / 8 if args.bandwidth_mbit else None,
+        total_bandwidth=args.total_bandwidth_mbit * 1e6 / 8 if args.total_bandwidth_mbit else None,
+    )
+    web.run_app(stub.make_app(), host=args.host, port=args.port, access_log=None, print=None)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the NAS-facing hot paths
+Runs one uvicorn worker against the stub NAS and drives three scenarios:
+
+- listing:    concurrent recursive folder walks (/api/folders?recursive=true),
+              i.e. NAS listing fetch + parse for every folder
+- seek:       concurrent random Range reads, like viewers scrubbing
+- sequential: concurrent unpaced full-speed reads of long ranges
+
+The JSON report holds p50/p90/p99 latencies, throughput and the server's RSS
+for each scenario. With --mount the server reads the same files from a local
+directory (NAS_MOUNT_ROOT) instead of over HTTP. Save one as a baseline and pass it to --baseline on later
+runs to get the relative change of every figure.
+
+Usage (from backend/):
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --latency-ms 5 --bandwidth-mbit 400 --baseline baseline.json
+    python -m benchmarks.suite --mount --scenarios seek,sequential --baseline baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+
+from benchmarks.harness import BACKEND_DIR, read_rss_mb, server_stack
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "p50": round(percentile(samples, 50), 2) if samples else None,
+        "p90": round(percentile(samples, 90), 2) if samples else None,
+        "p99": round(percentile(samples, 99), 2) if samples else None,
+        "max": round(samples[-1], 2) if samples else None,
+    }
+
+
+class Recorder:
+    """Collects request timings and bytes for one scenario"""
+
+    def __init__(self):
+        self.latency_ms = []
+        self.ttfb_ms = []
+        self.bytes = 0
+        self.errors = 0
+
+    async def request(self, session, url, headers=None):
+        started = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as response:
+                self.ttfb_ms.append((time.perf_counter() - started) * 1000)
+                if response.status >= 400:
+                    self.errors += 1
+                async for chunk in response.content.iter_any():
+                    self.bytes += len(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.errors += 1
+            return
+        self.latency_ms.append((time.perf_counter() - started) * 1000)
+
+
+async def sample_rss(pid, samples, stop):
+    while not stop.is_set():
+        rss = read_rss_mb(pid)
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), 0.2)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_scenario(name, api_url, pid, clients, duration, make_request):
+    """Run make_request(session, recorder, client, rng) in a loop on every client for duration seconds"""
+    recorder = Recorder()
+    rss = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(pid, rss, stop))
+    deadline = time.monotonic() + duration
+
+    async def client(index):
+        rng = random.Random(f"{name}-{index}")
+        while time.monotonic() < deadline:
+            await make_request(session, recorder, index, rng)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+    started = time.perf_counter()
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(client(index) for index in range(clients)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+    result = {
+        "clients": clients,
+        "requests": len(recorder.latency_ms),
+        "errors": recorder.errors,
+        "requests_per_s": round(len(recorder.latency_ms) / elapsed, 2),
+        "throughput_mb_s": round(recorder.bytes / elapsed / 2 ** 20, 2),
+        "latency_ms": summarize(recorder.latency_ms),
+        "ttfb_ms": summarize(recorder.ttfb_ms),
+        "rss_mb": {
+            "start": round(rss[0], 1) if rss else None,
+            "peak": round(max(rss), 1) if rss else None,
+            "end": round(rss[-1], 1) if rss else None,
+        },
+    }
+    print(f"{name}: {json.dumps(result)}", file=sys.stderr)
+    return result
+
+
+def listing_scenario(api_url):
+    async def make_request(session, recorder, client, rng):
+        await recorder.request(session, f"{api_url}/folders?recursive=true")
+    return make_request
+
+
+def seek_scenario(api_url, file_size, read_bytes, files):
+    async def make_request(session, recorder, client, rng):
+        start = rng.randrange(0, max(1, file_size - read_bytes))
+        url = f"{api_url}/stream/Films/movie-{rng.randrange(files)}.mkv"
+        await recorder.request(session, url, {"Range": f"bytes={start}-{start + read_bytes - 1}"})
+    return make_request
+
+
+def sequential_scenario(api_url, read_bytes):
+    async def make_request(session, recorder, client, rng):
+        url = f"{api_url}/stream/Films/sequential-{client}.mkv"
+        await recorder.request(session, url, {"Range": f"bytes=0-{read_bytes - 1}"})
+    return make_request
+
+
+def make_mount(args):
+    """Write the movies the scenarios read as sparse files, laid out like the stub NAS share"""
+    root = tempfile.mkdtemp(prefix="nas-mount-")
+    films = os.path.join(root, "Films")
+    os.mkdir(films)
+    names = [f"movie-{i}.mkv" for i in range(args.files)] + [f"sequential-{i}.mkv" for i in range(args.clients)]
+    for name in names:
+        with open(os.path.join(films, name), "wb") as movie:
+            movie.truncate(args.file_size)
+    return root
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Relative change (%) of each scenario figure against a baseline report"""
+    def delta(new, old):
+        if not isinstance(new, (int, float)) or not isinstance(old, (int, float)) or not old:
+            return None
+        return round((new - old) / old * 100, 1)
+
+    changes = {}
+    for name, result in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        changes[name] = {
+            "requests_per_s": delta(result["requests_per_s"], old["requests_per_s"]),
+            "throughput_mb_s": delta(result["throughput_mb_s"], old["throughput_mb_s"]),
+            "latency_p50": delta(result["latency_ms"]["p50"], old["latency_ms"]["p50"]),
+            "latency_p99": delta(result["latency_ms"]["p99"], old["latency_ms"]["p99"]),
+            "rss_peak": delta(result["rss_mb"]["peak"], old["rss_mb"]["peak"]),
+        }
+    return changes
+
+
+async def main(args):
+    nas_args = [
+        "--file-size", str(args.file_size),
+        "--listing-size", str(args.listing_size),
+        "--folders", str(args.folders),
+        "--latency-ms", str(args.latency_ms),
+    ]
+    if args.bandwidth_mbit:
+        nas_args += ["--bandwidth-mbit", str(args.bandwidth_mbit)]
+    if args.total_bandwidth_mbit:
+        nas_args += ["--total-bandwidth-mbit", str(args.total_bandwidth_mbit)]
+    env = {"CHUNK_CACHE_MAX_BYTES": str(args.cache_mb * 1024 * 1024)}
+    mount = make_mount(args) if args.mount else None
+    if mount:
+        env["NAS_MOUNT_ROOT"] = mount
+
+    scenarios = {
+        "listing": lambda api_url: listing_scenario(api_url),
+        "seek": lambda api_url: seek_scenario(api_url, args.file_size, args.seek_kb * 1024, args.files),
+        "sequential": lambda api_url: sequential_scenario(api_url, args.sequential_mb * 2 ** 20),
+    }
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "scenarios": {},
+    }
+    try:
+        async with server_stack(nas_args, env) as (api_url, server):
+            for name in args.scenarios:
+                report["scenarios"][name] = await run_scenario(
+                    name, api_url, server.pid, args.clients, args.duration, scenarios[name](api_url)
+                )
+    finally:
+        if mount:
+            shutil.rmtree(mount, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            report["change_vs_baseline_percent"] = compare(report, json.load(baseline))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as report_file:
+            report_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Listing, seek and sequential streaming benchmarks")
+    parser.add_argument("--scenarios", type=lambda v: v.split(","), default=["listing", "seek", "sequential"])
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients per scenario")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--file-size", type=int, default=1024 ** 3, help="size of every stub movie")
+    parser.add_argument("--files", type=int, default=16, help="distinct movies hit by the seek scenario")
+    parser.add_argument("--seek-kb", type=int, default=512, help="bytes read after each seek")
+    parser.add_argument("--sequential-mb", type=int, default=64, help="bytes read by each sequential request")
+    parser.add_argument("--listing-size", type=int, default=2000, help="files in every stub folder")
+    parser.add_argument("--folders", type=int, default=4, help="subfolders in every stub share")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="stub NAS delay before every response")
+    parser.add_argument("--bandwidth-mbit", type=float, default=None, help="stub NAS limit per response")
+    parser.add_argument("--total-bandwidth-mbit", type=float, default=None, help="stub NAS limit for all responses")
+    parser.add_argument("--cache-mb", type=int, default=0, help="range cache budget; 0 measures the plain proxy")
+    parser.add_argument("--mount", action="store_true", help="serve movies from a local directory, not the stub NAS")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,235 @@
+"""
+In-memory search index over the movie catalog
+Movie names are folded (case, accents, ligatures), split into words and
+stripped of the release tags that follow the title (1080p, x264, FRENCH...). Each word maps to the
+entries holding it, and each bigram of a word to the words holding it, so a
+query word is matched exactly, as a prefix (type-ahead) or within a small
+edit distance (typos) without scanning the catalog.
+
+No app dependencies; SearchIndex is updated incrementally as entries change.
+"""
+
+import bisect
+import re
+import unicodedata
+
+# Release tags that never belong to a title: the first one starts the tag tail
+TAG_WORDS = {
+    "480p", "576p", "720p", "1080p", "1080i", "2160p", "hdr10",
+    "x264", "x265", "h264", "h265", "hevc", "xvid", "divx", "av1", "10bit", "8bit",
+    "bluray", "bdrip", "brrip", "bdremux", "remux", "dvdrip", "dvdscr", "webrip", "webdl",
+    "hdtv", "hdrip", "hdlight", "tvrip", "aac", "ac3", "eac3", "dts", "dtshd", "truehd",
+    "vff", "vfq", "vfi", "vostfr", "subfrench", "truefrench",
+    "mkv", "mp4", "avi", "mov", "wmv", "flv", "webm", "m4v",
+}
+# Resolution, codec, source, audio and language tags, dropped from the tag tail only:
+# many are also title words (The French Connection, Charlotte's Web, Extended Stay)
+NOISE_WORDS = TAG_WORDS | {
+    "4k", "uhd", "hd", "fhd", "sd", "hdr", "dv", "avc", "web", "dl", "dvd", "mhd", "cam", "ts",
+    "repack", "proper", "extended", "unrated", "mp3", "flac", "opus", "ddp", "dd", "atmos",
+    "multi", "vf", "vo", "vost", "french", "fr",
+}
+LIGATURES = str.maketrans({"œ": "oe", "æ": "ae", "ß": "ss", "ø": "o", "ł": "l", "đ": "d"})
+WORD_RE = re.compile(r"[a-z0-9]+")
+EXTENSION_RE = re.compile(r"\.[A-Za-z0-9]{2,4}$")
+
+# Query words this short, and numbers, are only matched exactly or as a prefix
+FUZZY_MIN_LENGTH = 4
+# Prefix matches considered per query word, so a one-letter prefix stays cheap
+MAX_PREFIX_WORDS = 512
+
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.75
+FUZZY_WEIGHT = 0.5
+
+
+def fold(text):
+    """Lowercase text and strip its accents, e.g. 'Amélie Œuvre' -> 'amelie oeuvre'"""
+    text = text.lower().translate(LIGATURES)
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def words(text):
+    """Every folded word of a text, noise included, e.g. 'L'Été 1080p' -> ['l', 'ete', '1080p']"""
+    return WORD_RE.findall(fold(text))
+
+
+def is_year(word):
+    return len(word) == 4 and word.isdigit() and 1900 <= int(word) <= 2099
+
+
+def tokenize(text):
+    """Return the searchable words of a name or query, in order
+
+    Noise words are only dropped from the tag tail, which starts at the first
+    tag word or at a year following a title word.
+    """
+    tokens = []
+    tail = False
+    for word in words(text):
+        if not tail and (word in TAG_WORDS or (tokens and is_year(word))):
+            tail = True
+        if (tail and word in NOISE_WORDS) or (len(word) == 1 and word.isalpha()):
+            continue
+        tokens.append(word)
+    return tokens
+
+
+def name_words(name):
+    """Words of a movie file name, without its extension"""
+    return tokenize(EXTENSION_RE.sub("", name))
+
+
+def bigrams(word):
+    padded = f"^{word}$"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def max_typos(word):
+    if len(word) < FUZZY_MIN_LENGTH or word.isdigit():
+        return 0
+    return 1 if len(word) < 8 else 2
+
+
+def within_distance(a, b, limit):
+    """Whether the edit distance (with adjacent transpositions) of a and b is at most limit"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return False
+        previous2, previous = previous, current
+    return previous[-1] <= limit
+
+
+class SearchEntry:
+    __slots__ = ("id", "sort_key", "words", "folders")
+
+    def __init__(self, doc):
+        self.id = doc["id"]
+        self.sort_key = fold(doc.get("name") or "")
+        self.words = name_words(doc.get("name") or "")
+        self.folders = frozenset(doc.get("folders") or ())
+
+
+class SearchIndex:
+    def __init__(self):
+        self.entries = {}      # entry id -> SearchEntry
+        self.postings = {}     # word -> ids of the entries holding it
+        self.grams = {}        # bigram -> words holding it
+        self.vocabulary = []   # every indexed word, sorted for prefix lookups
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, doc):
+        """Index a catalog entry (id, name, folders), replacing an earlier version of it"""
+        self.remove(doc["id"])
+        entry = self.entries[doc["id"]] = SearchEntry(doc)
+        for word in set(entry.words):
+            ids = self.postings.get(word)
+            if ids is None:
+                ids = self.postings[word] = set()
+                bisect.insort(self.vocabulary, word)
+                for gram in bigrams(word):
+                    self.grams.setdefault(gram, set()).add(word)
+            ids.add(entry.id)
+
+    def remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for word in set(entry.words):
+            ids = self.postings[word]
+            ids.discard(entry_id)
+            if ids:
+                continue
+            del self.postings[word]
+            del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
+            for gram in bigrams(word):
+                words = self.grams[gram]
+                words.discard(word)
+                if not words:
+                    del self.grams[gram]
+
+    def matching_words(self, term):
+        """Return {indexed word: weight} for the words a query word matches"""
+        matches = {}
+        start = bisect.bisect_left(self.vocabulary, term)
+        for word in self.vocabulary[start:start + MAX_PREFIX_WORDS]:
+            if not word.startswith(term):
+                break
+            matches[word] = EXACT_WEIGHT if word == term else PREFIX_WEIGHT
+
+        limit = max_typos(term)
+        if limit:
+            # An edit (even a transposition) changes at most 3 bigrams, so words sharing
+            # fewer cannot be within limit edits
+            term_grams = bigrams(term)
+            shared = {}
+            for gram in term_grams:
+                for word in self.grams.get(gram, ()):
+                    shared[word] = shared.get(word, 0) + 1
+            needed = len(term_grams) - 3 * limit
+            for word, count in shared.items():
+                if word not in matches and count >= needed and within_distance(term, word, limit):
+                    matches[word] = FUZZY_WEIGHT
+        return matches
+
+    def term_scores(self, term):
+        """Return {entry id: weight of its best word matching term}"""
+        scores = {}
+        for word, weight in self.matching_words(term).items():
+            for entry_id in self.postings[word]:
+                if scores.get(entry_id, 0) < weight:
+                    scores[entry_id] = weight
+        return scores
+
+    def search(self, query, folder=None):
+        """Return the ids of the entries matching every word of query, best first
+
+        Noise words of the query (french, web...) are matched as title words
+        when present but not required, since release tags are not indexed; a
+        query of nothing but noise words is searched for as typed.
+        """
+        terms = [word for word in words(query) if not (len(word) == 1 and word.isalpha())]
+        required = [term for term in terms if term not in NOISE_WORDS] or terms
+        if not required:
+            return []
+
+        scores = None
+        for term in required:
+            term_scores = self.term_scores(term)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {entry_id: score + term_scores[entry_id] for entry_id, score in scores.items() if entry_id in term_scores}
+            if not scores:
+                return []
+        for term in terms:
+            if term in required:
+                continue
+            for entry_id, weight in self.term_scores(term).items():
+                if entry_id in scores:
+                    scores[entry_id] += weight
+
+        ranked = []
+        for entry_id, score in scores.items():
+            entry = self.entries[entry_id]
+            if folder is not None and folder not in entry.folders:
+                continue
+            if entry.words and entry.words[0] == terms[0]:
+                # Titles starting with the query come first
+                score += 0.5
+            # Of equal matches, the one with fewest other words is the closest
+            score -= 0.01 * len(entry.words)
+            ranked.append((-score, entry.sort_key, entry_id))
+        ranked.sort()
+        return [entry_id for _, _, entry_id in ranked]
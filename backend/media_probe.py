@@ -0,0 +1,469 @@
+"""
+Container header parsing for NAS movie files
+Pure functions with no app dependencies, so they can run in a process pool.
+
+probe_media() works on the byte windows read so far ({offset: bytes}) and
+either returns the media details or asks for more ranges to be read.
+"""
+
+import struct
+import uuid
+
+MP4_FORMATS = {"mp4", "m4v", "mov"}
+MATROSKA_FORMATS = {"mkv", "webm"}
+AVI_FORMATS = {"avi"}
+ASF_FORMATS = {"wmv", "asf"}
+
+# moov atoms larger than this are not worth reading for a few header fields
+MAX_MOOV_SIZE = 16 * 1024 * 1024
+MAX_ELEMENT_SIZE = 4 * 1024 * 1024
+
+CODEC_NAMES = {
+    "avc1": "h264", "avc3": "h264", "h264": "h264", "x264": "h264", "v_mpeg4/iso/avc": "h264",
+    "hvc1": "hevc", "hev1": "hevc", "hevc": "hevc", "h265": "hevc", "v_mpegh/iso/hevc": "hevc",
+    "mp4v": "mpeg4", "xvid": "mpeg4", "divx": "mpeg4", "dx50": "mpeg4", "fmp4": "mpeg4",
+    "v_mpeg4/iso/asp": "mpeg4", "v_mpeg4/iso/sp": "mpeg4",
+    "v_mpeg2": "mpeg2", "mpg2": "mpeg2",
+    "vp09": "vp9", "v_vp9": "vp9", "v_vp8": "vp8",
+    "av01": "av1", "v_av1": "av1",
+    "mp4a": "aac", "a_aac": "aac", "a_aac/mpeg4/lc": "aac", "a_aac/mpeg2/lc": "aac",
+    "ac-3": "ac3", "a_ac3": "ac3", "ec-3": "eac3", "a_eac3": "eac3",
+    "a_dts": "dts", "dtsc": "dts",
+    "a_mpeg/l3": "mp3", ".mp3": "mp3", "a_mpeg/l2": "mp2",
+    "opus": "opus", "a_opus": "opus", "a_vorbis": "vorbis",
+    "a_flac": "flac", "flac": "flac",
+    "a_truehd": "truehd",
+    "wvc1": "vc1", "wmva": "vc1",
+}
+
+# WAVEFORMATEX format tags found in AVI and ASF audio streams
+WAVE_FORMATS = {
+    0x0001: "pcm", 0x0050: "mp2", 0x0055: "mp3", 0x00FF: "aac", 0x2000: "ac3", 0x2001: "dts",
+    0x0160: "wmav1", 0x0161: "wmav2", 0x0162: "wmapro", 0x0163: "wmalossless",
+}
+
+
+class NeedMore(Exception):
+    """Raised by a parser that needs another byte range of the file"""
+
+    def __init__(self, offset, length):
+        super().__init__(offset, length)
+        self.offset = offset
+        self.length = length
+
+
+def codec_name(raw):
+    raw = raw.strip("\x00 ").lower()
+    return CODEC_NAMES.get(raw, raw or None)
+
+
+def header_length(size, offset):
+    """Bytes worth reading for an element header at offset, up to the end when the size is known"""
+    return 16 if size is None else min(16, size - offset)
+
+
+def read_window(windows, offset, length):
+    """Return length bytes at offset from the windows read so far, or ask for them"""
+    for start, data in windows.items():
+        if start <= offset and offset + length <= start + len(data):
+            return data[offset - start:offset - start + length]
+    raise NeedMore(offset, length)
+
+
+def probe_media(file_format, size, windows):
+    """Return {"media": {...}} or {"need": (offset, length)} for a file's header windows"""
+    file_format = (file_format or "").lower()
+    try:
+        if file_format in MP4_FORMATS:
+            media = parse_mp4(size, windows)
+        elif file_format in MATROSKA_FORMATS:
+            media = parse_matroska(size, windows)
+        elif file_format in AVI_FORMATS:
+            media = parse_avi(windows)
+        elif file_format in ASF_FORMATS:
+            media = parse_asf(windows)
+        else:
+            media = {}
+    except NeedMore as e:
+        return {"need": (e.offset, e.length)}
+    except Exception:
+        # Whatever a corrupt or unexpected header trips over, the file is just unparseable
+        media = {}
+
+    if media.get("duration") and size:
+        media["bitrate"] = int(size * 8 / media["duration"])
+    return {"media": media}
+
+
+# MP4 / QuickTime
+
+def iter_atoms(data, start=0, end=None):
+    """Yield (type, body start, body end) for the atoms in data[start:end]"""
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        atom_size, atom_type = struct.unpack_from(">I4s", data, position)
+        header = 8
+        if atom_size == 1:
+            atom_size = struct.unpack_from(">Q", data, position + 8)[0]
+            header = 16
+        elif atom_size == 0:
+            atom_size = end - position
+        if atom_size < header:
+            return
+        yield atom_type.decode("latin-1"), position + header, min(position + atom_size, end)
+        position += atom_size
+
+
+def find_atom(data, path, start=0, end=None):
+    """Return (body start, body end) of the first atom along path, e.g. ["mdia", "hdlr"]"""
+    for atom_type, body_start, body_end in iter_atoms(data, start, end):
+        if atom_type == path[0]:
+            if len(path) == 1:
+                return body_start, body_end
+            found = find_atom(data, path[1:], body_start, body_end)
+            if found:
+                return found
+    return None
+
+
+def parse_mp4(size, windows):
+    # Walk the top-level atoms with small reads until moov turns up; files that
+    # were not "fast-started" keep it after the multi-gigabyte mdat
+    position = 0
+    while size is None or position < size:
+        header = read_window(windows, position, header_length(size, position))
+        atom_size, atom_type = struct.unpack_from(">I4s", header)
+        header_size = 8
+        if atom_size == 1:
+            atom_size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif atom_size == 0:
+            if size is None:
+                # Runs to the end of a file of unknown size: nothing follows it
+                break
+            atom_size = size - position
+        if atom_size < header_size:
+            break
+        if atom_type == b"moov":
+            if atom_size > MAX_MOOV_SIZE:
+                return {}
+            moov = read_window(windows, position, atom_size)
+            return parse_moov(moov, header_size)
+        position += atom_size
+    return {}
+
+
+def parse_moov(moov, start):
+    media = {}
+    mvhd = find_atom(moov, ["mvhd"], start)
+    if mvhd:
+        body = mvhd[0]
+        if moov[body] == 1:
+            timescale, duration = struct.unpack_from(">IQ", moov, body + 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", moov, body + 12)
+        if timescale:
+            media["duration"] = round(duration / timescale, 3)
+
+    for atom_type, body_start, body_end in iter_atoms(moov, start):
+        if atom_type != "trak":
+            continue
+        hdlr = find_atom(moov, ["mdia", "hdlr"], body_start, body_end)
+        stsd = find_atom(moov, ["mdia", "minf", "stbl", "stsd"], body_start, body_end)
+        if not hdlr or not stsd:
+            continue
+        handler = moov[hdlr[0] + 8:hdlr[0] + 12]
+        entry = stsd[0] + 8  # version/flags, entry count
+        codec = codec_name(moov[entry + 4:entry + 8].decode("latin-1"))
+        if handler == b"vide" and "video_codec" not in media:
+            media["video_codec"] = codec
+            media["width"], media["height"] = struct.unpack_from(">HH", moov, entry + 32)
+        elif handler == b"soun" and "audio_codec" not in media:
+            media["audio_codec"] = codec
+    return media
+
+
+# Matroska / WebM (EBML)
+
+EBML_SEGMENT = 0x18538067
+EBML_SEEK_HEAD = 0x114D9B74
+EBML_SEEK = 0x4DBB
+EBML_SEEK_ID = 0x53AB
+EBML_SEEK_POSITION = 0x53AC
+EBML_INFO = 0x1549A966
+EBML_TIMECODE_SCALE = 0x2AD7B1
+EBML_DURATION = 0x4489
+EBML_TRACKS = 0x1654AE6B
+EBML_TRACK_ENTRY = 0xAE
+EBML_TRACK_TYPE = 0x83
+EBML_CODEC_ID = 0x86
+EBML_VIDEO = 0xE0
+EBML_PIXEL_WIDTH = 0xB0
+EBML_PIXEL_HEIGHT = 0xBA
+EBML_CLUSTER = 0x1F43B675
+
+
+def read_vint(data, position, keep_marker=False):
+    """Read an EBML variable-length integer, returning (value, length, unknown size)"""
+    first = data[position]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError("Invalid EBML variable-length integer")
+    if len(data) < position + length:
+        raise IndexError("Truncated EBML integer")
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[position + 1:position + length]:
+        value = (value << 8) | byte
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, length, unknown
+
+
+def iter_elements(data, start, end):
+    """Yield (id, element start, body start, body end) for the EBML elements in data[start:end]
+
+    body end is not clipped to the data, so callers can tell a truncated element.
+    """
+    position = start
+    while position < end:
+        element_id, id_length, _ = read_vint(data, position, keep_marker=True)
+        element_size, size_length, unknown = read_vint(data, position + id_length)
+        body_start = position + id_length + size_length
+        body_end = end if unknown else body_start + element_size
+        yield element_id, position, body_start, body_end
+        if unknown:
+            return
+        position = body_end
+
+
+def read_uint(data, start, end):
+    return int.from_bytes(data[start:end], "big")
+
+
+def read_float(data, start, end):
+    return struct.unpack(">f" if end - start == 4 else ">d", data[start:end])[0]
+
+
+def read_element(windows, offset, element_start, body_start, body_end):
+    """Return (data, body start, body end) of a whole element, asking for it if the windows cut it"""
+    if body_end - element_start > MAX_ELEMENT_SIZE:
+        raise ValueError("EBML element too large to probe")
+    data = read_window(windows, offset, body_end - element_start)
+    return data, body_start - element_start, body_end - element_start
+
+
+def parse_matroska(size, windows):
+    head = windows.get(0, b"")
+    segment_start = None
+    for element_id, _, body_start, _ in iter_elements(head, 0, len(head)):
+        if element_id == EBML_SEGMENT:
+            segment_start = body_start
+            break
+    if segment_start is None:
+        return {}
+
+    sections = {}
+    seek_positions = {}
+    try:
+        for element_id, element_start, body_start, body_end in iter_elements(head, segment_start, len(head)):
+            if element_id == EBML_CLUSTER:
+                break
+            if element_id == EBML_SEEK_HEAD:
+                data, start, end = read_element(windows, element_start, element_start, body_start, body_end)
+                seek_positions.update(parse_seek_head(data, start, end))
+            elif element_id in (EBML_INFO, EBML_TRACKS):
+                sections[element_id] = read_element(windows, element_start, element_start, body_start, body_end)
+    except IndexError:
+        # The head window ends inside an element header; the rest is found through the SeekHead
+        pass
+
+    # Info/Tracks placed after the first clusters are found through the SeekHead
+    for element_id in (EBML_INFO, EBML_TRACKS):
+        if element_id in sections or element_id not in seek_positions:
+            continue
+        offset = segment_start + seek_positions[element_id]
+        header = read_window(windows, offset, header_length(size, offset))
+        found_id, _, body_start, body_end = next(iter_elements(header, 0, len(header)))
+        if found_id == element_id:
+            sections[element_id] = read_element(windows, offset, 0, body_start, body_end)
+
+    media = {}
+    if EBML_INFO in sections:
+        data, body_start, body_end = sections[EBML_INFO]
+        timecode_scale = 1000000
+        duration = None
+        for element_id, _, start, end in iter_elements(data, body_start, body_end):
+            if element_id == EBML_TIMECODE_SCALE:
+                timecode_scale = read_uint(data, start, end)
+            elif element_id == EBML_DURATION:
+                duration = read_float(data, start, end)
+        if duration:
+            media["duration"] = round(duration * timecode_scale / 1e9, 3)
+
+    if EBML_TRACKS in sections:
+        data, body_start, body_end = sections[EBML_TRACKS]
+        for element_id, _, start, end in iter_elements(data, body_start, body_end):
+            if element_id == EBML_TRACK_ENTRY:
+                parse_track_entry(data, start, end, media)
+    return media
+
+
+def parse_seek_head(data, start, end):
+    positions = {}
+    for element_id, _, seek_start, seek_end in iter_elements(data, start, end):
+        if element_id != EBML_SEEK:
+            continue
+        seek_id = seek_position = None
+        for child_id, _, child_start, child_end in iter_elements(data, seek_start, seek_end):
+            if child_id == EBML_SEEK_ID:
+                seek_id = read_uint(data, child_start, child_end)
+            elif child_id == EBML_SEEK_POSITION:
+                seek_position = read_uint(data, child_start, child_end)
+        if seek_id is not None and seek_position is not None:
+            positions.setdefault(seek_id, seek_position)
+    return positions
+
+
+def parse_track_entry(data, start, end, media):
+    track_type = codec = None
+    width = height = None
+    for element_id, _, child_start, child_end in iter_elements(data, start, end):
+        if element_id == EBML_TRACK_TYPE:
+            track_type = read_uint(data, child_start, child_end)
+        elif element_id == EBML_CODEC_ID:
+            codec = codec_name(data[child_start:child_end].decode("latin-1"))
+        elif element_id == EBML_VIDEO:
+            for video_id, _, video_start, video_end in iter_elements(data, child_start, child_end):
+                if video_id == EBML_PIXEL_WIDTH:
+                    width = read_uint(data, video_start, video_end)
+                elif video_id == EBML_PIXEL_HEIGHT:
+                    height = read_uint(data, video_start, video_end)
+    if track_type == 1 and "video_codec" not in media:
+        media["video_codec"] = codec
+        if width and height:
+            media["width"], media["height"] = width, height
+    elif track_type == 2 and "audio_codec" not in media:
+        media["audio_codec"] = codec
+
+
+# AVI (RIFF)
+
+def iter_chunks(data, start, end):
+    """Yield (fourcc, list type or None, body start, body end) for RIFF chunks
+
+    body end is not clipped to the data, so callers can tell a truncated chunk.
+    """
+    position = start
+    while position + 8 <= end:
+        fourcc, chunk_size = struct.unpack_from("<4sI", data, position)
+        body_start = position + 8
+        body_end = body_start + chunk_size
+        list_type = None
+        if fourcc in (b"RIFF", b"LIST"):
+            list_type = data[body_start:body_start + 4]
+            body_start += 4
+        yield fourcc, list_type, body_start, body_end
+        position += 8 + chunk_size + (chunk_size & 1)
+
+
+def parse_avi(windows):
+    data = windows.get(0, b"")
+    if data[:4] != b"RIFF" or data[8:12] != b"AVI ":
+        return {}
+    media = {}
+    for fourcc, list_type, start, end in iter_chunks(data, 12, len(data)):
+        if list_type != b"hdrl":
+            continue
+        if end > len(data):
+            if end > MAX_ELEMENT_SIZE:
+                return {}
+            raise NeedMore(0, end)
+        for fourcc, list_type, body_start, body_end in iter_chunks(data, start, end):
+            if fourcc == b"avih":
+                usec_per_frame, = struct.unpack_from("<I", data, body_start)
+                total_frames, = struct.unpack_from("<I", data, body_start + 16)
+                media["width"], media["height"] = struct.unpack_from("<II", data, body_start + 32)
+                if usec_per_frame and total_frames:
+                    media["duration"] = round(total_frames * usec_per_frame / 1e6, 3)
+            elif list_type == b"strl":
+                parse_stream_list(data, body_start, body_end, media)
+        break
+    return media
+
+
+def parse_stream_list(data, start, end, media):
+    stream_type = handler = None
+    for fourcc, _, body_start, body_end in iter_chunks(data, start, end):
+        if fourcc == b"strh":
+            stream_type = data[body_start:body_start + 4]
+            handler = data[body_start + 4:body_start + 8].decode("latin-1")
+        elif fourcc == b"strf" and stream_type == b"vids" and "video_codec" not in media:
+            # BITMAPINFOHEADER.biCompression names the codec more reliably than the handler
+            compression = data[body_start + 16:body_start + 20].decode("latin-1")
+            media["video_codec"] = codec_name(compression) or codec_name(handler)
+        elif fourcc == b"strf" and stream_type == b"auds" and "audio_codec" not in media:
+            format_tag, = struct.unpack_from("<H", data, body_start)
+            media["audio_codec"] = WAVE_FORMATS.get(format_tag, f"0x{format_tag:04x}")
+
+
+# ASF (WMV)
+
+def asf_guid(text):
+    # GUIDs are stored with their first three fields little-endian
+    return uuid.UUID(text).bytes_le
+
+
+ASF_HEADER = asf_guid("75B22630-668E-11CF-A6D9-00AA0062CE6C")
+ASF_FILE_PROPERTIES = asf_guid("8CABDCA1-A947-11CF-8EE4-00C00C205365")
+ASF_STREAM_PROPERTIES = asf_guid("B7DC0791-A9B7-11CF-8EE6-00C00C205365")
+ASF_VIDEO_MEDIA = asf_guid("BC19EFC0-5B4D-11CF-A8FD-00805F5C442B")
+ASF_AUDIO_MEDIA = asf_guid("F8699E40-5B4D-11CF-A8FD-00805F5C442B")
+
+
+def parse_asf(windows):
+    data = windows.get(0, b"")
+    if data[:16] != ASF_HEADER:
+        return {}
+    header_size, object_count = struct.unpack_from("<QI", data, 16)
+    if header_size > len(data):
+        if header_size > MAX_ELEMENT_SIZE:
+            return {}
+        raise NeedMore(0, header_size)
+    media = {}
+    position = 30
+    for _ in range(object_count):
+        if position + 24 > header_size:
+            break
+        guid, object_size = data[position:position + 16], struct.unpack_from("<Q", data, position + 16)[0]
+        if object_size < 24:
+            break
+        body = position + 24
+        if guid == ASF_FILE_PROPERTIES:
+            # Play duration in 100 ns units, including the preroll given in ms
+            play_duration, = struct.unpack_from("<Q", data, body + 40)
+            preroll, = struct.unpack_from("<Q", data, body + 56)
+            if play_duration:
+                media["duration"] = round(max(play_duration / 1e7 - preroll / 1000, 0), 3)
+        elif guid == ASF_STREAM_PROPERTIES:
+            parse_asf_stream(data, body, media)
+        position += object_size
+    return media
+
+
+def parse_asf_stream(data, start, media):
+    stream_type = data[start:start + 16]
+    type_data = start + 54
+    if stream_type == ASF_VIDEO_MEDIA and "video_codec" not in media:
+        width, height = struct.unpack_from("<II", data, type_data)
+        if width and height:
+            media["width"], media["height"] = width, height
+        # A BITMAPINFOHEADER follows the image size, flags and format data size
+        compression = data[type_data + 27:type_data + 31].decode("latin-1")
+        media["video_codec"] = codec_name(compression)
+    elif stream_type == ASF_AUDIO_MEDIA and "audio_codec" not in media:
+        format_tag, = struct.unpack_from("<H", data, type_data)
+        media["audio_codec"] = WAVE_FORMATS.get(format_tag, f"0x{format_tag:04x}")
@@ -0,0 +1,187 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format
+Counters, gauges and histograms with labels, kept in plain dicts; no client
+library needed, and cheap enough to update on every streamed chunk. Processes
+serving one endpoint can swap snapshots and render them all, each series
+labelled with the worker it comes from.
+"""
+
+import copy
+import math
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def series(self):
+        """Return a copy of the values, by label values"""
+        with self.lock:
+            return copy.deepcopy(self.values)
+
+    def samples(self, values):
+        """Yield (suffix, label values, extra labels, value) for every series"""
+        for key, value in sorted(values.items()):
+            yield "", key, (), value
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def sample_lines(self, values, worker=None):
+        names = self.label_names
+        if worker is not None:
+            names += ("worker",)
+        lines = []
+        for suffix, key, extra, value in self.samples(values):
+            if worker is not None:
+                key += (worker,)
+            lines.append(f"{self.name}{suffix}{format_labels(names, key, extra)} {format_value(value)}")
+        return lines
+
+    def render(self):
+        return "\n".join(self.header() + self.sample_lines(self.series()))
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self, values):
+        for key, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                yield "_bucket", key, (("le", format_value(float(bound))),), cumulative
+            yield "_sum", key, (), series["sum"]
+            yield "_count", key, (), series["count"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+    def snapshot(self):
+        """Return every series as JSON-serializable data, for render_workers in another process"""
+        return {name: [[list(key), value] for key, value in metric.series().items()] for name, metric in self.metrics.items()}
+
+    def render_workers(self, snapshots):
+        """Render the snapshots of several workers, {worker: snapshot}, each series labelled with its worker"""
+        parts = []
+        for name, metric in self.metrics.items():
+            lines = metric.header()
+            for worker, snapshot in sorted(snapshots.items()):
+                values = {tuple(key): value for key, value in snapshot.get(name, [])}
+                lines += metric.sample_lines(values, worker)
+            parts.append("\n".join(lines))
+        return "\n".join(parts) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=()):
+    return REGISTRY.register(Counter(name, documentation, labels))
+
+
+def gauge(name, documentation, labels=()):
+    return REGISTRY.register(Gauge(name, documentation, labels))
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
+
+
+def render():
+    return REGISTRY.render()
+
+
+def snapshot():
+    return REGISTRY.snapshot()
+
+
+def render_workers(snapshots):
+    return REGISTRY.render_workers(snapshots)
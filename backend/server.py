@@ -5,19 +5,37 @@ from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
-import requests
 import aiohttp
 import asyncio
+import time
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import urllib.parse
 import json
 import re
-from requests.auth import HTTPBasicAuth
+import html
+import codecs
 import base64
+import hashlib
+import mmap
+import fcntl
+import math
+import itertools
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict, deque
+from functools import partial
+from contextlib import asynccontextmanager
+from pymongo import UpdateOne, DeleteOne, DeleteMany, ReturnDocument
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from abc import ABC, abstractmethod
+import catalog_search
+import media_probe
+import metrics
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -28,10 +46,117 @@ client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
 # NAS Configuration
-NAS_IP = "192.168.1.152"
-NAS_USERNAME = "admin"
-NAS_PASSWORD = "sinnss"
-NAS_BASE_URL = f"http://{NAS_IP}"
+NAS_IP = os.environ.get('NAS_IP', "192.168.1.152")
+NAS_USERNAME = os.environ.get('NAS_USERNAME', "admin")
+NAS_PASSWORD = os.environ.get('NAS_PASSWORD', "sinnss")
+NAS_BASE_URL = os.environ.get('NAS_BASE_URL', f"http://{NAS_IP}")
+
+# Streaming proxy tuning
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 256 * 1024))
+NAS_POOL_SIZE = int(os.environ.get('NAS_POOL_SIZE', 32))
+NAS_KEEPALIVE_TIMEOUT = float(os.environ.get('NAS_KEEPALIVE_TIMEOUT', 60))
+NAS_DNS_TTL = int(os.environ.get('NAS_DNS_TTL', 300))
+
+# Optional local mount of the NAS shares (CIFS/NFS), e.g. /mnt/nas holding Films/, Movies/...
+# Listings and movie bytes are read from it while it answers, over HTTP otherwise
+NAS_MOUNT_ROOT = os.environ.get('NAS_MOUNT_ROOT')
+NAS_MOUNT_CHECK_INTERVAL = float(os.environ.get('NAS_MOUNT_CHECK_INTERVAL', 10))
+NAS_MOUNT_TIMEOUT = float(os.environ.get('NAS_MOUNT_TIMEOUT', 5))
+NAS_MOUNT_READ_SIZE = int(os.environ.get('NAS_MOUNT_READ_SIZE', 1024 * 1024))
+
+# NAS health monitor and circuit breaker
+NAS_HEALTH_INTERVAL = float(os.environ.get('NAS_HEALTH_INTERVAL', 15))
+NAS_HEALTH_TIMEOUT = float(os.environ.get('NAS_HEALTH_TIMEOUT', 5))
+NAS_BREAKER_THRESHOLD = int(os.environ.get('NAS_BREAKER_THRESHOLD', 3))
+NAS_BREAKER_COOLDOWN = float(os.environ.get('NAS_BREAKER_COOLDOWN', 30))
+
+# NAS access discovery
+NAS_ACCESS_TTL = float(os.environ.get('NAS_ACCESS_TTL', 1800))
+NAS_LOGIN_TTL = float(os.environ.get('NAS_LOGIN_TTL', 900))
+LISTING_CHUNK_SIZE = 64 * 1024
+
+# Folder discovery
+DEFAULT_NAS_SHARES = ("Films", "Movies", "Videos")
+NAS_SCAN_CONCURRENCY = int(os.environ.get('NAS_SCAN_CONCURRENCY', 4))
+NAS_SCAN_MAX_DEPTH = int(os.environ.get('NAS_SCAN_MAX_DEPTH', 8))
+
+# Local caches
+CACHE_DIR = Path(os.environ.get('CACHE_DIR', ROOT_DIR / 'cache'))
+CHUNK_CACHE_BLOCK_SIZE = int(os.environ.get('CHUNK_CACHE_BLOCK_SIZE', 2 * 1024 * 1024))
+CHUNK_CACHE_MAX_BYTES = int(os.environ.get('CHUNK_CACHE_MAX_BYTES', 4 * 1024 ** 3))
+
+# File metadata (size, mtime, content type) used to answer HEAD/conditional requests
+METADATA_TTL = float(os.environ.get('METADATA_TTL', 300))
+
+# Read-ahead for sequential playback, in cache blocks
+READAHEAD_MIN_BLOCKS = int(os.environ.get('READAHEAD_MIN_BLOCKS', 2))
+READAHEAD_MAX_BLOCKS = int(os.environ.get('READAHEAD_MAX_BLOCKS', 16))
+READAHEAD_CONCURRENCY = int(os.environ.get('READAHEAD_CONCURRENCY', 4))
+READAHEAD_STALL_SECONDS = float(os.environ.get('READAHEAD_STALL_SECONDS', 0.05))
+
+# Sharing the NAS between streams: concurrent body reads, total bytes/s (0 = no
+# limit) and how far ahead of that rate a quiet period lets readers burst
+NAS_MAX_READS = int(os.environ.get('NAS_MAX_READS', 8))
+NAS_MAX_BANDWIDTH = float(os.environ.get('NAS_MAX_BANDWIDTH', 0))
+NAS_BANDWIDTH_BURST = float(os.environ.get('NAS_BANDWIDTH_BURST', 0.25))
+# Bytes a new request (start-up or seek) reads ahead of steady playback
+NAS_STARTUP_BYTES = int(os.environ.get('NAS_STARTUP_BYTES', 4 * 1024 * 1024))
+
+# Movie catalog
+CATALOG_DEFAULT_FOLDER = "Films"
+CATALOG_RESCAN_INTERVAL = float(os.environ.get('CATALOG_RESCAN_INTERVAL', 300))
+
+# Catalog change feed (/api/events)
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 256))
+EVENTS_HISTORY = int(os.environ.get('EVENTS_HISTORY', 1024))
+EVENTS_KEEPALIVE = float(os.environ.get('EVENTS_KEEPALIVE', 15))
+
+# Playback progress: player heartbeats are buffered in memory and written to
+# MongoDB in batches every PROGRESS_FLUSH_INTERVAL, or sooner past PROGRESS_MAX_PENDING
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', 10))
+PROGRESS_MAX_PENDING = int(os.environ.get('PROGRESS_MAX_PENDING', 1000))
+# Viewers whose records stay in memory, least recently active dropped first
+PROGRESS_MAX_VIEWERS = int(os.environ.get('PROGRESS_MAX_VIEWERS', 10000))
+# Positions this close to the start or the end are not worth resuming
+PROGRESS_MIN_SECONDS = float(os.environ.get('PROGRESS_MIN_SECONDS', 60))
+PROGRESS_FINISHED_RATIO = float(os.environ.get('PROGRESS_FINISHED_RATIO', 0.95))
+
+# Workers (uvicorn --workers) sharing CACHE_DIR: one is elected to run scans,
+# probes and cache eviction; catalog events, NAS health and the NAS access method
+# are shared through MongoDB, caches through CACHE_DIR. uvicorn does not tell a
+# worker how many there are, so they count each other every WORKER_CHECK_INTERVAL
+WORKER_CHECK_INTERVAL = float(os.environ.get('WORKER_CHECK_INTERVAL', 5))
+LEADER_RETRY_INTERVAL = float(os.environ.get('LEADER_RETRY_INTERVAL', 5))
+CACHE_SWEEP_INTERVAL = float(os.environ.get('CACHE_SWEEP_INTERVAL', 5))
+EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 0.5))
+EVENTS_GAP_TIMEOUT = float(os.environ.get('EVENTS_GAP_TIMEOUT', 5))
+EVENTS_RETENTION = int(os.environ.get('EVENTS_RETENTION', 86400))
+
+# Media probing (container headers read with ranged requests, parsed in worker processes)
+MEDIA_PROBE_WORKERS = int(os.environ.get('MEDIA_PROBE_WORKERS', 2))
+MEDIA_PROBE_CONCURRENCY = int(os.environ.get('MEDIA_PROBE_CONCURRENCY', 2))
+MEDIA_PROBE_HEAD_BYTES = int(os.environ.get('MEDIA_PROBE_HEAD_BYTES', 512 * 1024))
+MEDIA_PROBE_INTERVAL = float(os.environ.get('MEDIA_PROBE_INTERVAL', 60))
+
+# ffmpeg reads movies back from this API, e.g. http://127.0.0.1:8001; by default
+# from the address the thumbnail or HLS request came in on
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', "ffmpeg")
+API_SELF_URL = os.environ.get('API_SELF_URL')
+
+# Thumbnails
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+THUMBNAIL_TIMEOUT = float(os.environ.get('THUMBNAIL_TIMEOUT', 60))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+THUMBNAIL_RETRY_SECONDS = float(os.environ.get('THUMBNAIL_RETRY_SECONDS', 3600))
+THUMBNAIL_VARIANTS = {"small": 320, "poster": 640}  # name -> width in pixels
+
+# HLS packaging of files browsers cannot play directly
+HLS_SEGMENT_SECONDS = float(os.environ.get('HLS_SEGMENT_SECONDS', 6))
+HLS_MAX_JOBS = int(os.environ.get('HLS_MAX_JOBS', 2))
+HLS_SEGMENT_TIMEOUT = float(os.environ.get('HLS_SEGMENT_TIMEOUT', 120))
+HLS_READAHEAD_SEGMENTS = int(os.environ.get('HLS_READAHEAD_SEGMENTS', 2))
+HLS_CACHE_MAX_BYTES = int(os.environ.get('HLS_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+HLS_COPY_AUDIO_CODECS = set(os.environ.get('HLS_COPY_AUDIO_CODECS', "aac,mp3").split(","))
 
 # Create the main app without a prefix
 app = FastAPI(title="NAS Movie Streamer", description="Stream movies from Buffalo LinkStation")
@@ -39,143 +164,1299 @@ app = FastAPI(title="NAS Movie Streamer", description="Stream movies from Buffal
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Metrics (served by /api/metrics)
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Time until the response headers are sent, by route",
+    ("method", "route", "status"),
+)
+NAS_TTFB_SECONDS = metrics.histogram(
+    "nas_ttfb_seconds", "Time from sending a NAS request to its response headers", ("kind",)
+)
+NAS_READ_BYTES = metrics.counter("nas_read_bytes_total", "Movie bytes read from the NAS", ("kind",))
+NAS_READ_SECONDS = metrics.counter(
+    "nas_read_seconds_total", "Time spent waiting on NAS movie bodies (bytes / seconds = NAS throughput)", ("kind",)
+)
+NAS_BLOCK_THROUGHPUT = metrics.histogram(
+    "nas_block_throughput_bytes_per_second", "NAS read speed of each range cache block",
+    buckets=(1e6, 2.5e6, 5e6, 10e6, 25e6, 50e6, 100e6, 250e6),
+)
+NAS_SCHEDULER_WAIT_SECONDS = metrics.histogram(
+    "nas_scheduler_wait_seconds", "Time a NAS read waited for a read slot or bandwidth", ("priority",)
+)
+STREAM_BYTES = metrics.counter("stream_bytes_total", "Movie bytes sent to clients", ("source",))
+ACTIVE_STREAMS = metrics.gauge("active_streams", "Movie bodies being sent to clients", ("source",))
+LISTING_PARSE_SECONDS = metrics.histogram(
+    "listing_parse_seconds", "Time spent parsing one NAS folder listing, excluding network waits",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+NAS_LISTING_METHOD_SELECTED = metrics.counter(
+    "nas_listing_method_selected_total", "Listing access method that won discovery", ("method",)
+)
+CACHE_REQUESTS = metrics.counter("cache_requests_total", "Cache lookups", ("cache", "result"))
+CACHE_BYTES = metrics.gauge("cache_bytes", "Bytes held by each disk cache", ("cache",))
+EVENT_SUBSCRIBERS = metrics.gauge("event_subscribers", "Clients connected to /api/events")
+EVENTS_PUBLISHED = metrics.counter("events_published_total", "Catalog change events published", ("type",))
+SEARCH_SECONDS = metrics.histogram(
+    "search_seconds", "Time spent matching and ranking one search query in the index",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+SEARCH_INDEX_ENTRIES = metrics.gauge("search_index_entries", "Catalog entries held by the search index")
+EVENT_RESYNCS = metrics.counter("event_resyncs_total", "Clients told to reload after falling too far behind")
+NAS_UP = metrics.gauge("nas_up", "1 when the last NAS health probe got an answer")
+NAS_BREAKER_OPEN = metrics.gauge("nas_circuit_breaker_open", "1 while NAS requests are failed fast")
+NAS_MOUNT_UP = metrics.gauge("nas_mount_up", "1 while the local mount of the NAS shares answers")
+STORAGE_FALLBACKS = metrics.counter(
+    "storage_fallbacks_total", "Operations retried over HTTP after the local mount failed", ("operation",)
+)
+PROGRESS_HEARTBEATS = metrics.counter("progress_heartbeats_total", "Playback positions reported by players")
+PROGRESS_WRITES = metrics.counter("progress_writes_total", "Progress records written to MongoDB", ("operation",))
+PROGRESS_FLUSH_SECONDS = metrics.histogram(
+    "progress_flush_seconds", "Time spent writing one batch of progress records to MongoDB"
+)
+PROGRESS_PENDING = metrics.gauge("progress_pending", "Progress records changed in memory but not yet written")
+WORKER_LEADER = metrics.gauge("worker_leader", "1 in the worker elected to run scans, probes and cache sweeps")
+LIVE_WORKERS = metrics.gauge("workers", "Workers sharing CACHE_DIR, as last counted")
+
+class RequestMetricsMiddleware:
+    """Record the time to the response headers of every HTTP request, by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                route = scope.get("route")
+                HTTP_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started, method=scope["method"],
+                    route=getattr(route, "path", "unmatched"), status=status,
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
+
+async def metered_stream(chunks, source, share=None):
+    """Count the bytes and the open streams of a movie body sent to a client, closing its NAS share at the end"""
+    ACTIVE_STREAMS.inc(source=source)
+    try:
+        async for chunk in chunks:
+            STREAM_BYTES.inc(len(chunk), source=source)
+            yield chunk
+    finally:
+        ACTIVE_STREAMS.dec(source=source)
+        if share:
+            share.close()
+
 # Models
+class MediaInfo(BaseModel):
+    duration: Optional[float] = None
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    bitrate: Optional[int] = None
+
+def movie_id_for_path(path):
+    """Stable id of a NAS file, derived from its path so every listing and worker agrees on it"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"nas:{path}"))
+
 class Movie(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str
     name: str
     path: str
     size: Optional[int] = None
     format: Optional[str] = None
     thumbnail: Optional[str] = None
+    modified: Optional[datetime] = None
+    media: Optional[MediaInfo] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def derive_id(cls, data):
+        if isinstance(data, dict) and not data.get("id") and data.get("path"):
+            data = {**data, "id": movie_id_for_path(data["path"])}
+        return data
 
 class MoviesResponse(BaseModel):
     movies: List[Movie]
     total: int
+    next_cursor: Optional[str] = None
+
+class ProgressUpdate(BaseModel):
+    position: float = Field(ge=0)
+    duration: Optional[float] = Field(default=None, gt=0)
+    viewer: str = Field(default="default", min_length=1, max_length=64)
+
+class Progress(BaseModel):
+    movie_id: str
+    position: float
+    duration: Optional[float] = None
+    finished: bool = False
+    updated_at: datetime
+
+class ContinueWatching(BaseModel):
+    progress: Progress
+    movie: Movie
 
 class NASConnection(BaseModel):
     connected: bool
     message: str
+    state: Optional[str] = None
+    storage: Optional[str] = None
+    checked_at: Optional[datetime] = None
+    latency_ms: Optional[float] = None
+
+# NAS health
+# Every request made through the shared session, plus a periodic probe, feeds a
+# circuit breaker. After NAS_BREAKER_THRESHOLD failures in a row it opens and NAS
+# requests fail at once with a 503 instead of each waiting out its own timeout;
+# one trial request is let through per cooldown and the probe keeps running, so
+# the breaker closes again as soon as the NAS answers.
+class NASUnavailable(HTTPException):
+    def __init__(self, detail="NAS is unreachable"):
+        super().__init__(status_code=503, detail=detail, headers={"Retry-After": str(int(NAS_BREAKER_COOLDOWN))})
+
+class NASCircuitBreaker:
+    """Counts consecutive NAS failures and fails requests fast while the NAS is down"""
+
+    def __init__(self, threshold=NAS_BREAKER_THRESHOLD, cooldown=NAS_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+
+    @property
+    def state(self):
+        return "closed" if self.opened_at is None else "open"
+
+    def check(self):
+        """Raise NASUnavailable while open, letting one trial request through per cooldown"""
+        if self.opened_at is None:
+            return
+        now = time.monotonic()
+        if now - self.opened_at < self.cooldown:
+            raise NASUnavailable(f"NAS is unreachable: {self.last_error}")
+        self.opened_at = now
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logging.info("NAS is reachable again, closing the circuit breaker")
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.last_error = str(error) or type(error).__name__
+        if self.opened_at is None and self.failures >= self.threshold:
+            logging.warning(f"NAS failed {self.failures} times in a row, opening the circuit breaker: {self.last_error}")
+            self.opened_at = time.monotonic()
+        elif self.opened_at is not None:
+            # A trial request failed: stay open for another cooldown
+            self.opened_at = time.monotonic()
+
+nas_breaker = NASCircuitBreaker()
+nas_health = {"connected": False, "checked_at": None, "latency_ms": None, "error": None}
+nas_health_task = None
+
+async def _on_nas_request_start(session, context, params):
+    context.started = time.perf_counter()
+
+async def _on_nas_request_end(session, context, params):
+    nas_breaker.record_success()
+    kind = (context.trace_request_ctx or {}).get("kind", "other")
+    NAS_TTFB_SECONDS.observe(time.perf_counter() - context.started, kind=kind)
+
+async def _on_nas_request_exception(session, context, params):
+    if not isinstance(params.exception, asyncio.CancelledError):
+        nas_breaker.record_failure(params.exception)
 
 # Global session for NAS connection
 nas_session = None
 
-async def init_nas_connection():
-    """Initialize connection to Buffalo LinkStation"""
+def get_nas_session(fail_fast=True):
+    """Return the shared NAS session, creating its keep-alive connection pool if needed
+
+    Raises NASUnavailable while the circuit breaker is open, unless fail_fast is False.
+    """
     global nas_session
+    if fail_fast:
+        nas_breaker.check()
+    if nas_session is None or nas_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=NAS_POOL_SIZE,
+            limit_per_host=NAS_POOL_SIZE,
+            keepalive_timeout=NAS_KEEPALIVE_TIMEOUT,
+            use_dns_cache=True,
+            ttl_dns_cache=NAS_DNS_TTL,
+        )
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(_on_nas_request_start)
+        trace.on_request_end.append(_on_nas_request_end)
+        trace.on_request_exception.append(_on_nas_request_exception)
+        nas_session = aiohttp.ClientSession(connector=connector, trace_configs=[trace])
+    return nas_session
+
+async def check_nas_health():
+    """Probe the NAS web server and record whether it answers, and how fast"""
+    started = time.monotonic()
     try:
-        nas_session = aiohttp.ClientSession()
-        
-        # Test basic connectivity
-        async with nas_session.get(f"{NAS_BASE_URL}", timeout=10) as response:
-            if response.status == 200:
-                logging.info("Successfully connected to NAS")
-                return True
+        async with get_nas_session(fail_fast=False).get(
+            NAS_BASE_URL, timeout=aiohttp.ClientTimeout(total=NAS_HEALTH_TIMEOUT),
+            trace_request_ctx={"kind": "health"},
+        ) as response:
+            connected = response.status < 500
+            error = None if connected else f"HTTP {response.status}"
     except Exception as e:
-        logging.error(f"Failed to connect to NAS: {e}")
-        if nas_session:
-            await nas_session.close()
-            nas_session = None
-    return False
+        connected, error = False, str(e) or type(e).__name__
+    
+    if connected != nas_health["connected"]:
+        if connected:
+            logging.info("Successfully connected to NAS")
+        else:
+            logging.error(f"Failed to connect to NAS: {error}")
+    nas_health.update(
+        connected=connected,
+        checked_at=datetime.utcnow(),
+        latency_ms=round((time.monotonic() - started) * 1000, 1) if connected else None,
+        error=error,
+    )
+    try:
+        await shared_state.replace_one({"_id": "nas_health"}, dict(nas_health), upsert=True)
+    except Exception as e:
+        logging.error(f"Failed to share the NAS health: {e}")
+    return connected
 
-async def get_nas_file_list(folder_path="Films"):
-    """Get list of files from NAS folder"""
-    global nas_session
-    if not nas_session:
-        await init_nas_connection()
+async def follow_nas_health():
+    """Take the NAS health probed by the elected worker, probing it here when that is stale"""
+    try:
+        shared = await shared_state.find_one({"_id": "nas_health"}, {"_id": 0})
+    except Exception as e:
+        logging.error(f"Failed to read the shared NAS health: {e}")
+        shared = None
+    if not shared or datetime.utcnow() - shared["checked_at"] > timedelta(seconds=3 * NAS_HEALTH_INTERVAL):
+        return await check_nas_health()
+    if shared["checked_at"] != nas_health["checked_at"]:
+        # Counted by this worker's breaker as if it had made the probe itself
+        if shared["connected"]:
+            nas_breaker.record_success()
+        else:
+            nas_breaker.record_failure(Exception(shared["error"]))
+        nas_health.update(shared)
+    return nas_health["connected"]
+
+async def nas_health_loop():
+    """Keep probing the NAS so its health is known without waiting on it"""
+    while True:
+        await asyncio.sleep(NAS_HEALTH_INTERVAL)
+        if leadership.leader:
+            await check_nas_health()
+        else:
+            await follow_nas_health()
+
+# NAS listing access methods, in order of preference
+NAS_LISTING_URLS = {
+    "func.cgi": "{base}/cgi-bin/func.cgi?FUNC=dir&PATH=/{folder}",
+    "share": "{base}/share/{folder}",
+    "files": "{base}/files/{folder}",
+    "browse.cgi": "{base}/cgi-bin/browse.cgi?path=/{folder}",
+}
+NAS_WEB_METHOD = "web"
+# URL path each method's listings link subfolders under; the CGI listings link
+# the /share paths files are downloaded from
+NAS_LISTING_ROOTS = {"files": "/files"}
+NAS_DEFAULT_LISTING_ROOT = "/share"
+
+# Discovered access method and web login, remembered until they expire or fail
+nas_access_method = None
+nas_access_expires = 0.0
+nas_login_expires = 0.0
+nas_discovery_lock = asyncio.Lock()
+
+class NASAccessError(Exception):
+    """Raised when no access method can list a NAS folder"""
+
+async def nas_web_login():
+    """Log in to the LinkStation web interface unless the session cookie is still valid"""
+    global nas_login_expires
+    if time.monotonic() < nas_login_expires:
+        return
+    login_url = f"{NAS_BASE_URL}/cgi-bin/login.cgi"
+    login_data = {
+        "USER": NAS_USERNAME,
+        "PASS": NAS_PASSWORD,
+        "LANGUAGE": "en"
+    }
+    # The session cookie is kept in the shared session's cookie jar
+    async with get_nas_session().post(login_url, data=login_data, timeout=15) as response:
+        if response.status != 200:
+            raise NASAccessError(f"Web interface login returned HTTP {response.status}")
+    nas_login_expires = time.monotonic() + NAS_LOGIN_TTL
+
+def listing_charset(response):
+    """Return a usable charset for a listing response, defaulting to UTF-8"""
+    try:
+        return codecs.lookup(response.charset or "utf-8").name
+    except LookupError:
+        return "utf-8"
+
+async def fetch_nas_listing(method, folder_path):
+    """Fetch and parse the listing of a folder with one access method, returning its ListingParser"""
+    global nas_login_expires
+    if method == NAS_WEB_METHOD:
+        await nas_web_login()
+        url = f"{NAS_BASE_URL}/cgi-bin/func.cgi"
+        request_args = {"params": {"FUNC": "dir", "PATH": f"/{folder_path}"}}
+    else:
+        url = NAS_LISTING_URLS[method].format(base=NAS_BASE_URL, folder=folder_path)
+        request_args = {"auth": aiohttp.BasicAuth(NAS_USERNAME, NAS_PASSWORD)}
     
+    async with get_nas_session().get(
+        url, timeout=15, trace_request_ctx={"kind": "listing"}, **request_args
+    ) as response:
+        if response.status != 200:
+            if method == NAS_WEB_METHOD:
+                nas_login_expires = 0.0
+            raise NASAccessError(f"{method} returned HTTP {response.status}")
+        # Parse the listing as it arrives instead of buffering the whole page
+        parser = ListingParser(folder_path, NAS_LISTING_ROOTS.get(method, NAS_DEFAULT_LISTING_ROOT))
+        decoder = codecs.getincrementaldecoder(listing_charset(response))(errors="replace")
+        parse_seconds = 0.0
+        async for chunk in response.content.iter_chunked(LISTING_CHUNK_SIZE):
+            started = time.perf_counter()
+            parser.feed(decoder.decode(chunk))
+            parse_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        LISTING_PARSE_SECONDS.observe(parse_seconds + time.perf_counter() - started)
+        return parser
+
+async def discover_nas_access(folder_path):
+    """Probe every listing method at once and return (method, listing) of the first one that answers"""
+    probes = {
+        asyncio.create_task(fetch_nas_listing(method, folder_path)): method
+        for method in NAS_LISTING_URLS
+    }
+    for task in probes:
+        # Losing probes may still fail after a winner returned; retrieve their errors
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    order = list(NAS_LISTING_URLS)
+    pending = set(probes)
     try:
-        # Try different common paths for Buffalo LinkStation file access
-        possible_paths = [
-            f"{NAS_BASE_URL}/cgi-bin/func.cgi?FUNC=dir&PATH=/{folder_path}",
-            f"{NAS_BASE_URL}/share/{folder_path}",
-            f"{NAS_BASE_URL}/files/{folder_path}",
-            f"{NAS_BASE_URL}/cgi-bin/browse.cgi?path=/{folder_path}",
-        ]
-        
-        auth = aiohttp.BasicAuth(NAS_USERNAME, NAS_PASSWORD)
-        
-        for path_url in possible_paths:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda task: order.index(probes[task])):
+                if task.exception() is None:
+                    NAS_LISTING_METHOD_SELECTED.inc(method=probes[task])
+                    return probes[task], task.result()
+                logging.warning(f"NAS listing method {probes[task]} failed: {task.exception()}")
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    # Only log in to the web interface when plain HTTP access is not available
+    try:
+        listing = await fetch_nas_listing(NAS_WEB_METHOD, folder_path)
+        NAS_LISTING_METHOD_SELECTED.inc(method=NAS_WEB_METHOD)
+        return NAS_WEB_METHOD, listing
+    except Exception as e:
+        raise NASAccessError(f"No NAS access method could list /{folder_path}: {e}") from e
+
+async def fetch_nas_folder(folder_path):
+    """List a folder with the remembered access method, re-probing when it fails"""
+    global nas_access_method, nas_access_expires
+    method = nas_access_method
+    if not (method and time.monotonic() < nas_access_expires):
+        # Discovered by another worker: try it before probing every method again
+        shared = await shared_state.find_one({"_id": "nas_access"}) or {}
+        if shared.get("expires_at", 0) > time.time():
+            method = nas_access_method = shared["method"]
+            nas_access_expires = time.monotonic() + shared["expires_at"] - time.time()
+    seen_expires = nas_access_expires
+    if method and time.monotonic() < nas_access_expires:
+        try:
+            return await fetch_nas_listing(method, folder_path)
+        except NASUnavailable:
+            raise
+        except Exception as e:
+            logging.warning(f"NAS listing method {method} stopped working, re-probing: {e}")
+    
+    async with nas_discovery_lock:
+        if nas_access_method and nas_access_expires != seen_expires and time.monotonic() < nas_access_expires:
+            # Discovered by a listing that held the lock before this one
+            try:
+                return await fetch_nas_listing(nas_access_method, folder_path)
+            except NASUnavailable:
+                raise
+            except Exception as e:
+                logging.warning(f"NAS listing method {nas_access_method} stopped working, re-probing: {e}")
+        method, listing = await discover_nas_access(folder_path)
+        if method != nas_access_method:
+            logging.info(f"Using NAS listing method {method}")
+        nas_access_method = method
+        nas_access_expires = time.monotonic() + NAS_ACCESS_TTL
+        await shared_state.replace_one(
+            {"_id": "nas_access"}, {"method": method, "expires_at": time.time() + NAS_ACCESS_TTL}, upsert=True
+        )
+        return listing
+
+def join_folder(parent, name):
+    """Join a NAS folder path and a subfolder name"""
+    return f"{parent}/{name}" if parent else name
+
+def folder_ancestors(folder_path):
+    """Return a folder path and all its parents, e.g. Films, Films/2023 for Films/2023"""
+    parts = folder_path.split("/")
+    return ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+async def walk_nas_folders(roots, max_depth=None):
+    """Yield (folder, listing, error) for every folder below roots as soon as it is listed
+
+    Folders are listed by a pool of NAS_SCAN_CONCURRENCY workers, so a nested
+    library is walked several folders at a time without flooding the NAS.
+    """
+    max_depth = NAS_SCAN_MAX_DEPTH if max_depth is None else max_depth
+    folders = asyncio.Queue()
+    results = asyncio.Queue()
+    seen = set(roots)
+    queued = len(seen)
+    for root in seen:
+        folders.put_nowait((root, 0))
+    
+    async def worker():
+        nonlocal queued
+        while True:
+            folder, depth = await folders.get()
             try:
-                async with nas_session.get(path_url, auth=auth, timeout=15) as response:
-                    if response.status == 200:
-                        content = await response.text()
-                        return parse_file_list(content, folder_path)
+                listing = await list_nas_folder(folder)
             except Exception as e:
-                logging.warning(f"Failed to access {path_url}: {e}")
+                await results.put((folder, None, e))
                 continue
-        
-        # If direct access fails, try to use SMB-style access via web interface
-        return await get_movies_via_web_interface()
-        
+            if depth < max_depth:
+                for name in listing.folders:
+                    child = join_folder(folder, name)
+                    if child not in seen:
+                        seen.add(child)
+                        queued += 1
+                        folders.put_nowait((child, depth + 1))
+            await results.put((folder, listing, None))
+    
+    workers = [asyncio.create_task(worker()) for _ in range(NAS_SCAN_CONCURRENCY)]
+    try:
+        received = 0
+        while received < queued:
+            yield await results.get()
+            received += 1
+    finally:
+        for task in workers:
+            task.cancel()
+
+async def get_nas_shares():
+    """List the top-level shares of the NAS"""
+    try:
+        shares = (await list_nas_folder("")).folders
     except Exception as e:
-        logging.error(f"Error getting file list: {e}")
-        return []
+        logging.warning(f"Failed to list NAS shares: {e}")
+        shares = []
+    return shares or list(DEFAULT_NAS_SHARES)
 
-async def get_movies_via_web_interface():
-    """Alternative method using web interface"""
-    global nas_session
+# Listing parser
+VIDEO_EXTENSIONS = ('mp4', 'mkv', 'avi', 'mov', 'wmv', 'flv', 'webm', 'm4v')
+_VIDEO_FILE = r'\.(?:' + '|'.join(VIDEO_EXTENSIONS) + r')'
+
+# One alternation per way the NAS names a file: link target, link text, form
+# field; folders are links ending in a slash
+LISTING_ENTRY_RE = re.compile(
+    rf'href="(?P<href>[^"]*{_VIDEO_FILE})"'
+    r'|href="(?P<dir>[^"?#]*/)"'
+    rf'|>(?P<text>[^<>\n]*{_VIDEO_FILE})<'
+    rf'|name="(?P<name>[^"]*{_VIDEO_FILE})"',
+    re.IGNORECASE,
+)
+LISTING_MTIME_RE = re.compile(
+    r'(?:mtime|data-mtime)="(?P<epoch>\d+)"'
+    r'|(?P<year>\d{4})[-/.](?P<month>\d{2})[-/.](?P<day>\d{2})[ T](?P<hour>\d{2}):(?P<minute>\d{2})(?::(?P<second>\d{2}))?'
+    r'|(?P<a_day>\d{2})-(?P<a_month>[A-Za-z]{3})-(?P<a_year>\d{4}) (?P<a_hour>\d{2}):(?P<a_minute>\d{2})'
+)
+LISTING_SIZE_RE = re.compile(
+    r'(?:size|data-size)="(?P<attr>\d+)"'
+    r'|(?P<value>\d+(?:[.,]\d+)?)\s*(?P<unit>bytes|[KMGT]i?B|[KMGT]o|[KMGT])(?![\w.])'
+    r'|>\s*(?P<bytes>\d{4,})\s*<',
+    re.IGNORECASE,
+)
+MONTH_ABBREVIATIONS = {
+    month: number for number, month in enumerate(
+        ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), start=1)
+}
+SIZE_UNITS = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+# Text after an entry that may hold its size/mtime columns
+LISTING_DETAILS_WINDOW = 512
+# Unmatched tail kept between chunks so an entry split across them is not lost
+LISTING_CARRY = 1024
+
+def parse_listing_mtime(text):
+    """Return the first modification time found in a listing row, if any"""
+    match = LISTING_MTIME_RE.search(text)
+    if not match:
+        return None
     try:
-        # Login to web interface
-        login_url = f"{NAS_BASE_URL}/cgi-bin/login.cgi"
-        login_data = {
-            "USER": NAS_USERNAME,
-            "PASS": NAS_PASSWORD,
-            "LANGUAGE": "en"
-        }
+        if match['epoch']:
+            return datetime.utcfromtimestamp(int(match['epoch']))
+        if match['year']:
+            return datetime(int(match['year']), int(match['month']), int(match['day']),
+                            int(match['hour']), int(match['minute']), int(match['second'] or 0))
+        return datetime(int(match['a_year']), MONTH_ABBREVIATIONS[match['a_month'].lower()], int(match['a_day']),
+                        int(match['a_hour']), int(match['a_minute']))
+    except (KeyError, ValueError, OverflowError):
+        return None
+
+def parse_listing_size(text):
+    """Return the first file size (in bytes) found in a listing row, if any"""
+    match = LISTING_SIZE_RE.search(text)
+    if not match:
+        return None
+    if match['attr'] or match['bytes']:
+        return int(match['attr'] or match['bytes'])
+    unit = match['unit'].lower()
+    multiplier = 1 if unit == 'bytes' else SIZE_UNITS[unit[0]]
+    return int(float(match['value'].replace(',', '.')) * multiplier)
+
+class ListingParser:
+    """Single-pass, incremental parser for NAS directory listings
+
+    Feed it decoded chunks of the listing as they arrive; each file is reported
+    once however many times the HTML mentions it. An entry is only emitted once
+    the text after it is known, so its size and mtime columns can be read.
+    """
+
+    def __init__(self, folder_path, root=NAS_DEFAULT_LISTING_ROOT):
+        self.folder_path = folder_path
+        # Folder links are resolved against the URL of the listed folder itself
+        parts = [part for part in f"{root}/{folder_path}".split('/') if part]
+        self.base_url = f"{NAS_BASE_URL}/{'/'.join(parts)}/"
+        self.movies = []
+        self.folders = []
+        self._seen = set()
+        self._seen_folders = set()
+        self._buffer = ''
+
+    @staticmethod
+    def _file_name(match):
+        if match['href']:
+            value = urllib.parse.unquote(match['href'])
+        else:
+            value = match['text'] or match['name']
+        return html.unescape(value).split('/')[-1].strip()  # Get just the filename
+
+    def _folder(self, match):
+        # Only a link to a folder right below this one, on the NAS itself: not a
+        # parent, a deeper folder, the web interface's /static/ or another site
+        base = urllib.parse.urlsplit(self.base_url)
+        target = urllib.parse.urlsplit(urllib.parse.urljoin(self.base_url, html.unescape(match['dir'])))
+        path, base_path = urllib.parse.unquote(target.path), urllib.parse.unquote(base.path)
+        if (target.scheme, target.netloc) != (base.scheme, base.netloc) or not path.startswith(base_path):
+            return
+        name = path[len(base_path):-1]
+        if not name or '/' in name or name in ('.', '..'):
+            return
+        if name not in self._seen_folders:
+            self._seen_folders.add(name)
+            self.folders.append(name)
+
+    def _entry(self, file_name, details):
+        path = f"/{self.folder_path}/{file_name}"
+        if path in self._seen:
+            return None
+        self._seen.add(path)
         
-        async with nas_session.post(login_url, data=login_data) as response:
-            if response.status == 200:
-                # Try to access file browser
-                browse_url = f"{NAS_BASE_URL}/cgi-bin/func.cgi"
-                browse_params = {
-                    "FUNC": "dir",
-                    "PATH": "/Films"
-                }
-                
-                async with nas_session.get(browse_url, params=browse_params) as browse_response:
-                    if browse_response.status == 200:
-                        content = await browse_response.text()
-                        return parse_file_list(content, "Films")
-    except Exception as e:
-        logging.error(f"Web interface access failed: {e}")
-    
-    # Return some dummy data for testing
-    return [
-        Movie(name="Example Movie 1.mp4", path="/Films/Example Movie 1.mp4", format="mp4"),
-        Movie(name="Example Movie 2.mkv", path="/Films/Example Movie 2.mkv", format="mkv"),
-        Movie(name="Example Movie 3.avi", path="/Films/Example Movie 3.avi", format="avi"),
-    ]
+        details = details[:LISTING_DETAILS_WINDOW]
+        movie = Movie(
+            name=file_name,
+            path=path,
+            format=file_name.rsplit('.', 1)[-1].lower(),
+            size=parse_listing_size(details),
+            modified=parse_listing_mtime(details),
+        )
+        self.movies.append(movie)
+        return movie
+
+    def feed(self, text):
+        """Parse the next chunk of the listing and return the movies it completed"""
+        self._buffer += text
+        found = []
+        pending = pending_name = None
+        for match in LISTING_ENTRY_RE.finditer(self._buffer):
+            if match['dir']:
+                if pending:
+                    found.append(self._entry(pending_name, self._buffer[pending.end():match.start()]))
+                pending = pending_name = None
+                self._folder(match)
+                continue
+            file_name = self._file_name(match)
+            if file_name != pending_name:
+                if pending:
+                    found.append(self._entry(pending_name, self._buffer[pending.end():match.start()]))
+                pending_name = file_name
+            # Link and link text usually name the same file back to back; its
+            # details only start after the last of them
+            pending = match
+        
+        if pending is None:
+            self._buffer = self._buffer[-LISTING_CARRY:]
+        elif len(self._buffer) - pending.end() >= LISTING_DETAILS_WINDOW:
+            found.append(self._entry(pending_name, self._buffer[pending.end():]))
+            self._buffer = self._buffer[pending.end():][-LISTING_CARRY:]
+        else:
+            self._buffer = self._buffer[pending.start():]
+        return [movie for movie in found if movie]
+
+    def close(self):
+        """Flush the last entry and return every movie in the listing"""
+        pending = None
+        for match in LISTING_ENTRY_RE.finditer(self._buffer):
+            if match['dir']:
+                self._folder(match)
+            pending = None if match['dir'] else match
+        if pending:
+            self._entry(self._file_name(pending), self._buffer[pending.end():])
+        self._buffer = ''
+        return self.movies
 
 def parse_file_list(html_content, folder_path):
     """Parse HTML content to extract movie files"""
-    movies = []
+    started = time.perf_counter()
+    parser = ListingParser(folder_path)
+    parser.feed(html_content)
+    movies = parser.close()
+    LISTING_PARSE_SECONDS.observe(time.perf_counter() - started)
+    return movies
+
+# Catalog events
+# Rescans and media probes publish what they change; one broadcaster fans each
+# event out to every /api/events client through its own bounded queue. A client
+# that falls behind, or reconnects after events it missed were dropped from the
+# history, gets a single "resync" event telling it to reload instead.
+class EventBroadcaster:
+    """Fans catalog change events out to subscribers, keeping a short history for reconnects"""
+
+    def __init__(self, queue_size=EVENTS_QUEUE_SIZE, history=EVENTS_HISTORY):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.history = deque(maxlen=history)
+        self.epoch = str(int(time.time()))  # event ids from an earlier run are never replayed
+        self.last_id = 0
+        self.first_id = 0  # events up to this one happened before this process was listening
+
+    def event_id(self, event):
+        return f"{self.epoch}:{event['seq']}"
+
+    def resync_event(self):
+        return {"seq": self.last_id, "type": "resync", "folders": None, "data": {}}
+
+    def publish(self, event_type, data, folders=None, seq=None):
+        self.last_id = self.last_id + 1 if seq is None else seq
+        event = {"seq": self.last_id, "type": event_type, "folders": folders, "data": data}
+        self.history.append(event)
+        EVENTS_PUBLISHED.inc(type=event_type)
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too far behind: drop its backlog, it will reload the catalog instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.resync_event())
+                EVENT_RESYNCS.inc()
+
+    def subscribe(self, last_event_id=None):
+        """Return a new subscriber queue, primed with the events missed since last_event_id"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if last_event_id:
+            epoch, _, seq = last_event_id.partition(":")
+            missed = [event for event in self.history if seq.isdigit() and event["seq"] > int(seq)]
+            complete = (
+                epoch == self.epoch and seq.isdigit() and int(seq) >= self.first_id
+                and (not self.history or self.history[0]["seq"] <= int(seq) + 1)
+            )
+            if complete and len(missed) < self.queue_size:
+                for event in missed:
+                    queue.put_nowait(event)
+            else:
+                queue.put_nowait(self.resync_event())
+        self.subscribers.add(queue)
+        EVENT_SUBSCRIBERS.set(len(self.subscribers))
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        EVENT_SUBSCRIBERS.set(len(self.subscribers))
+
+catalog_events = EventBroadcaster()
+
+# Events go through a feed in MongoDB, so that every worker sees them: whichever
+# worker changed the catalog appends them under one shared counter, and every
+# worker polls the feed, applies the changes to its in-memory index and hands
+# them to its own /api/events clients. Event ids and catalog ETags are then the
+# same whichever worker a client reaches.
+class CatalogFeed:
+    """Carries catalog events between workers through MongoDB, numbered by one shared counter"""
+
+    def __init__(self, collection, state_collection, broadcaster):
+        self.collection = collection
+        self.state = state_collection
+        self.broadcaster = broadcaster
+        self.origin = uuid.uuid4().hex  # events this worker already applied to its index
+        self.outbox = []
+        self.outbox_ready = asyncio.Event()
+        self.position = 0
+        self.tasks = []
+
+    def publish(self, event_type, data, folders=None):
+        self.outbox.append({"type": event_type, "data": data, "folders": folders})
+        self.outbox_ready.set()
+
+    async def start(self):
+        """Join the feed at its current position and start writing and reading it"""
+        try:
+            await self.collection.create_index("seq", unique=True)
+            await self.collection.create_index("created_at", expireAfterSeconds=EVENTS_RETENTION)
+        except Exception as e:
+            logging.error(f"Failed to create catalog feed indexes: {e}")
+        state = await self.state.find_one_and_update(
+            {"_id": "catalog_feed"},
+            {"$setOnInsert": {"seq": 0, "epoch": str(int(time.time()))}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        self.broadcaster.epoch = state["epoch"]
+        self.broadcaster.last_id = self.broadcaster.first_id = self.position = state["seq"]
+        self.tasks = [asyncio.create_task(self.write_loop()), asyncio.create_task(self.read_loop())]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+    async def write_loop(self):
+        while True:
+            await self.outbox_ready.wait()
+            self.outbox_ready.clear()
+            batch, self.outbox = self.outbox, []
+            try:
+                state = await self.state.find_one_and_update(
+                    {"_id": "catalog_feed"}, {"$inc": {"seq": len(batch)}}, return_document=ReturnDocument.AFTER
+                )
+                first = state["seq"] - len(batch) + 1
+                now = datetime.utcnow()
+                await self.collection.insert_many([
+                    {**event, "seq": first + i, "origin": self.origin, "created_at": now}
+                    for i, event in enumerate(batch)
+                ])
+            except Exception as e:
+                # Numbers taken but never written show up as a gap, which readers skip in time
+                logging.error(f"Failed to append {len(batch)} events to the catalog feed, retrying: {e}")
+                self.outbox = batch + self.outbox
+                await asyncio.sleep(EVENTS_POLL_INTERVAL)
+                self.outbox_ready.set()
+
+    async def read_loop(self):
+        gap_since = None
+        while True:
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+            try:
+                docs = await self.collection.find(
+                    {"seq": {"$gt": self.position}}, {"_id": 0}
+                ).sort("seq", 1).to_list(1000)
+            except Exception as e:
+                logging.error(f"Failed to read the catalog feed: {e}")
+                continue
+            for doc in docs:
+                if doc["seq"] != self.position + 1:
+                    # Another worker took the numbers and has not written them yet
+                    gap_since = gap_since or time.monotonic()
+                    if time.monotonic() - gap_since < EVENTS_GAP_TIMEOUT:
+                        break
+                    logging.warning(f"Catalog events {self.position + 1}-{doc['seq'] - 1} never arrived, reloading")
+                    await reload_catalog_index()
+                    self.broadcaster.publish("resync", {}, seq=doc["seq"] - 1)
+                gap_since = None
+                self.apply(doc)
+
+    def apply(self, doc):
+        if doc["origin"] != self.origin:
+            index_catalog_change(doc["type"], {**doc["data"], "folders": doc["folders"]})
+        self.broadcaster.publish(doc["type"], doc["data"], folders=doc["folders"], seq=doc["seq"])
+        self.position = doc["seq"]
+
+shared_state = db.shared_state
+catalog_feed = CatalogFeed(db.catalog_events, shared_state, catalog_events)
+
+def publish_movie_event(event_type, doc):
+    """Publish an added/updated catalog entry, or a removed one (only id and path needed)"""
+    if event_type == "removed":
+        data = {"id": doc.get("id"), "path": doc["path"]}
+    else:
+        data = catalog_movie(doc).model_dump(mode="json")
+    catalog_feed.publish(event_type, data, folders=doc.get("folders"))
+
+# Movie catalog
+# Parsed listings are kept in MongoDB and served from there; the NAS is only
+# read by background rescans, which upsert/delete the entries that changed.
+catalog_collection = db.movies
+catalog_last_scan = {}
+catalog_scan_locks = {}
+catalog_task = None
+
+CATALOG_FIELDS = ("name", "size", "format", "thumbnail", "modified")
+CATALOG_SORT_FIELDS = ("name", "size", "format")
+
+def catalog_name_words(name):
+    """Folded words of a movie name, stored so q filters are anchored prefix scans of an index"""
+    return catalog_search.words(catalog_search.EXTENSION_RE.sub("", name))
+
+async def init_catalog():
+    """Create the catalog indexes"""
+    try:
+        await catalog_collection.create_index("path", unique=True)
+        for field in CATALOG_SORT_FIELDS:
+            await catalog_collection.create_index([("folders", 1), (field, 1), ("path", 1)])
+        await catalog_collection.create_index([("folders", 1), ("format", 1), ("name", 1), ("path", 1)])
+        # folders is an array too, and MongoDB cannot index two arrays together
+        await catalog_collection.create_index("name_words")
+        await catalog_collection.create_index("media")
+        await catalog_collection.create_index("id")
+    except Exception as e:
+        logging.error(f"Failed to create catalog indexes: {e}")
+    
+    # Entries stored before ids were derived from paths carry random (version 4) uuids
+    legacy = await catalog_collection.find(
+        {"id": {"$not": re.compile(r"^.{14}5")}}, {"_id": 0, "path": 1}
+    ).to_list(None)
+    if legacy:
+        await catalog_collection.bulk_write([
+            UpdateOne({"path": doc["path"]}, {"$set": {"id": movie_id_for_path(doc["path"])}}) for doc in legacy
+        ], ordered=False)
+        logging.info(f"Gave {len(legacy)} catalog entries path-derived ids")
+    
+    unsplit = await catalog_collection.find(
+        {"name_words": {"$exists": False}}, {"_id": 0, "path": 1, "name": 1}
+    ).to_list(None)
+    if unsplit:
+        await catalog_collection.bulk_write([
+            UpdateOne({"path": doc["path"]}, {"$set": {"name_words": catalog_name_words(doc["name"])}})
+            for doc in unsplit
+        ], ordered=False)
+        logging.info(f"Split the names of {len(unsplit)} catalog entries into words")
+
+def catalog_changes(folder, movies, known):
+    """Return (operations, added, updated) that bring the catalog in line with a folder listing
+
+    added and updated are the resulting catalog entries. Entries found are
+    popped from known, so what remains there afterwards is no longer on the NAS.
+    """
+    operations = []
+    added, updated = [], []
+    location = {"folder": folder, "folders": folder_ancestors(folder)}
+    for movie in movies:
+        fields = {field: getattr(movie, field) for field in CATALOG_FIELDS}
+        fields["name_words"] = catalog_name_words(movie.name)
+        doc = known.pop(movie.path, None)
+        if doc is not None and all(doc.get(field) == value for field, value in {**fields, **location}.items()):
+            continue
+        changes = {**fields, **location}
+        if doc is None or doc.get("size") != movie.size or doc.get("modified") != movie.modified:
+            # New or rewritten file: have its container headers (re)probed
+            changes["media"] = None
+        if doc is None:
+            added.append({"id": movie.id, "path": movie.path, **changes})
+        else:
+            updated.append({**doc, **changes})
+        operations.append(UpdateOne(
+            {"path": movie.path},
+            {"$set": changes, "$setOnInsert": {"id": movie.id}},
+            upsert=True,
+        ))
+    return operations, added, updated
+
+def index_catalog_change(event_type, doc):
+    """Apply an added, updated or removed entry to the search index and the path table"""
+    if event_type == "removed":
+        search_index.remove(doc.get("id"))
+        catalog_paths.pop(doc.get("id"), None)
+    else:
+        search_index.add(doc)
+        catalog_paths[doc["id"]] = doc["path"]
+
+def publish_catalog_changes(added, updated, removed):
+    """Apply catalog changes to the in-memory index and announce them to /api/events clients"""
+    for event_type, docs in (("added", added), ("updated", updated), ("removed", removed)):
+        for doc in docs:
+            index_catalog_change(event_type, doc)
+            publish_movie_event(event_type, doc)
+
+async def rescan_folder(folder=CATALOG_DEFAULT_FOLDER):
+    """Re-read a NAS folder tree and apply only the changed entries to the catalog
+
+    Each subfolder's changes are written as soon as its listing arrives.
+    """
+    lock = catalog_scan_locks.setdefault(folder, asyncio.Lock())
+    async with lock:
+        known = {
+            doc["path"]: doc
+            async for doc in catalog_collection.find(
+                {"folders": folder},
+                {"_id": 0, "id": 1, "path": 1, "folder": 1, "folders": 1, "media": 1, "name_words": 1,
+                 **{field: 1 for field in CATALOG_FIELDS}},
+            )
+        }
+        
+        added = updated = removed = 0
+        failed = []
+        async for subfolder, listing, error in walk_nas_folders([folder]):
+            if error:
+                if subfolder == folder:
+                    raise error
+                logging.warning(f"Failed to list {subfolder}, keeping its catalog entries: {error}")
+                failed.append(subfolder)
+                continue
+            
+            operations, folder_added, folder_updated = catalog_changes(subfolder, listing.movies, known)
+            gone = [known.pop(path) for path, doc in list(known.items()) if doc.get("folder") == subfolder]
+            if gone:
+                operations.append(DeleteMany({"path": {"$in": [doc["path"] for doc in gone]}}))
+            if operations:
+                await catalog_collection.bulk_write(operations, ordered=False)
+            publish_catalog_changes(folder_added, folder_updated, gone)
+            added += len(folder_added)
+            updated += len(folder_updated)
+            removed += len(gone)
+        
+        # What is left lived in folders that no longer exist, unless they failed to list
+        gone = [
+            doc for doc in known.values()
+            if not any(ancestor in failed for ancestor in folder_ancestors(doc.get("folder", folder)))
+        ]
+        if gone:
+            await catalog_collection.delete_many({"path": {"$in": [doc["path"] for doc in gone]}})
+            publish_catalog_changes([], [], gone)
+            removed += len(gone)
+        
+        catalog_last_scan[folder] = datetime.utcnow()
+        logging.info(f"Catalog rescan of {folder}: {added} added, {updated} updated, {removed} removed")
+        return {"added": added, "updated": updated, "removed": removed}
+
+async def ensure_catalog_folder(folder=CATALOG_DEFAULT_FOLDER):
+    """Scan a folder into the catalog if it was never indexed"""
+    if folder in catalog_last_scan:
+        return
+    if not await catalog_collection.count_documents({"folders": folder}, limit=1):
+        await rescan_folder(folder)
+    else:
+        # Known from a previous run: serve it and let the background loop refresh it
+        catalog_last_scan[folder] = datetime.min
+    # Rescans run on the elected worker, which may not be this one
+    await shared_state.update_one({"_id": "catalog_folders"}, {"$addToSet": {"folders": folder}}, upsert=True)
+
+def encode_catalog_cursor(doc, sort_field):
+    """Encode the sort key of the last returned entry as an opaque cursor"""
+    key = json.dumps([doc.get(sort_field), doc["path"]])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def decode_catalog_cursor(cursor):
+    """Decode a cursor produced by encode_catalog_cursor"""
+    try:
+        value, path = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, path
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def catalog_query(folder, q=None, movie_format=None, sort="name", cursor=None):
+    """Build the Mongo filter and sort for a catalog page
+
+    Pages are keyset-paginated on (sort field, path), so each page is an index
+    range scan however deep the client pages. Missing values (e.g. unknown
+    sizes) sort first ascending and last descending, as MongoDB orders them.
+    Every word of q must start a word of the name; each is an anchored regex
+    on the indexed name_words, so it is a range scan too, not a collection scan.
+    """
+    descending = sort.startswith("-")
+    field = sort.lstrip("-")
+    if field not in CATALOG_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by {field}")
     
-    # Common video file extensions
-    video_extensions = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v']
+    query = {"folders": folder}
+    terms = catalog_search.words(q) if q else []
+    if terms:
+        query["$and"] = [{"name_words": re.compile("^" + re.escape(term))} for term in terms]
+    if movie_format:
+        query["format"] = movie_format.lower()
     
-    # Try to extract file names from HTML
-    # This is a simplified parser - might need adjustment based on actual NAS response
-    import re
+    if cursor:
+        value, path = decode_catalog_cursor(cursor)
+        after = "$lt" if descending else "$gt"
+        if value is None:
+            after_cursor = [{field: None, "path": {after: path}}]
+            if not descending:
+                after_cursor.append({field: {"$ne": None}})
+        else:
+            after_cursor = [{field: {after: value}}, {field: value, "path": {after: path}}]
+            if descending:
+                after_cursor.append({field: None})
+        query["$or"] = after_cursor
     
-    # Look for file patterns in HTML
-    patterns = [
-        r'href="([^"]*\.(?:mp4|mkv|avi|mov|wmv|flv|webm|m4v))"',
-        r'>([^<]*\.(?:mp4|mkv|avi|mov|wmv|flv|webm|m4v))<',
-        r'name="([^"]*\.(?:mp4|mkv|avi|mov|wmv|flv|webm|m4v))"'
-    ]
+    direction = -1 if descending else 1
+    return query, [(field, direction), ("path", direction)]
+
+def catalog_movie(doc):
+    """Build the Movie of a catalog entry, pointing its thumbnail at the thumbnail service"""
+    movie = Movie(**doc)
+    if movie.thumbnail is None:
+        # The version changes with the file, so browsers may cache each URL forever
+        movie.thumbnail = f"/api/thumbnails/{movie.id}?v={movie_version_key(doc)[:16]}"
+    return movie
+
+async def get_catalog_movies(folder=CATALOG_DEFAULT_FOLDER, q=None, movie_format=None, sort="name", limit=None, cursor=None):
+    """Return (movies, total, next_cursor) for one page of a folder's catalog"""
+    await ensure_catalog_folder(folder)
+    query, sort_spec = catalog_query(folder, q, movie_format, sort, cursor)
     
-    for pattern in patterns:
-        matches = re.findall(pattern, html_content, re.IGNORECASE)
-        for match in matches:
-            if any(match.lower().endswith(ext) for ext in video_extensions):
-                file_name = match.split('/')[-1]  # Get just the filename
-                movies.append(Movie(
-                    name=file_name,
-                    path=f"/{folder_path}/{file_name}",
-                    format=file_name.split('.')[-1].lower()
-                ))
+    find = catalog_collection.find(query, {"_id": 0}).sort(sort_spec)
+    if limit:
+        # Fetch one extra entry to know whether another page follows
+        find = find.limit(limit + 1)
+    docs = await find.to_list(None)
     
-    return movies
+    next_cursor = None
+    if limit and len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_catalog_cursor(docs[-1], sort.lstrip("-"))
+    
+    count_query, _ = catalog_query(folder, q, movie_format, sort)
+    total = await catalog_collection.count_documents(count_query)
+    return [catalog_movie(doc) for doc in docs], total, next_cursor
+
+async def stream_catalog_movies(folder=CATALOG_DEFAULT_FOLDER, q=None, movie_format=None, sort="name", limit=None, cursor=None):
+    """Yield the matching catalog entries as NDJSON lines while the Mongo cursor is read"""
+    query, sort_spec = catalog_query(folder, q, movie_format, sort, cursor)
+    find = catalog_collection.find(query, {"_id": 0}).sort(sort_spec)
+    if limit:
+        find = find.limit(limit)
+    async for doc in find:
+        yield catalog_movie(doc).model_dump_json() + "\n"
+
+# Catalog index
+# Every entry's name is held in an in-memory search index (catalog_search) and
+# its path in an id -> path table, loaded from MongoDB once and then kept
+# current by publish_catalog_changes, so neither type-ahead queries nor id
+# lookups touch the collection.
+search_index = catalog_search.SearchIndex()
+catalog_paths = {}
+catalog_index_loaded = False
+catalog_index_lock = asyncio.Lock()
+
+async def load_catalog_index(index, paths):
+    """Read every catalog entry into a search index and an id -> path table"""
+    started = time.perf_counter()
+    async for doc in catalog_collection.find({}, {"_id": 0, "id": 1, "path": 1, "name": 1, "folders": 1}):
+        index.add(doc)
+        paths[doc["id"]] = doc["path"]
+    logging.info(f"Indexed {len(index)} catalog entries in {time.perf_counter() - started:.2f}s")
+
+async def ensure_catalog_index():
+    """Load every catalog entry into the search index and the path table, once"""
+    global catalog_index_loaded
+    async with catalog_index_lock:
+        if catalog_index_loaded:
+            return
+        await load_catalog_index(search_index, catalog_paths)
+        catalog_index_loaded = True
+
+async def reload_catalog_index():
+    """Rebuild the search index and the path table from MongoDB, e.g. after catalog events were lost"""
+    global search_index, catalog_paths, catalog_index_loaded
+    async with catalog_index_lock:
+        index, paths = catalog_search.SearchIndex(), {}
+        await load_catalog_index(index, paths)
+        search_index, catalog_paths, catalog_index_loaded = index, paths, True
+
+async def get_movie_path(movie_id):
+    """Return the NAS path of a catalog entry"""
+    await ensure_catalog_index()
+    path = catalog_paths.get(movie_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Movie not found")
+    return path
+
+def catalog_etag(request):
+    """Strong ETag of a catalog response, changing with every catalog change and with the query"""
+    version = f"{catalog_events.epoch}:{catalog_events.last_id}:{request.url.query}"
+    return f'"{hashlib.sha1(version.encode()).hexdigest()[:20]}"'
+
+async def search_catalog(q, folder=CATALOG_DEFAULT_FOLDER, limit=20, offset=0):
+    """Return (movies, total) for one page of ranked search results"""
+    await ensure_catalog_folder(folder)
+    await ensure_catalog_index()
+    started = time.perf_counter()
+    ids = search_index.search(q, folder)
+    SEARCH_SECONDS.observe(time.perf_counter() - started)
+    
+    page = ids[offset:offset + limit]
+    docs = await catalog_collection.find({"id": {"$in": page}}, {"_id": 0}).to_list(None)
+    by_id = {doc["id"]: doc for doc in docs}
+    return [catalog_movie(by_id[entry_id]) for entry_id in page if entry_id in by_id], len(ids)
+
+async def catalog_rescan_loop():
+    """Periodically rescan every folder that has been requested"""
+    await init_catalog()
+    await ensure_catalog_index()
+    catalog_last_scan.setdefault(CATALOG_DEFAULT_FOLDER, datetime.min)
+    while True:
+        try:
+            shared = await shared_state.find_one({"_id": "catalog_folders"}) or {}
+        except Exception as e:
+            logging.error(f"Failed to read the folders other workers serve: {e}")
+            shared = {}
+        for folder in shared.get("folders", []):
+            # Scanned by the worker that first served it
+            catalog_last_scan.setdefault(folder, datetime.utcnow())
+        now = datetime.utcnow()
+        for folder, scanned_at in list(catalog_last_scan.items()):
+            if any(parent in catalog_last_scan for parent in folder_ancestors(folder)[:-1]):
+                # Already covered by the rescan of a parent folder
+                continue
+            if (now - scanned_at).total_seconds() >= CATALOG_RESCAN_INTERVAL:
+                try:
+                    await rescan_folder(folder)
+                except Exception as e:
+                    logging.error(f"Catalog rescan of {folder} failed: {e}")
+        await asyncio.sleep(min(CATALOG_RESCAN_INTERVAL, 30))
+
+# Media probing
+# Duration, codecs and resolution come from the container headers only (MP4 moov,
+# Matroska EBML, AVI hdrl, ASF header), read with ranged requests and parsed in a
+# process pool by media_probe. Entries with media set to null are waiting to be probed; an
+# empty dict means the file could not be parsed.
+media_probe_pool = None
+media_task = None
+
+MEDIA_PROBE_MAX_ROUNDS = 6
+MEDIA_PROBE_MIN_READ = 256 * 1024
+
+async def read_nas_range(movie_path, offset, length):
+    """Read length bytes at offset of a NAS file and return (data, total size)
+
+    The data is empty when the NAS does not serve byte ranges of the file.
+    """
+    read = nas_scheduler.read()
+    async with nas_scheduler.reading(read), get_nas_session().get(
+        nas_file_url(movie_path),
+        auth=aiohttp.BasicAuth(NAS_USERNAME, NAS_PASSWORD),
+        headers={"Range": f"bytes={offset}-{offset + length - 1}"},
+        timeout=aiohttp.ClientTimeout(total=60, sock_connect=10),
+    ) as response:
+        if response.status == 206:
+            match = re.fullmatch(r"bytes \d+-\d+/(\d+)", response.headers.get("content-range", ""))
+            data = await response.read()
+            await nas_scheduler.transfer(read, len(data))
+            return data, int(match.group(1)) if match else None
+        if response.status == 200:
+            # No range support: reaching a moov at the end would mean reading the whole film
+            logging.warning(f"NAS does not serve byte ranges of {movie_path}, not reading its headers")
+            response.close()
+            return b"", response.content_length
+        raise aiohttp.ClientResponseError(
+            response.request_info, response.history, status=response.status,
+            message=f"NAS answered a header read with HTTP {response.status}",
+        )
+
+async def probe_movie(doc):
+    """Read and parse the container headers of a catalog entry, returning its media details"""
+    loop = asyncio.get_running_loop()
+    data, size = await read_movie_range(doc["path"], 0, MEDIA_PROBE_HEAD_BYTES)
+    if not data:
+        return {}
+    size = size or doc.get("size")
+    windows = {0: data}
+    for _ in range(MEDIA_PROBE_MAX_ROUNDS):
+        result = await loop.run_in_executor(
+            media_probe_pool, media_probe.probe_media, doc.get("format"), size, windows
+        )
+        if "media" in result:
+            return result["media"]
+        offset, length = result["need"]
+        length = max(length, MEDIA_PROBE_MIN_READ)
+        if size:
+            length = min(length, size - offset)
+        if length <= 0:
+            break
+        data, _ = await read_movie_range(doc["path"], offset, length)
+        if not data:
+            break
+        windows[offset] = data
+    return {}
+
+async def save_movie_media(path, media):
+    """Store the probed media details of a catalog entry and announce the update"""
+    doc = await catalog_collection.find_one_and_update(
+        {"path": path}, {"$set": {"media": media}}, projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is not None:
+        publish_movie_event("updated", doc)
+
+async def probe_pending_movies():
+    """Probe every catalog entry without media details, returning how many were probed"""
+    semaphore = asyncio.Semaphore(MEDIA_PROBE_CONCURRENCY)
+    failed = set()
+
+    async def probe(doc):
+        async with semaphore:
+            try:
+                media = await probe_movie(doc)
+            except (aiohttp.ClientError, asyncio.TimeoutError, NASUnavailable, OSError) as e:
+                # Left pending, tried again on the next round
+                logging.warning(f"Could not read the headers of {doc['path']}: {e}")
+                failed.add(doc["path"])
+                return 0
+            except Exception as e:
+                # Not retried this round either, and the rest of the batch goes on
+                logging.error(f"Failed to probe {doc['path']}: {e}")
+                failed.add(doc["path"])
+                return 0
+            await save_movie_media(doc["path"], media)
+            return 1
+
+    probed = 0
+    while True:
+        docs = await catalog_collection.find(
+            {"media": None, "path": {"$nin": list(failed)}},
+            {"_id": 0, "path": 1, "format": 1, "size": 1},
+        ).limit(100).to_list(100)
+        if not docs:
+            return probed
+        probed += sum(await asyncio.gather(*(probe(doc) for doc in docs)))
+
+async def media_probe_loop():
+    """Keep probing new and changed catalog entries in the background"""
+    while True:
+        try:
+            probed = await probe_pending_movies()
+            if probed:
+                logging.info(f"Probed media details of {probed} movies")
+        except Exception as e:
+            logging.error(f"Media probing failed: {e}")
+        await asyncio.sleep(MEDIA_PROBE_INTERVAL)
+
+def nas_file_url(movie_path):
+    """Return the NAS URL of a movie file"""
+    return f"{NAS_BASE_URL}/share/{movie_path}"
 
 # API Routes
 @api_router.get("/")
@@ -184,115 +1465,2227 @@ async def root():
 
 @api_router.get("/connection/test", response_model=NASConnection)
 async def test_nas_connection():
-    """Test connection to NAS"""
-    connected = await init_nas_connection()
+    """Report the NAS connection state from the last health probe"""
+    if nas_health["checked_at"] is None:
+        await check_nas_health()
+    connected = nas_health["connected"]
     return NASConnection(
         connected=connected,
-        message="Connected to NAS" if connected else "Failed to connect to NAS"
+        message="Connected to NAS" if connected else f"Failed to connect to NAS: {nas_health['error']}",
+        state=nas_breaker.state,
+        storage=(await get_storage()).name,
+        checked_at=nas_health["checked_at"],
+        latency_ms=nas_health["latency_ms"],
     )
 
 @api_router.get("/movies", response_model=MoviesResponse)
-async def get_movies(folder: str = Query(default="Films")):
-    """Get list of movies from NAS"""
+async def get_movies(
+    request: Request,
+    response: Response,
+    folder: str = Query(default="Films"),
+    q: Optional[str] = Query(default=None, description="Each word must start a word of the movie name; case and accents are ignored"),
+    movie_format: Optional[str] = Query(default=None, alias="format", description="File extension, e.g. mkv"),
+    sort: str = Query(default="name", description="name, size or format; prefix with - for descending"),
+    limit: Optional[int] = Query(default=None, ge=1, le=1000),
+    cursor: Optional[str] = Query(default=None, description="next_cursor of the previous page"),
+    stream: bool = Query(default=False, description="Return one JSON movie per line (NDJSON)"),
+):
+    """Get list of movies from the catalog"""
     try:
-        movies = await get_nas_file_list(folder)
-        return MoviesResponse(movies=movies, total=len(movies))
+        await ensure_catalog_folder(folder)
+        # Validate the parameters before answering
+        catalog_query(folder, q, movie_format, sort, cursor)
+        # Taken before the catalog is read, so a change made meanwhile gets a new tag
+        headers = {"ETag": catalog_etag(request), "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match", ""), headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        if stream:
+            return StreamingResponse(
+                stream_catalog_movies(folder, q, movie_format, sort, limit, cursor),
+                media_type="application/x-ndjson", headers=headers,
+            )
+        movies, total, next_cursor = await get_catalog_movies(folder, q, movie_format, sort, limit, cursor)
+        response.headers.update(headers)
+        return MoviesResponse(movies=movies, total=total, next_cursor=next_cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error getting movies: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to get movies: {str(e)}")
 
-@api_router.get("/stream/{movie_path:path}")
-async def stream_movie(movie_path: str, request: Request):
-    """Stream movie from NAS"""
+@api_router.get("/search", response_model=MoviesResponse)
+async def search_movies(
+    q: str = Query(..., min_length=1, description="Title words in any order; case, accents and small typos are ignored"),
+    folder: str = Query(default="Films"),
+    limit: int = Query(default=20, ge=1, le=1000),
+    cursor: Optional[str] = Query(default=None, description="next_cursor of the previous page"),
+):
+    """Search the catalog, best matches first"""
     try:
-        # Construct full NAS URL for the movie
-        full_path = f"{NAS_BASE_URL}/share/{movie_path}"
-        
-        # Get range header for seeking support
-        range_header = request.headers.get('range')
-        
-        # Set up authentication
-        auth = HTTPBasicAuth(NAS_USERNAME, NAS_PASSWORD)
-        
-        headers = {}
-        if range_header:
-            headers['Range'] = range_header
-        
-        # Stream from NAS
-        response = requests.get(full_path, auth=auth, headers=headers, stream=True)
-        
-        if response.status_code in [200, 206]:
-            def generate():
-                for chunk in response.iter_content(chunk_size=8192):
-                    yield chunk
-            
-            # Determine content type
-            content_type = response.headers.get('content-type', 'video/mp4')
-            
-            # Set up response headers
-            response_headers = {
-                'Content-Type': content_type,
-                'Accept-Ranges': 'bytes',
-                'Content-Length': response.headers.get('content-length', ''),
-            }
-            
-            if range_header and response.status_code == 206:
-                response_headers['Content-Range'] = response.headers.get('content-range', '')
-                return StreamingResponse(
-                    generate(),
-                    status_code=206,
-                    headers=response_headers
-                )
-            
-            return StreamingResponse(
-                generate(),
-                status_code=200,
-                headers=response_headers
-            )
-        else:
-            raise HTTPException(status_code=404, detail="Movie not found")
-            
-    except Exception as e:
-        logging.error(f"Error streaming movie: {e}")
-        raise HTTPException(status_code=500, detail=f"Streaming error: {str(e)}")
-
-@api_router.get("/folders")
-async def get_folders():
-    """Get available folders on NAS"""
+        offset = int(cursor) if cursor else 0
+    except ValueError:
+        offset = -1
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
     try:
-        # This would normally scan for folders, for now return Films
-        return {"folders": ["Films", "Movies", "Videos"]}
+        movies, total = await search_catalog(q, folder, limit, offset)
+        next_cursor = str(offset + limit) if offset + limit < total else None
+        return MoviesResponse(movies=movies, total=total, next_cursor=next_cursor)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get folders: {str(e)}")
+        logging.error(f"Error searching movies: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to search movies: {str(e)}")
 
-# Include the router in the main app
-app.include_router(api_router)
+# File metadata
+# Size, modification time and content type of each streamed file, kept in memory
+# so HEAD, If-None-Match and If-Range requests are answered without the NAS.
+file_metadata = {}
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def guess_content_type(movie_path, upstream_type=None):
+    """Prefer the NAS content type unless it is missing or generic"""
+    if upstream_type and upstream_type.split(";")[0].strip() != "application/octet-stream":
+        return upstream_type
+    return mimetypes.guess_type(movie_path)[0] or "video/mp4"
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+def remember_file_metadata(movie_path, size, headers):
+    """Record what an upstream response told us about a file and return it"""
+    modified = None
+    if headers.get("last-modified"):
+        try:
+            modified = parsedate_to_datetime(headers["last-modified"]).timestamp()
+        except (TypeError, ValueError):
+            pass
+    metadata = make_file_metadata(movie_path, size, modified, headers.get("content-type"))
+    file_metadata[movie_path] = metadata
+    return metadata
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize NAS connection on startup"""
+def make_file_metadata(movie_path, size, modified, content_type=None):
+    """Build the metadata of a file; the ETag is the same whichever storage reported it"""
+    if modified is not None:
+        etag = f'"{size:x}-{int(modified):x}"'
+    else:
+        # Without an mtime the size alone cannot prove two files are byte-identical
+        etag = f'W/"{size:x}"'
+    metadata = {
+        "size": size,
+        "modified": modified,
+        "content_type": guess_content_type(movie_path, content_type),
+        "etag": etag,
+        "expires": time.monotonic() + METADATA_TTL,
+    }
+    return metadata
+
+async def get_file_metadata(movie_path):
+    """Return the cached metadata of a file, asking the NAS with a HEAD request when unknown"""
+    metadata = file_metadata.get(movie_path)
+    if metadata and time.monotonic() < metadata["expires"]:
+        CACHE_REQUESTS.inc(cache="metadata", result="hit")
+        return metadata
+    CACHE_REQUESTS.inc(cache="metadata", result="miss")
+    
+    session = get_nas_session()
+    auth = aiohttp.BasicAuth(NAS_USERNAME, NAS_PASSWORD)
+    trace = {"kind": "metadata"}
+    async with session.head(nas_file_url(movie_path), auth=auth, timeout=15, trace_request_ctx=trace) as response:
+        if response.status == 404:
+            raise HTTPException(status_code=404, detail="Movie not found")
+        if response.status == 200 and response.content_length is not None:
+            return remember_file_metadata(movie_path, response.content_length, response.headers)
+    
+    # Some NAS web servers do not answer HEAD; a one-byte range reveals the size
+    async with session.get(
+        nas_file_url(movie_path), auth=auth, headers={"Range": "bytes=0-0"}, timeout=15, trace_request_ctx=trace
+    ) as response:
+        if response.status == 404:
+            raise HTTPException(status_code=404, detail="Movie not found")
+        match = re.fullmatch(r"bytes \d+-\d+/(\d+)", response.headers.get("content-range", ""))
+        if response.status == 206 and match:
+            return remember_file_metadata(movie_path, int(match.group(1)), response.headers)
+        if response.status == 200 and response.content_length is not None:
+            return remember_file_metadata(movie_path, response.content_length, response.headers)
+    raise HTTPException(status_code=502, detail="NAS did not report the file size")
+
+def metadata_headers(metadata):
+    """Validator and entity headers shared by every response for a file"""
+    headers = {
+        'Content-Type': metadata["content_type"],
+        'Accept-Ranges': 'bytes',
+        'ETag': metadata["etag"],
+    }
+    if metadata["modified"] is not None:
+        headers['Last-Modified'] = formatdate(metadata["modified"], usegmt=True)
+    return headers
+
+def etag_matches(header, etag, weak=True):
+    """Compare an If-None-Match/If-Range list against an ETag"""
+    if header.strip() == "*":
+        return True
+    if not weak and etag.startswith("W/"):
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    if weak:
+        tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+        etag = etag[2:] if etag.startswith("W/") else etag
+    return etag in tags
+
+def not_modified(request, metadata):
+    """True when the client's cached copy is still current"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, metadata["etag"])
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and metadata["modified"] is not None:
+        try:
+            return int(metadata["modified"]) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def if_range_matches(request, metadata):
+    """True when a Range request applies to the current version of the file"""
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(('"', 'W/')):
+        return etag_matches(if_range, metadata["etag"], weak=False)
+    try:
+        return metadata["modified"] is not None and int(metadata["modified"]) == parsedate_to_datetime(if_range).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+def parse_range_header(range_header, size):
+    """Normalise a Range header against a file size
+
+    Returns (start, end) inclusive, or None when the header is malformed and
+    should be ignored. Multiple ranges and ranges past the end of the file are
+    answered with 416.
+    """
+    if not range_header:
+        return None
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    if "," in ranges:
+        raise HTTPException(status_code=416, detail="Multiple ranges are not supported",
+                            headers={'Content-Range': f'bytes */{size}'})
+    match = re.fullmatch(r"\s*(\d*)\s*-\s*(\d*)\s*", ranges)
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(size - int(last), 0), size - 1
+        if int(last) == 0:
+            start = size
+    else:
+        start, end = int(first), min(int(last) if last else size - 1, size - 1)
+        if last and int(last) < start:
+            return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={'Content-Range': f'bytes */{size}'})
+    return start, end
+
+# Upstream scheduling
+# Every NAS body read goes through one scheduler. It caps concurrent reads at
+# NAS_MAX_READS and, with NAS_MAX_BANDWIDTH set, paces bytes through a token
+# bucket. Waiting reads are served start-up/seek first, then steady playback,
+# then read-ahead; within a class each stream's share advances a weighted fair
+# queueing tag, so a client buffering far ahead cannot crowd out the others.
+# Proxied bodies (range cache bypassed) are paced but hold no read slot, since
+# they stay open for the whole film. ffmpeg jobs (thumbnails, HLS) read through
+# background shares, served after every viewer like read-ahead.
+SCHEDULER_PRIORITIES = ("startup", "playback", "readahead")
+
+class UpstreamShare:
+    """One stream's share of the NAS: its weight, and the rate it is getting"""
+
+    RATE_WINDOW = 5.0  # seconds the reported rate is averaged over
+
+    def __init__(self, scheduler, share_id, label, client=None, weight=1.0, background=False):
+        self.scheduler = scheduler
+        self.id = share_id
+        self.label = label
+        self.client = client
+        self.weight = weight
+        self.background = background
+        self.opened = time.monotonic()
+        self.bytes = 0
+        self.rate = 0.0
+        self.rate_at = self.opened
+        self.waited = 0.0
+        self.finish_tag = 0.0
+
+    def priority(self, readahead):
+        if self.background or readahead:
+            return 2
+        return 0 if self.bytes < NAS_STARTUP_BYTES else 1
+
+    def account(self, nbytes):
+        now = time.monotonic()
+        decay = math.exp(-(now - self.rate_at) / self.RATE_WINDOW)
+        self.rate = self.rate * decay + nbytes / self.RATE_WINDOW
+        self.rate_at = now
+        self.bytes += nbytes
+
+    def current_rate(self):
+        return self.rate * math.exp(-(time.monotonic() - self.rate_at) / self.RATE_WINDOW)
+
+    def close(self):
+        self.scheduler.shares.pop(self.id, None)
+
+    def describe(self):
+        return {
+            "id": self.id,
+            "label": self.label,
+            "client": self.client,
+            "weight": self.weight,
+            "background": self.background,
+            "priority": SCHEDULER_PRIORITIES[self.priority(False)],
+            "bytes": self.bytes,
+            "rate_bytes_per_second": round(self.current_rate()),
+            "waited_seconds": round(self.waited, 3),
+            "age_seconds": round(time.monotonic() - self.opened, 1),
+        }
+
+class UpstreamRead:
+    """A read on behalf of a share; a read-ahead is promoted once a viewer waits on it"""
+
+    def __init__(self, share, readahead=False):
+        self.share = share
+        self.readahead = readahead
+
+    def priority(self):
+        return self.share.priority(self.readahead)
+
+class UpstreamScheduler:
+    def __init__(self, max_reads=NAS_MAX_READS, bandwidth=NAS_MAX_BANDWIDTH, burst=NAS_BANDWIDTH_BURST):
+        self.max_reads = max_reads
+        self.bandwidth = bandwidth
+        self.burst = burst
+        self.shares = {}
+        self.ids = itertools.count(1)
+        self.background = UpstreamShare(self, 0, "background", background=True)
+        self.reads = 0
+        self.read_waiters = []  # [priority key, future, read]
+        self.byte_waiters = []  # [tag, start tag, nbytes, future, read]
+        self.sequence = itertools.count()
+        self.available_at = 0.0
+        self.virtual_time = 0.0
+        self.dispatcher = None
+
+    def open_share(self, label, client=None, weight=1.0, background=False):
+        share = UpstreamShare(self, next(self.ids), label, client, weight, background)
+        self.shares[share.id] = share
+        return share
+
+    def read(self, share=None, readahead=False):
+        if share is None:
+            return UpstreamRead(self.background, readahead=True)
+        return UpstreamRead(share, readahead)
+
+    @staticmethod
+    def _waited(read, started):
+        waited = time.monotonic() - started
+        read.share.waited += waited
+        NAS_SCHEDULER_WAIT_SECONDS.observe(waited, priority=SCHEDULER_PRIORITIES[read.priority()])
+
+    # Read slots
+    async def acquire_read(self, read):
+        if self.reads < self.max_reads and not self.read_waiters:
+            self.reads += 1
+            return
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self.read_waiters.append([next(self.sequence), future, read])
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted as we were cancelled: hand the slot on
+                self.release_read()
+            raise
+        self._waited(read, started)
+
+    def release_read(self):
+        self.reads -= 1
+        self._grant_reads()
+
+    def _grant_reads(self):
+        while self.read_waiters and self.reads < self.max_reads:
+            # Priorities are read now, so a promoted read-ahead moves up
+            waiter = min(self.read_waiters, key=lambda w: (w[2].priority(), w[2].share.finish_tag, w[0]))
+            self.read_waiters.remove(waiter)
+            if not waiter[1].cancelled():
+                self.reads += 1
+                waiter[1].set_result(None)
+
+    @asynccontextmanager
+    async def reading(self, read):
+        """Hold one of the NAS_MAX_READS read slots"""
+        await self.acquire_read(read)
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    # Bandwidth
+    async def transfer(self, read, nbytes):
+        """Account nbytes read for a share, waiting for its turn when bandwidth is limited"""
+        share = read.share
+        if not self.bandwidth:
+            share.account(nbytes)
+            return
+        start = max(share.finish_tag, self.virtual_time)
+        share.finish_tag = start + nbytes / share.weight
+        now = time.monotonic()
+        if not self.byte_waiters and self.available_at <= now:
+            self._grant(read, nbytes, start, now)
+            return
+        started = now
+        future = asyncio.get_running_loop().create_future()
+        self.byte_waiters.append([share.finish_tag, start, nbytes, future, read])
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        await future
+        self._waited(read, started)
+
+    def _grant(self, read, nbytes, start, now):
+        self.available_at = max(self.available_at, now - self.burst) + nbytes / self.bandwidth
+        self.virtual_time = max(self.virtual_time, start)
+        read.share.account(nbytes)
+
+    async def _dispatch(self):
+        while self.byte_waiters:
+            delay = self.available_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            waiter = min(self.byte_waiters, key=lambda w: (w[4].priority(), w[0]))
+            self.byte_waiters.remove(waiter)
+            tag, start, nbytes, future, read = waiter
+            if future.cancelled():
+                continue
+            self._grant(read, nbytes, start, time.monotonic())
+            future.set_result(None)
+
+    def resize(self, max_reads, bandwidth):
+        """Change the limits, e.g. as workers come and go"""
+        self.max_reads = max_reads
+        self.bandwidth = bandwidth
+        self._grant_reads()
+
+    def describe(self):
+        return {
+            "max_reads": self.max_reads,
+            "active_reads": self.reads,
+            "waiting_reads": len(self.read_waiters),
+            "bandwidth_bytes_per_second": self.bandwidth or None,
+            "waiting_transfers": len(self.byte_waiters),
+            "streams": [share.describe() for share in [*self.shares.values(), self.background]],
+        }
+
+# Each worker schedules its own reads: the NAS limits are split between them by
+# share_nas_limits once they have counted each other
+nas_scheduler = UpstreamScheduler()
+
+# Range cache
+# Movie bytes are cached on local disk in fixed, block-aligned pieces, so a seek,
+# a replay or a second viewer of the same film reads the NAS only once.
+class ChunkCacheBypass(Exception):
+    """Raised when a request cannot be served block by block and must be proxied as is"""
+
+class FileChanged(Exception):
+    """Raised when the NAS sends a different version of a file than the one being served"""
+
+class ReadAhead:
+    """Detects sequential block reads per viewer and file, and sizes their prefetch window
+
+    The window doubles whenever the viewer had to wait for a block and shrinks
+    by one block after a full window of reads that were already there, so it
+    settles at the depth the NAS currently needs to stay ahead of playback.
+    """
+
+    MAX_STREAMS = 256
+
+    def __init__(self, min_blocks=READAHEAD_MIN_BLOCKS, max_blocks=READAHEAD_MAX_BLOCKS):
+        self.min_blocks = min_blocks
+        self.max_blocks = max_blocks
+        self.streams = OrderedDict()  # (reader, file key) -> state, least recently used first
+
+    def advance(self, stream, index, stalled):
+        """Record a read of block index and return the block indexes to prefetch"""
+        state = self.streams.pop(stream, None) or {
+            "next": None, "streak": 0, "window": self.min_blocks, "ready": 0,
+        }
+        self.streams[stream] = state
+        if len(self.streams) > self.MAX_STREAMS:
+            self.streams.popitem(last=False)
+        
+        if state["next"] is not None and state["next"] - 1 <= index <= state["next"]:
+            state["streak"] += index == state["next"]
+        else:
+            # A seek: start over with a small window
+            state["streak"] = 0
+            state["window"] = self.min_blocks
+        state["next"] = index + 1
+        
+        if stalled:
+            state["window"] = min(state["window"] * 2, self.max_blocks)
+            state["ready"] = 0
+        else:
+            state["ready"] += 1
+            if state["ready"] >= state["window"]:
+                state["window"] = max(state["window"] - 1, self.min_blocks)
+                state["ready"] = 0
+        
+        if not state["streak"]:
+            return range(0)
+        return range(index + 1, index + 1 + state["window"])
+
+# Workers sharing CACHE_DIR use one set of block files. A block missing from a
+# worker's index may have been written by another, and is picked up from disk;
+# a byte-range lock per block stripe keeps two workers from fetching the same
+# block at once. Eviction is then left to the elected worker's sweep, which goes
+# by file mtimes that every hit refreshes.
+FETCH_LOCK_STRIPES = 4096
+FETCH_LOCK_TIMEOUT = 30
+
+class ChunkCache:
+    """Disk-backed, block-aligned read-through cache of NAS files with LRU eviction"""
+
+    def __init__(self, directory, block_size=CHUNK_CACHE_BLOCK_SIZE, max_bytes=CHUNK_CACHE_MAX_BYTES, shared=False):
+        self.directory = Path(directory)
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.fetch_locks = None  # file holding the cross-worker fetch locks
+        self.stripe_locks = {}  # stripe -> asyncio.Lock of this worker's fetches in it
+        self.blocks = OrderedDict()  # (file key, block index) -> size, least recently used first
+        self.total_bytes = 0
+        self.files = {}  # file key -> {"size": ..., "content_type": ...}
+        self.versions = {}  # movie path -> file key of its latest version seen
+        self.inflight = {}  # (file key, block index) -> fetch task
+        self.inflight_reads = {}  # (file key, block index) -> UpstreamRead of the fetch
+        self.read_ahead = ReadAhead()
+        self.bypassed = set()  # movie paths the NAS will not serve in ranges
+        self.prefetching = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def serves(self, movie_path):
+        return self.enabled and movie_path not in self.bypassed
+
+    @staticmethod
+    def file_key(movie_path, version):
+        """Key of the blocks of one version (ETag) of a file, so a rewritten file never reuses them"""
+        return hashlib.sha1(f"{movie_path}\n{version}".encode()).hexdigest()
+
+    def block_file(self, key, index):
+        return self.directory / f"{key}.{index}.blk"
+
+    def meta_file(self, key):
+        return self.directory / f"{key}.json"
+
+    def load(self):
+        """Index the blocks left on disk by a previous run, oldest first"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.shared:
+            self.fetch_locks = open(self.directory / "fetch.lock", "a+b")
+        for meta in self.directory.glob("*.json"):
+            try:
+                self.files[meta.stem] = json.loads(meta.read_text())
+            except (OSError, ValueError):
+                meta.unlink(missing_ok=True)
+        blocks = sorted(self.directory.glob("*.blk"), key=lambda block: block.stat().st_mtime)
+        for block in blocks:
+            key, index, _ = block.name.split(".")
+            if key not in self.files:
+                block.unlink(missing_ok=True)
+                continue
+            size = block.stat().st_size
+            self.blocks[(key, int(index))] = size
+            self.total_bytes += size
+        self._evict()
+        logging.info(f"Range cache: {len(self.blocks)} blocks, {self.total_bytes} bytes in {self.directory}")
+
+    def _evict(self):
+        if self.shared:
+            # Other workers' blocks count too: left to sweep_cache_directory,
+            # which reconcile then catches this index up with
+            return
+        while self.total_bytes > self.max_bytes and self.blocks:
+            (key, index), size = self.blocks.popitem(last=False)
+            self.total_bytes -= size
+            self.block_file(key, index).unlink(missing_ok=True)
+
+    def scan_blocks(self):
+        """Return {(file key, block index): size} of the blocks on disk, whichever worker wrote them"""
+        blocks = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                # Half-written blocks are named key.index.blk.pid.tmp
+                key, _, rest = entry.name.partition(".")
+                index, _, suffix = rest.partition(".")
+                if suffix != "blk" or not index.isdigit():
+                    continue
+                try:
+                    blocks[(key, int(index))] = entry.stat().st_size
+                except FileNotFoundError:
+                    continue
+        return blocks
+
+    def reconcile(self, on_disk):
+        """Drop the blocks the sweep deleted from the index, and count every worker's blocks in total_bytes"""
+        for block in [block for block in self.blocks if block not in on_disk]:
+            del self.blocks[block]
+        self.total_bytes = sum(on_disk.values())
+
+    def _forget_file(self, key):
+        """Drop every block of a file, e.g. because it changed on the NAS"""
+        for block in [block for block in self.blocks if block[0] == key]:
+            self.total_bytes -= self.blocks.pop(block)
+            self.block_file(*block).unlink(missing_ok=True)
+        if self.shared:
+            for path in self.directory.glob(f"{key}.*.blk"):
+                path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _write_file(path, data):
+        # Written aside under a name of this process, then renamed: readers, and
+        # other workers, only ever see complete files
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _write_block(self, key, index, data):
+        self._write_file(self.block_file(key, index), data)
+
+    def _read_block(self, key, index, offset, length):
+        # Map the block instead of read()ing it: the slice is copied once,
+        # straight from the page cache
+        with open(self.block_file(key, index), "rb") as f:
+            if self.shared:
+                # Marks the block as recently used for the sweep
+                os.utime(f.fileno())
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[offset:offset + length]
+
+    def _read_shared_block(self, key, index):
+        """Return (data, meta) of a block another worker cached, or None"""
+        try:
+            meta = self.files.get(key) or json.loads(self.meta_file(key).read_text())
+            return self.block_file(key, index).read_bytes(), meta
+        except (OSError, ValueError):
+            return None
+
+    @asynccontextmanager
+    async def worker_fetch_lock(self, key, index):
+        """Hold the cross-worker lock of a block's stripe, or give up waiting after FETCH_LOCK_TIMEOUT"""
+        # Not hash(): string hashes differ from one process to the next
+        stripe = (int(key[:8], 16) + index) % FETCH_LOCK_STRIPES
+        deadline = time.monotonic() + FETCH_LOCK_TIMEOUT
+        # lockf locks belong to the process, which would let every fetch of this
+        # worker through at once: they queue on an asyncio lock of the stripe first
+        stripe_lock = self.stripe_locks.setdefault(stripe, asyncio.Lock())
+        try:
+            await asyncio.wait_for(stripe_lock.acquire(), FETCH_LOCK_TIMEOUT)
+            held = True
+        except asyncio.TimeoutError:
+            held = False
+        locked = False
+        while held and not locked and time.monotonic() < deadline:
+            try:
+                fcntl.lockf(self.fetch_locks, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, stripe)
+                locked = True
+            except OSError:
+                await asyncio.sleep(0.02)
+        try:
+            yield
+        finally:
+            if locked:
+                fcntl.lockf(self.fetch_locks, fcntl.LOCK_UN, 1, stripe)
+            if held:
+                stripe_lock.release()
+
+    async def _fetch_block(self, movie_path, version, key, index, read):
+        if not self.shared:
+            return await self._download_block(movie_path, version, key, index, read)
+        async with self.worker_fetch_lock(key, index):
+            found = await asyncio.to_thread(self._read_shared_block, key, index)
+            if found is None:
+                return await self._download_block(movie_path, version, key, index, read)
+        data, meta = found
+        CACHE_REQUESTS.inc(cache="range", result="shared")
+        self.files.setdefault(key, meta)
+        if (key, index) not in self.blocks:
+            self.blocks[(key, index)] = len(data)
+            self.total_bytes += len(data)
+        return data
+
+    async def _download_block(self, movie_path, version, key, index, read):
+        start = index * self.block_size
+        end = start + self.block_size - 1
+        async with nas_scheduler.reading(read), get_nas_session().get(
+            nas_file_url(movie_path),
+            auth=aiohttp.BasicAuth(NAS_USERNAME, NAS_PASSWORD),
+            headers={"Range": f"bytes={start}-{end}"},
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30),
+            trace_request_ctx={"kind": "block"},
+        ) as response:
+            if response.status == 404:
+                raise HTTPException(status_code=404, detail="Movie not found")
+            if response.status != 206:
+                self.bypassed.add(movie_path)
+                raise ChunkCacheBypass(f"NAS answered a block request with HTTP {response.status}")
+            match = re.fullmatch(r"bytes \d+-\d+/(\d+)", response.headers.get("content-range", ""))
+            if not match:
+                raise ChunkCacheBypass("NAS did not report the file size")
+            started = time.perf_counter()
+            if nas_scheduler.bandwidth:
+                # Paced chunk by chunk, so the block does not go out in one burst
+                data = bytearray()
+                async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                    await nas_scheduler.transfer(read, len(chunk))
+                    data += chunk
+                data = bytes(data)
+            else:
+                data = await response.read()
+                await nas_scheduler.transfer(read, len(data))
+            elapsed = time.perf_counter() - started
+            NAS_READ_BYTES.inc(len(data), kind="block")
+            NAS_READ_SECONDS.inc(elapsed, kind="block")
+            if elapsed > 0:
+                NAS_BLOCK_THROUGHPUT.observe(len(data) / elapsed)
+            metadata = remember_file_metadata(movie_path, int(match.group(1)), response.headers)
+            meta = {
+                "size": int(match.group(1)),
+                "content_type": response.headers.get("content-type", "video/mp4"),
+            }
+        
+        if metadata["etag"] != version:
+            # Rewritten since its headers were sent: these bytes belong to another version
+            raise FileChanged(f"{movie_path} changed on the NAS while it was being served")
+        previous = self.versions.get(movie_path)
+        if previous is not None and previous != key:
+            logging.info(f"{movie_path} changed on the NAS, dropping its cached blocks")
+            self._forget_file(previous)
+        self.versions[movie_path] = key
+        if self.files.get(key) != meta:
+            self.files[key] = meta
+            await asyncio.to_thread(self._write_file, self.meta_file(key), json.dumps(meta).encode())
+        await asyncio.to_thread(self._write_block, key, index, data)
+        if (key, index) not in self.blocks:
+            self.blocks[(key, index)] = len(data)
+            self.total_bytes += len(data)
+            self._evict()
+        return data
+
+    def _fetch_done(self, block, task):
+        self.inflight.pop(block, None)
+        self.inflight_reads.pop(block, None)
+        if not task.cancelled() and task.exception():
+            logging.warning(f"Range cache fetch of block {block[1]} failed: {task.exception()}")
+
+    async def read_block(self, movie_path, version, index, offset=0, length=None, share=None):
+        """Return part of a block of one version of a file, from disk when cached, otherwise from a single shared NAS fetch"""
+        key = self.file_key(movie_path, version)
+        length = self.block_size if length is None else length
+        if (key, index) in self.blocks:
+            self.blocks.move_to_end((key, index))
+            try:
+                data = await asyncio.to_thread(self._read_block, key, index, offset, length)
+                self.hits += 1
+                CACHE_REQUESTS.inc(cache="range", result="hit")
+                return data
+            except FileNotFoundError:
+                self.total_bytes -= self.blocks.pop((key, index), 0)
+        
+        self.misses += 1
+        CACHE_REQUESTS.inc(cache="range", result="miss")
+        # Concurrent readers of the same block wait on one upstream request
+        task = self.inflight.get((key, index))
+        if task is None:
+            task = self._start_fetch(movie_path, version, key, index, nas_scheduler.read(share))
+        elif share is not None and self.inflight_reads[(key, index)].readahead:
+            # A viewer is now waiting on this read-ahead: it is no longer background work
+            read = self.inflight_reads[(key, index)]
+            read.share, read.readahead = share, False
+        data = await asyncio.shield(task)
+        return data[offset:offset + length]
+
+    def _start_fetch(self, movie_path, version, key, index, read):
+        task = asyncio.create_task(self._fetch_block(movie_path, version, key, index, read))
+        self.inflight[(key, index)] = task
+        self.inflight_reads[(key, index)] = read
+        task.add_done_callback(partial(self._fetch_done, (key, index)))
+        return task
+
+    def prefetch(self, movie_path, version, index, share=None):
+        """Fetch a block in the background unless it is cached, on its way or too many are"""
+        key = self.file_key(movie_path, version)
+        if (key, index) in self.blocks or (key, index) in self.inflight:
+            return
+        if self.prefetching >= READAHEAD_CONCURRENCY:
+            return
+        self.prefetching += 1
+        self.prefetches += 1
+        task = self._start_fetch(movie_path, version, key, index, nas_scheduler.read(share, readahead=True))
+        task.add_done_callback(self._prefetch_done)
+
+    def _prefetch_done(self, task):
+        self.prefetching -= 1
+
+    async def iter_range(self, movie_path, version, start, end, size, reader=None, share=None):
+        """Yield the bytes start..end (inclusive) of a file version block by block, reading ahead of sequential viewers"""
+        key = self.file_key(movie_path, version)
+        last_block = (size - 1) // self.block_size
+        position = start
+        while position <= end:
+            index, offset = divmod(position, self.block_size)
+            length = min(self.block_size - offset, end - position + 1)
+            started = time.monotonic()
+            data = await self.read_block(movie_path, version, index, offset, length, share)
+            if not data:
+                break
+            stalled = time.monotonic() - started > READAHEAD_STALL_SECONDS
+            for ahead in self.read_ahead.advance((reader, key), index, stalled):
+                if ahead > last_block:
+                    break
+                self.prefetch(movie_path, version, ahead, share)
+            yield data
+            position += len(data)
+
+chunk_cache = ChunkCache(CACHE_DIR / "chunks", shared=True)
+
+class ShareStreamResponse(StreamingResponse):
+    """Streaming response that closes its NAS share however it ends
+
+    metered_stream closes it too, but only once the body has started: a
+    response dropped before that would leave the share in /api/streams.
+    """
+
+    def __init__(self, content, share, **kwargs):
+        self.share = share
+        super().__init__(content, **kwargs)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.share.close()
+
+class NASStreamResponse(ShareStreamResponse):
+    """Streaming response that forwards an upstream NAS body and always hands its connection back"""
+
+    def __init__(self, upstream: aiohttp.ClientResponse, share, chunk_size: int = STREAM_CHUNK_SIZE, **kwargs):
+        self.upstream = upstream
+        self.read = nas_scheduler.read(share)
+        super().__init__(metered_stream(self.iter_upstream(chunk_size), "nas", share), share, **kwargs)
+
+    async def iter_upstream(self, chunk_size: int):
+        # Each chunk is only read once the previous one has been sent, so a slow
+        # client throttles the NAS read instead of buffering the film in memory.
+        # Only the wait for the NAS is timed, not the time spent sending.
+        chunks = self.upstream.content.iter_chunked(chunk_size).__aiter__()
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            NAS_READ_SECONDS.inc(time.perf_counter() - started, kind="stream")
+            NAS_READ_BYTES.inc(len(chunk), kind="stream")
+            await nas_scheduler.transfer(self.read, len(chunk))
+            yield chunk
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # A client disconnect cancels the send loop; drop the half-read upstream
+            # connection, otherwise return the fully read one to the keep-alive pool
+            if self.upstream.content.at_eof():
+                self.upstream.release()
+            else:
+                self.upstream.close()
+
+# Storage backends
+# Folder listings, file metadata and movie bytes come from a Storage: the NAS web
+# server over HTTP, or a local CIFS/NFS mount of its shares when NAS_MOUNT_ROOT
+# is set. The mount skips the second HTTP hop, Basic auth and the range cache,
+# and hands files to the kernel with sendfile where the ASGI server supports it.
+# Whenever the mount stops answering, the same call is retried over HTTP.
+class StorageUnavailable(Exception):
+    """The storage cannot be used right now; the caller falls back to HTTP"""
+
+class FolderListing:
+    def __init__(self, folder_path, movies, folders):
+        self.folder_path = folder_path
+        self.movies = movies
+        self.folders = folders
+
+class Storage(ABC):
+    """Where folder listings and movie bytes are read from"""
+    name = None
+
+    @abstractmethod
+    async def list_folder(self, folder_path):
+        """Return the movies and subfolders of a folder (an object with .movies and .folders)"""
+
+    @abstractmethod
+    async def file_metadata(self, movie_path):
+        """Return the size, mtime, content type and ETag of a file"""
+
+    @abstractmethod
+    async def read_range(self, movie_path, offset, length):
+        """Return (data, total size) for length bytes at offset of a file"""
+
+    @abstractmethod
+    async def stream(self, movie_path, request, start, end, size, status_code, headers, share):
+        """Return the response sending bytes start..end (inclusive) of a file, closing share when done"""
+
+class HTTPStorage(Storage):
+    """The NAS web server, through the shared session, range cache and circuit breaker"""
+    name = "http"
+
+    async def list_folder(self, folder_path):
+        return await fetch_nas_folder(folder_path)
+
+    async def file_metadata(self, movie_path):
+        return await get_file_metadata(movie_path.lstrip("/"))
+
+    async def read_range(self, movie_path, offset, length):
+        return await read_nas_range(movie_path, offset, length)
+
+    async def stream(self, movie_path, request, start, end, size, status_code, headers, share):
+        return await stream_from_nas(movie_path.lstrip("/"), request, start, end, size, status_code, headers, share)
+
+class LocalFileResponse(StreamingResponse):
+    """Sends a byte range of an open local file, zero-copy when the ASGI server offers it"""
+
+    def __init__(self, file, start, end, share, **kwargs):
+        self.file = file
+        self.start = start
+        self.end = end
+        self.share = share
+        super().__init__(metered_stream(self.iter_file(), "mount", share), **kwargs)
+
+    async def iter_file(self):
+        # The mount reads the same NAS disks and link, so it is paced like HTTP reads
+        read = nas_scheduler.read(self.share)
+        position = self.start
+        while position <= self.end:
+            length = min(NAS_MOUNT_READ_SIZE, self.end - position + 1)
+            async with nas_scheduler.reading(read):
+                data = await asyncio.to_thread(os.pread, self.file.fileno(), length, position)
+            if not data:
+                break
+            await nas_scheduler.transfer(read, len(data))
+            yield data
+            position += len(data)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            if "http.response.zerocopy" not in scope.get("extensions", {}):
+                return await super().__call__(scope, receive, send)
+            # The server sendfile()s straight from the page cache to the socket
+            # Handed to the kernel in one piece, so not paced by the scheduler
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            count = self.end - self.start + 1
+            ACTIVE_STREAMS.inc(source="mount")
+            try:
+                await send({"type": "http.response.zerocopy", "file": self.file, "offset": self.start, "count": count})
+                STREAM_BYTES.inc(count, source="mount")
+            finally:
+                ACTIVE_STREAMS.dec(source="mount")
+        finally:
+            self.file.close()
+            self.share.close()
+
+class LocalMountStorage(Storage):
+    """A local mount of the NAS shares; NAS path /Films/a.mkv is root/Films/a.mkv"""
+    name = "mount"
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.checked_at = 0.0
+        self.up = False
+
+    async def available(self):
+        """Whether the mount answered its last check, re-checked every NAS_MOUNT_CHECK_INTERVAL"""
+        if time.monotonic() - self.checked_at >= NAS_MOUNT_CHECK_INTERVAL:
+            self.checked_at = time.monotonic()
+            try:
+                # A hard CIFS/NFS mount can block for minutes when the server is gone
+                await asyncio.wait_for(asyncio.to_thread(self._check), NAS_MOUNT_TIMEOUT)
+                self._set_up(True)
+            except (OSError, asyncio.TimeoutError) as e:
+                if self.up:
+                    logging.warning(f"NAS mount {self.root} is not answering, using HTTP: {e}")
+                self._set_up(False)
+        return self.up
+
+    def _check(self):
+        with os.scandir(self.root) as entries:
+            next(entries, None)
+
+    def _set_up(self, up):
+        if up and not self.up:
+            logging.info(f"Reading the NAS shares from {self.root}")
+        self.up = up
+        NAS_MOUNT_UP.set(1 if up else 0)
+
+    def resolve(self, nas_path):
+        """Return the local path of a NAS path, refusing anything outside the mount"""
+        parts = [part for part in nas_path.split("/") if part]
+        if any(part in (".", "..") for part in parts):
+            raise HTTPException(status_code=404, detail="Movie not found")
+        return self.root.joinpath(*parts)
+
+    async def run(self, func, *args):
+        """Run blocking filesystem work off the event loop; a failing mount is marked down"""
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(func, *args), NAS_MOUNT_TIMEOUT)
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            raise
+        except (OSError, asyncio.TimeoutError) as e:
+            self._set_up(False)
+            self.checked_at = time.monotonic()
+            raise StorageUnavailable(f"NAS mount {self.root} failed: {e}") from e
+
+    def _scan(self, folder_path):
+        movies, folders = [], []
+        with os.scandir(self.resolve(folder_path)) as entries:
+            for entry in entries:
+                if entry.name.startswith((".", "@")):
+                    # .DS_Store, @eaDir and similar NAS bookkeeping
+                    continue
+                if entry.is_dir():
+                    folders.append(entry.name)
+                    continue
+                extension = entry.name.rsplit(".", 1)[-1].lower()
+                if extension not in VIDEO_EXTENSIONS or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                movies.append(Movie(
+                    name=entry.name,
+                    path=f"/{folder_path}/{entry.name}",
+                    format=extension,
+                    size=stat.st_size,
+                    modified=datetime.utcfromtimestamp(int(stat.st_mtime)),
+                ))
+        return FolderListing(folder_path, movies, folders)
+
+    async def list_folder(self, folder_path):
+        return await self.run(self._scan, folder_path)
+
+    async def file_metadata(self, movie_path):
+        # Cached like HTTP metadata, under a key of its own
+        key = ("mount", movie_path)
+        metadata = file_metadata.get(key)
+        if metadata and time.monotonic() < metadata["expires"]:
+            CACHE_REQUESTS.inc(cache="metadata", result="hit")
+            return metadata
+        CACHE_REQUESTS.inc(cache="metadata", result="miss")
+        try:
+            stat = await self.run(os.stat, self.resolve(movie_path))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Movie not found")
+        metadata = file_metadata[key] = make_file_metadata(movie_path, stat.st_size, stat.st_mtime)
+        return metadata
+
+    def _read(self, path, offset, length):
+        with open(path, "rb") as file:
+            return os.pread(file.fileno(), length, offset), os.fstat(file.fileno()).st_size
+
+    async def read_range(self, movie_path, offset, length):
+        return await self.run(self._read, self.resolve(movie_path), offset, length)
+
+    async def stream(self, movie_path, request, start, end, size, status_code, headers, share):
+        try:
+            file = await self.run(open, self.resolve(movie_path), "rb")
+        except (FileNotFoundError, IsADirectoryError):
+            raise HTTPException(status_code=404, detail="Movie not found")
+        return LocalFileResponse(file, start, end, share, status_code=status_code, headers=headers)
+
+http_storage = HTTPStorage()
+mount_storage = LocalMountStorage(NAS_MOUNT_ROOT) if NAS_MOUNT_ROOT else None
+
+async def get_storage():
+    """The local mount when configured and answering, otherwise the NAS web server"""
+    if mount_storage and await mount_storage.available():
+        return mount_storage
+    return http_storage
+
+async def on_storage(operation, name):
+    """Await operation(storage) on the current storage, retrying over HTTP if the mount fails"""
+    storage = await get_storage()
+    try:
+        return await operation(storage)
+    except StorageUnavailable as e:
+        logging.warning(f"{e}; retrying {name} over HTTP")
+        STORAGE_FALLBACKS.inc(operation=name)
+        return await operation(http_storage)
+
+async def list_nas_folder(folder_path):
+    """List a NAS folder through the current storage"""
+    return await on_storage(lambda storage: storage.list_folder(folder_path), "listing")
+
+async def read_movie_range(movie_path, offset, length):
+    """Read length bytes at offset of a movie through the current storage"""
+    return await on_storage(lambda storage: storage.read_range(movie_path, offset, length), "read")
+
+def api_self_url(request):
+    """Base URL this API answers on, for ffmpeg to read movies back from"""
+    if API_SELF_URL:
+        return API_SELF_URL.rstrip("/")
+    server = request.scope.get("server")
+    if not server or server[1] is None:
+        raise HTTPException(status_code=500, detail="Set API_SELF_URL so ffmpeg can read movies from this API")
+    host, port = server
+    if host in ("0.0.0.0", "::"):
+        host = "127.0.0.1"
+    elif ":" in host:
+        host = f"[{host}]"
+    return f"http://{host}:{port}"
+
+async def movie_ffmpeg_input(movie_path, api_url):
+    """Return the URL ffmpeg reads a movie from: this API, as background work of the NAS scheduler
+
+    Its reads then go through the range cache (or the mount) and are paced
+    like any stream, after every viewer's.
+    """
+    if await get_storage() is http_storage:
+        # Fail fast while the NAS is down instead of leaving ffmpeg to time out
+        nas_breaker.check()
+    return f"{api_url}/api/stream/by-id/{movie_id_for_path(movie_path)}?background=true"
+
+# Registered first so by-id is not taken for a folder of /stream/{movie_path}
+@api_router.api_route("/stream/by-id/{movie_id}", methods=["GET", "HEAD"])
+async def stream_movie_by_id(
+    movie_id: str,
+    request: Request,
+    background: bool = Query(default=False, description="Read after every viewer, as ffmpeg jobs do"),
+):
+    """Stream a catalog movie by id, without quoting its path into the URL"""
+    movie_path = await get_movie_path(movie_id)
+    return await stream_movie(movie_path.lstrip("/"), request, background)
+
+@api_router.api_route("/stream/{movie_path:path}", methods=["GET", "HEAD"])
+async def stream_movie(
+    movie_path: str,
+    request: Request,
+    background: bool = Query(default=False, description="Read after every viewer, as ffmpeg jobs do"),
+):
+    """Stream movie from NAS"""
+    return await on_storage(lambda storage: serve_movie(storage, movie_path, request, background), "stream")
+
+async def serve_movie(storage, movie_path, request, background=False, retried=False):
+    """Answer a movie request from one storage, honouring conditional and Range headers"""
+    try:
+        metadata = await storage.file_metadata(movie_path)
+    except (HTTPException, StorageUnavailable):
+        raise
+    except Exception as e:
+        logging.error(f"Error streaming movie: {e}")
+        raise HTTPException(status_code=500, detail=f"Streaming error: {str(e)}")
+    
+    size = metadata["size"]
+    response_headers = metadata_headers(metadata)
+    if not_modified(request, metadata):
+        return Response(status_code=304, headers=response_headers)
+    
+    # Get range header for seeking support; a stale If-Range asks for the whole file
+    byte_range = None
+    if if_range_matches(request, metadata):
+        byte_range = parse_range_header(request.headers.get('range'), size)
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        start, end = 0, size - 1
+        status_code = 200
+    response_headers['Content-Length'] = str(end - start + 1)
+    
+    if request.method == "HEAD" or size == 0:
+        return Response(status_code=status_code, headers=response_headers)
+    
+    client = request.client.host if request.client else None
+    share = nas_scheduler.open_share(movie_path, client, background=background)
+    try:
+        return await storage.stream(movie_path, request, start, end, size, status_code, response_headers, share)
+    except FileChanged as e:
+        share.close()
+        if retried:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+        # The fetch refreshed the metadata: answer again, validators included, for the new version
+        logging.info(f"{e}; serving the new version")
+        return await serve_movie(storage, movie_path, request, background, retried=True)
+    except BaseException:
+        share.close()
+        raise
+
+async def stream_from_nas(movie_path, request, start, end, size, status_code, response_headers, share):
+    """Send bytes start..end of a NAS file, from the range cache or proxied from the web server"""
+    byte_range = status_code == 206
+    if chunk_cache.serves(movie_path):
+        # Blocks are cached per version, the one the response headers announce
+        version = response_headers['ETag']
+        try:
+            # Fetch the first block now so NAS errors still become a proper status
+            await chunk_cache.read_block(movie_path, version, start // chunk_cache.block_size, length=0, share=share)
+            reader = request.client.host if request.client else None
+            return ShareStreamResponse(
+                metered_stream(
+                    chunk_cache.iter_range(movie_path, version, start, end, size, reader, share), "cache", share
+                ),
+                share,
+                status_code=status_code,
+                headers=response_headers,
+            )
+        except ChunkCacheBypass as e:
+            logging.info(f"Proxying {movie_path} without the range cache: {e}")
+        except (HTTPException, FileChanged):
+            raise
+        except Exception as e:
+            logging.error(f"Error streaming movie: {e}")
+            raise HTTPException(status_code=500, detail=f"Streaming error: {str(e)}")
+    
+    headers = {}
+    if byte_range:
+        headers['Range'] = f'bytes={start}-{end}'
+    
+    try:
+        # Stream from NAS over the shared keep-alive pool
+        upstream = await get_nas_session().get(
+            nas_file_url(movie_path),
+            auth=aiohttp.BasicAuth(NAS_USERNAME, NAS_PASSWORD),
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30),
+            trace_request_ctx={"kind": "stream"},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error streaming movie: {e}")
+        raise HTTPException(status_code=500, detail=f"Streaming error: {str(e)}")
+    
+    if upstream.status not in [200, 206]:
+        upstream.release()
+        raise HTTPException(status_code=404, detail="Movie not found")
+    if byte_range and upstream.status != 206:
+        # The NAS ignored the range: relay the whole file as a plain 200
+        status_code = 200
+        response_headers.pop('Content-Range')
+    if upstream.content_length is not None:
+        response_headers['Content-Length'] = str(upstream.content_length)
+    else:
+        response_headers.pop('Content-Length')
+    
+    return NASStreamResponse(upstream, share, status_code=status_code, headers=response_headers)
+
+@api_router.post("/catalog/rescan")
+async def rescan_catalog(folder: str = Query(default="Films")):
+    """Rescan a NAS folder into the catalog now"""
+    try:
+        return {"folder": folder, **await rescan_folder(folder)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error rescanning catalog: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to rescan catalog: {str(e)}")
+
+@api_router.get("/folders")
+async def get_folders(recursive: bool = Query(default=False, description="Walk the whole share tree")):
+    """Get available folders on NAS"""
+    try:
+        shares = await get_nas_shares()
+        if not recursive:
+            return {"folders": shares}
+        folders = [folder async for folder, listing, error in walk_nas_folders(shares) if not error]
+        return {"folders": sorted(folders)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get folders: {str(e)}")
+
+# Playback progress
+# Players report their position every few seconds. Each report only updates the
+# viewer's records in memory; changed records are written to MongoDB together in
+# one unordered bulk_write every PROGRESS_FLUSH_INTERVAL (sooner when
+# PROGRESS_MAX_PENDING pile up) and at shutdown, so a heartbeat is never a write
+# of its own. Reads are answered from memory, and "continue watching" walks a
+# per-viewer list of the unfinished records kept in update order instead of
+# scanning them all. Only the PROGRESS_MAX_VIEWERS most recently active viewers
+# are kept; the others are read again on their next request, once nothing of
+# theirs is left to write. With several workers, a viewer's heartbeats may land on any
+# of them, so each re-reads a viewer's records once they are a flush old.
+progress_collection = db.progress
+progress_task = None
+
+class ProgressStore:
+    """Playback positions by viewer and movie, held in memory and written to MongoDB in batches"""
+
+    def __init__(self, collection, shared=False, max_viewers=PROGRESS_MAX_VIEWERS):
+        self.collection = collection
+        self.shared = shared
+        self.max_viewers = max_viewers
+        self.loaded_at = {}   # viewer -> when their records were read
+        self.positions = OrderedDict()  # viewer -> {movie id: record}, least recently used first
+        self.watching = {}    # viewer -> resumable records by movie id, least recently updated first
+        self.pending = {}     # (viewer, movie id) -> record to write, or None to delete
+        self.load_locks = {}
+        self.flush_lock = asyncio.Lock()
+        self.flush_wanted = asyncio.Event()
+
+    @staticmethod
+    def resumable(record):
+        return not record["finished"] and record["position"] >= PROGRESS_MIN_SECONDS
+
+    async def load(self, viewer):
+        """Return the records of a viewer, read from MongoDB the first time"""
+        if viewer in self.positions and not self.expired(viewer):
+            self.positions.move_to_end(viewer)
+            return self.positions[viewer]
+        async with self.load_locks.setdefault(viewer, asyncio.Lock()):
+            try:
+                if viewer in self.positions and not self.expired(viewer):
+                    self.positions.move_to_end(viewer)
+                    return self.positions[viewer]
+                docs = [doc async for doc in self.collection.find({"viewer": viewer}, {"_id": 0}).sort("updated_at", 1)]
+                # Changes of this worker not written yet are newer than what MongoDB holds
+                mine = {movie_id: record for (owner, movie_id), record in self.pending.items() if owner == viewer}
+                docs = [doc for doc in docs if doc["movie_id"] not in mine]
+                docs += [record for record in mine.values() if record]
+                docs.sort(key=lambda doc: doc["updated_at"])
+                positions, watching = {}, OrderedDict()
+                for doc in docs:
+                    positions[doc["movie_id"]] = doc
+                    if self.resumable(doc):
+                        watching[doc["movie_id"]] = doc
+                self.positions[viewer], self.watching[viewer] = positions, watching
+                self.positions.move_to_end(viewer)
+                self.loaded_at[viewer] = time.monotonic()
+            finally:
+                self.load_locks.pop(viewer, None)
+        self.evict()
+        return self.positions[viewer]
+
+    def evict(self):
+        """Drop the least recently used viewers past max_viewers, keeping those with changes to write"""
+        excess = len(self.positions) - self.max_viewers
+        if excess <= 0:
+            return
+        busy = {viewer for viewer, _ in self.pending}
+        for viewer in list(itertools.islice(self.positions, len(self.positions) - 1)):
+            if excess <= 0:
+                break
+            if viewer in busy or viewer in self.load_locks:
+                continue
+            del self.positions[viewer]
+            del self.watching[viewer]
+            del self.loaded_at[viewer]
+            excess -= 1
+
+    def expired(self, viewer):
+        return self.shared and time.monotonic() - self.loaded_at[viewer] > PROGRESS_FLUSH_INTERVAL
+
+    async def get(self, viewer, movie_id):
+        return (await self.load(viewer)).get(movie_id)
+
+    async def record(self, viewer, movie_id, position, duration=None):
+        """Remember where a viewer is in a movie; written to MongoDB with the next batch"""
+        positions = await self.load(viewer)
+        previous = positions.get(movie_id)
+        duration = duration or (previous and previous.get("duration"))
+        if duration:
+            position = min(position, duration)
+        record = {
+            "viewer": viewer,
+            "movie_id": movie_id,
+            "position": position,
+            "duration": duration,
+            "finished": bool(duration) and position >= duration * PROGRESS_FINISHED_RATIO,
+            "updated_at": datetime.utcnow(),
+        }
+        positions[movie_id] = record
+        watching = self.watching[viewer]
+        watching.pop(movie_id, None)
+        if self.resumable(record):
+            watching[movie_id] = record
+        self.mark(viewer, movie_id, record)
+        PROGRESS_HEARTBEATS.inc()
+        return record
+
+    async def forget(self, viewer, movie_id):
+        """Drop a viewer's record of a movie; returns whether there was one"""
+        positions = await self.load(viewer)
+        if positions.pop(movie_id, None) is None:
+            return False
+        self.watching[viewer].pop(movie_id, None)
+        self.mark(viewer, movie_id, None)
+        return True
+
+    def mark(self, viewer, movie_id, record):
+        # A newer change of the same record replaces the one waiting to be written
+        self.pending[(viewer, movie_id)] = record
+        PROGRESS_PENDING.set(len(self.pending))
+        if len(self.pending) >= PROGRESS_MAX_PENDING:
+            self.flush_wanted.set()
+
+    async def continue_watching(self, viewer, limit, keep=None):
+        """Return up to limit resumable records of a viewer, most recently watched first"""
+        await self.load(viewer)
+        records = (record for record in reversed(self.watching[viewer].values()) if keep is None or keep(record))
+        return list(itertools.islice(records, limit))
+
+    async def flush(self):
+        """Write every pending change in one bulk_write; returns the number of records written"""
+        async with self.flush_lock:
+            if not self.pending:
+                return 0
+            batch, self.pending = self.pending, {}
+            operations = []
+            for (viewer, movie_id), record in batch.items():
+                key = {"viewer": viewer, "movie_id": movie_id}
+                if record is None:
+                    operations.append(DeleteOne(key))
+                else:
+                    operations.append(UpdateOne(key, {"$set": record}, upsert=True))
+            
+            started = time.perf_counter()
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+            except Exception:
+                # Retried with the next batch; every operation is idempotent, and a
+                # record reported again meanwhile is newer than the one that failed
+                for key, record in batch.items():
+                    self.pending.setdefault(key, record)
+                raise
+            finally:
+                PROGRESS_PENDING.set(len(self.pending))
+            PROGRESS_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            deleted = sum(1 for record in batch.values() if record is None)
+            PROGRESS_WRITES.inc(len(operations) - deleted, operation="upsert")
+            PROGRESS_WRITES.inc(deleted, operation="delete")
+            # Viewers kept only for their pending changes can go now
+            self.evict()
+            return len(operations)
+
+progress_store = ProgressStore(progress_collection, shared=True)
+
+async def init_progress():
+    """Create the progress indexes"""
+    try:
+        await progress_collection.create_index([("viewer", 1), ("movie_id", 1)], unique=True)
+        # Loads a viewer's records already in update order
+        await progress_collection.create_index([("viewer", 1), ("updated_at", 1)])
+    except Exception as e:
+        logging.error(f"Failed to create progress indexes: {e}")
+
+async def progress_flush_loop():
+    """Write pending progress every PROGRESS_FLUSH_INTERVAL, or as soon as enough piled up"""
+    await init_progress()
+    while True:
+        try:
+            await asyncio.wait_for(progress_store.flush_wanted.wait(), PROGRESS_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        progress_store.flush_wanted.clear()
+        try:
+            await progress_store.flush()
+        except Exception as e:
+            logging.error(f"Failed to write playback progress: {e}")
+
+@api_router.get("/progress", response_model=List[ContinueWatching])
+async def get_continue_watching(
+    viewer: str = Query(default="default", max_length=64),
+    limit: int = Query(default=20, ge=1, le=100),
+):
+    """Get the movies a viewer stopped partway through, most recently watched first"""
+    await ensure_catalog_index()
+    # Movies no longer on the NAS are skipped, not forgotten, in case they come back
+    records = await progress_store.continue_watching(
+        viewer, limit, keep=lambda record: record["movie_id"] in catalog_paths
+    )
+    docs = await catalog_collection.find(
+        {"id": {"$in": [record["movie_id"] for record in records]}}, {"_id": 0}
+    ).to_list(None)
+    by_id = {doc["id"]: doc for doc in docs}
+    return [
+        ContinueWatching(progress=Progress(**record), movie=catalog_movie(by_id[record["movie_id"]]))
+        for record in records if record["movie_id"] in by_id
+    ]
+
+@api_router.get("/progress/{movie_id}", response_model=Progress)
+async def get_progress(movie_id: str, viewer: str = Query(default="default", max_length=64)):
+    """Get where a viewer stopped in a movie"""
+    record = await progress_store.get(viewer, movie_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="No progress recorded")
+    return Progress(**record)
+
+@api_router.post("/progress/{movie_id}", response_model=Progress)
+async def report_progress(movie_id: str, update: ProgressUpdate):
+    """Record a player's position in a movie (heartbeat)"""
+    await get_movie_path(movie_id)
+    return Progress(**await progress_store.record(update.viewer, movie_id, update.position, update.duration))
+
+@api_router.delete("/progress/{movie_id}")
+async def delete_progress(movie_id: str, viewer: str = Query(default="default", max_length=64)):
+    """Forget where a viewer stopped in a movie, taking it off their continue watching list"""
+    if not await progress_store.forget(viewer, movie_id):
+        raise HTTPException(status_code=404, detail="No progress recorded")
+    return {"movie_id": movie_id, "removed": True}
+
+# ffmpeg
+# Thumbnails and HLS segments are cut by a local ffmpeg reading the movie from
+# /api/stream/by-id of this API, so only the byte ranges around the requested
+# position are fetched, through the range cache and the NAS scheduler.
+class FFmpegError(Exception):
+    pass
+
+def movie_version_key(doc):
+    """Return a key that changes whenever a catalog entry's file does (path, size, mtime)"""
+    modified = doc.get("modified")
+    version = f"{doc['path']}\n{doc.get('size')}\n{modified.isoformat() if modified else ''}"
+    return hashlib.sha1(version.encode()).hexdigest()
+
+async def run_ffmpeg(arguments, timeout):
+    """Run ffmpeg with the given arguments, raising FFmpegError if it fails or runs too long"""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            FFMPEG_PATH, "-nostdin", "-loglevel", "error", "-y", *arguments,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        )
+    except OSError as e:
+        # Missing or not executable: remembered as a failure like any other
+        raise FFmpegError(f"Cannot run {FFMPEG_PATH}: {e}") from e
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise FFmpegError(f"ffmpeg took more than {timeout}s")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    if process.returncode != 0:
+        raise FFmpegError(stderr.decode(errors="replace").strip() or f"ffmpeg exited with {process.returncode}")
+
+# Thumbnails
+# Poster frames are grabbed once per file version, scaled to every variant in the
+# same pass, and kept on disk under the movie's version key.
+class ThumbnailError(FFmpegError):
+    pass
+
+class ThumbnailCache:
+    """Content-addressed disk cache of movie thumbnails, generated lazily by a bounded ffmpeg pool"""
+
+    def __init__(self, directory, max_bytes=THUMBNAIL_CACHE_MAX_BYTES, workers=THUMBNAIL_WORKERS, shared=False):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.entries = OrderedDict()  # key -> bytes on disk for all variants, least recently used first
+        self.total_bytes = 0
+        self.inflight = {}  # key -> generation task
+        self.failed = {}  # key -> when ffmpeg last failed to make a frame of it
+        self.workers = asyncio.Semaphore(workers)
+
+    def variant_file(self, key, variant):
+        return self.directory / f"{key}.{variant}.jpg"
+
+    def part_file(self, key, variant):
+        return self.directory / f"{key}.{variant}.{os.getpid()}.tmp.jpg"
+
+    def load(self):
+        """Index the thumbnails left on disk by a previous run, oldest first"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        remove_cache_parts(self.directory.glob("*.tmp.jpg"), self.shared, THUMBNAIL_TIMEOUT)
+        images = [image for image in self.directory.glob("*.jpg") if not image.name.endswith(".tmp.jpg")]
+        for image in sorted(images, key=lambda image: image.stat().st_mtime):
+            key, variant, _ = image.name.split(".")
+            if variant not in THUMBNAIL_VARIANTS:
+                image.unlink(missing_ok=True)
+                continue
+            size = image.stat().st_size
+            self.entries[key] = self.entries.pop(key, 0) + size
+            self.total_bytes += size
+        self._evict()
+        logging.info(f"Thumbnail cache: {len(self.entries)} movies, {self.total_bytes} bytes in {self.directory}")
+
+    def _evict(self):
+        if self.shared:
+            return
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            for variant in THUMBNAIL_VARIANTS:
+                self.variant_file(key, variant).unlink(missing_ok=True)
+
+    def frame_time(self, doc):
+        """Seconds into the movie to grab, past opening logos and black frames"""
+        duration = (doc.get("media") or {}).get("duration")
+        if duration:
+            return round(min(duration * 0.1, 600), 2)
+        return 60
+
+    async def _grab_frame(self, url, seek, outputs):
+        split = "".join(f"[v{i}]" for i in range(len(outputs)))
+        scales = ";".join(
+            f"[v{i}]scale={width}:-2[out{i}]" for i, (width, _) in enumerate(outputs)
+        )
+        arguments = [
+            "-ss", str(seek), "-i", url,
+            "-filter_complex", f"[0:v:0]split={len(outputs)}{split};{scales}",
+        ]
+        for i, (_, target) in enumerate(outputs):
+            arguments += ["-map", f"[out{i}]", "-frames:v", "1", "-q:v", "4", str(target)]
+        await run_ffmpeg(arguments, THUMBNAIL_TIMEOUT)
+        if not all(target.exists() for _, target in outputs):
+            raise ThumbnailError(f"No frame at {seek}s")
+
+    async def _generate(self, key, doc, api_url):
+        url = await movie_ffmpeg_input(doc["path"], api_url)
+        outputs = [(width, self.part_file(key, variant)) for variant, width in THUMBNAIL_VARIANTS.items()]
+        await asyncio.to_thread(self.directory.mkdir, parents=True, exist_ok=True)
+        async with self.workers:
+            try:
+                await self._grab_frame(url, self.frame_time(doc), outputs)
+            except FFmpegError:
+                # Seeked past the end of a short or unprobed file: take the first frame
+                await self._grab_frame(url, 0, outputs)
+        
+        total = 0
+        for (_, target), variant in zip(outputs, THUMBNAIL_VARIANTS):
+            total += target.stat().st_size
+            os.replace(target, self.variant_file(key, variant))
+        self.entries[key] = total
+        self.total_bytes += total
+        self._evict()
+
+    def _generate_done(self, key, task):
+        self.inflight.pop(key, None)
+        if not task.cancelled() and task.exception():
+            if isinstance(task.exception(), FFmpegError):
+                self.failed[key] = time.monotonic()
+            logging.warning(f"Thumbnail generation failed: {task.exception()}")
+            for variant in THUMBNAIL_VARIANTS:
+                self.part_file(key, variant).unlink(missing_ok=True)
+
+    async def get(self, doc, variant, api_url):
+        """Return the key and image file of a movie's thumbnail variant, generating it on first use"""
+        key = movie_version_key(doc)
+        if self.shared:
+            # Made, or evicted, by another worker since this one last looked
+            size = await asyncio.to_thread(
+                touch_cache_files, [self.variant_file(key, variant) for variant in THUMBNAIL_VARIANTS]
+            )
+            if size is None:
+                self.total_bytes -= self.entries.pop(key, 0)
+            elif key not in self.entries:
+                self.entries[key] = size
+                self.total_bytes += size
+        CACHE_REQUESTS.inc(cache="thumbnail", result="hit" if key in self.entries else "miss")
+        if time.monotonic() - self.failed.get(key, -THUMBNAIL_RETRY_SECONDS) < THUMBNAIL_RETRY_SECONDS:
+            raise ThumbnailError("No frame could be extracted from this movie")
+        if key not in self.entries:
+            task = self.inflight.get(key)
+            if task is None:
+                task = asyncio.create_task(self._generate(key, doc, api_url))
+                self.inflight[key] = task
+                task.add_done_callback(partial(self._generate_done, key))
+            # Shielded so a viewer scrolling away does not abort a thumbnail others wait for
+            await asyncio.shield(task)
+        self.entries.move_to_end(key)
+        return key, self.variant_file(key, variant)
+
+thumbnail_cache = ThumbnailCache(CACHE_DIR / "thumbnails", shared=True)
+
+@api_router.get("/thumbnails/{movie_id}")
+async def get_thumbnail(
+    movie_id: str,
+    request: Request,
+    size: str = Query(default="small", description="Thumbnail variant: " + ", ".join(THUMBNAIL_VARIANTS)),
+):
+    """Get a movie's poster frame"""
+    if size not in THUMBNAIL_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Unknown thumbnail size: {size}")
+    doc = await catalog_collection.find_one(
+        {"id": movie_id}, {"_id": 0, "path": 1, "size": 1, "modified": 1, "media": 1}
+    )
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Movie not found")
+    
+    etag = f'"{movie_version_key(doc)}.{size}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        _, image = await thumbnail_cache.get(doc, size, api_self_url(request))
+        content = await asyncio.to_thread(image.read_bytes)
+    except FFmpegError as e:
+        raise HTTPException(status_code=404, detail=f"No thumbnail for this movie: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error getting thumbnail: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get thumbnail: {str(e)}")
+    return Response(content=content, media_type="image/jpeg", headers=headers)
+
+# HLS
+# MKV/AVI/WMV files are packaged on demand as MPEG-TS segments of a fixed-length
+# VOD playlist. Each segment is cut by its own ffmpeg run seeking straight to it,
+# so playback can start or jump anywhere without reading what comes before.
+# Video is always re-encoded with a keyframe forced at the start of the segment:
+# a copied segment would have to start at the keyframe before its slot and so
+# overlap the previous one. Audio packets split cleanly by timestamp, so audio is
+# copied when browsers decode it.
+class HLSSegmentCache:
+    """Disk cache of HLS segments, cut lazily by a capped number of ffmpeg jobs"""
+
+    def __init__(self, directory, max_bytes=HLS_CACHE_MAX_BYTES, max_jobs=HLS_MAX_JOBS, shared=False):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.max_jobs = max_jobs
+        self.segments = OrderedDict()  # (key, segment) -> size, least recently used first
+        self.total_bytes = 0
+        self.inflight = {}  # (key, segment) -> ffmpeg task
+        self.jobs = asyncio.Semaphore(max_jobs)
+
+    @staticmethod
+    def segment_count(duration):
+        return max(1, -(-int(duration * 1000) // int(HLS_SEGMENT_SECONDS * 1000)))
+
+    @staticmethod
+    def encoding_arguments(media):
+        """ffmpeg codec arguments: segment-aligned H.264 video, audio copied when browsers decode it"""
+        arguments = [
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+            "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        ]
+        if media.get("audio_codec") in HLS_COPY_AUDIO_CODECS:
+            arguments += ["-c:a", "copy"]
+        else:
+            arguments += ["-c:a", "aac", "-b:a", "192k", "-ac", "2"]
+        return arguments
+
+    @staticmethod
+    def stream_key(doc):
+        """Key of a movie's segments, changing with its file and the encoding chosen for it"""
+        encoding = " ".join(HLSSegmentCache.encoding_arguments(doc.get("media") or {}))
+        version = f"{movie_version_key(doc)}\n{HLS_SEGMENT_SECONDS}\n{encoding}"
+        return hashlib.sha1(version.encode()).hexdigest()
+
+    def segment_file(self, key, segment):
+        return self.directory / f"{key}.{segment}.ts"
+
+    def part_file(self, key, segment):
+        return self.directory / f"{key}.{segment}.{os.getpid()}.tmp.ts"
+
+    def load(self):
+        """Index the segments left on disk by a previous run, oldest first"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        remove_cache_parts(self.directory.glob("*.tmp.ts"), self.shared, HLS_SEGMENT_TIMEOUT)
+        segments = [segment for segment in self.directory.glob("*.ts") if not segment.name.endswith(".tmp.ts")]
+        for segment in sorted(segments, key=lambda segment: segment.stat().st_mtime):
+            key, index, _ = segment.name.split(".")
+            size = segment.stat().st_size
+            self.segments[(key, int(index))] = size
+            self.total_bytes += size
+        self._evict()
+        logging.info(f"HLS cache: {len(self.segments)} segments, {self.total_bytes} bytes in {self.directory}")
+
+    def _evict(self):
+        if self.shared:
+            return
+        while self.total_bytes > self.max_bytes and self.segments:
+            (key, index), size = self.segments.popitem(last=False)
+            self.total_bytes -= size
+            self.segment_file(key, index).unlink(missing_ok=True)
+
+    async def _refresh(self, key, segment):
+        """Pick up a segment another worker cut, or drop one it evicted, since this one last looked"""
+        size = await asyncio.to_thread(touch_cache_files, [self.segment_file(key, segment)])
+        if size is None:
+            self.total_bytes -= self.segments.pop((key, segment), 0)
+        elif (key, segment) not in self.segments:
+            self.segments[(key, segment)] = size
+            self.total_bytes += size
+
+    async def _cut(self, doc, key, segment, api_url):
+        if self.shared:
+            await self._refresh(key, segment)
+            if (key, segment) in self.segments:
+                return
+        start = segment * HLS_SEGMENT_SECONDS
+        target = self.part_file(key, segment)
+        await asyncio.to_thread(self.directory.mkdir, parents=True, exist_ok=True)
+        async with self.jobs:
+            source = await movie_ffmpeg_input(doc["path"], api_url)
+            await run_ffmpeg([
+                "-ss", f"{start:.3f}", "-i", source,
+                "-t", f"{HLS_SEGMENT_SECONDS:.3f}", "-output_ts_offset", f"{start:.3f}",
+                "-map", "0:v:0", "-map", "0:a:0?", "-sn", "-dn",
+                *self.encoding_arguments(doc.get("media") or {}),
+                "-f", "mpegts", str(target),
+            ], HLS_SEGMENT_TIMEOUT)
+        
+        size = target.stat().st_size
+        os.replace(target, self.segment_file(key, segment))
+        self.segments[(key, segment)] = size
+        self.total_bytes += size
+        self._evict()
+
+    def _cut_done(self, block, task):
+        self.inflight.pop(block, None)
+        if not task.cancelled() and task.exception():
+            logging.warning(f"HLS segment {block[1]} failed: {task.exception()}")
+            self.part_file(*block).unlink(missing_ok=True)
+
+    def _start_cut(self, doc, key, segment, api_url):
+        task = self.inflight.get((key, segment))
+        if task is None:
+            task = asyncio.create_task(self._cut(doc, key, segment, api_url))
+            self.inflight[(key, segment)] = task
+            task.add_done_callback(partial(self._cut_done, (key, segment)))
+        return task
+
+    async def segment(self, doc, segment, api_url):
+        """Return the file of one segment, cutting it (and the next few in the background) if needed"""
+        key = self.stream_key(doc)
+        if self.shared:
+            await self._refresh(key, segment)
+        CACHE_REQUESTS.inc(cache="hls", result="hit" if (key, segment) in self.segments else "miss")
+        if (key, segment) not in self.segments:
+            # Shielded so a player abandoning the request does not kill a half-cut segment
+            await asyncio.shield(self._start_cut(doc, key, segment, api_url))
+        self.segments.move_to_end((key, segment))
+        
+        last = self.segment_count(doc["media"]["duration"]) - 1
+        for ahead in range(segment + 1, min(segment + HLS_READAHEAD_SEGMENTS, last) + 1):
+            if len(self.inflight) >= self.max_jobs:
+                # Keep job slots for segments players are waiting on
+                break
+            if (key, ahead) not in self.segments:
+                self._start_cut(doc, key, ahead, api_url)
+        return self.segment_file(key, segment)
+
+hls_cache = HLSSegmentCache(CACHE_DIR / "hls", shared=True)
+
+async def get_hls_movie(movie_id):
+    """Return the catalog entry of a movie to package, probing its duration and codecs if needed
+
+    Shared by the playlist and segment routes, so both answer 404, 422 or 502 alike.
+    """
+    try:
+        doc = await catalog_collection.find_one(
+            {"id": movie_id}, {"_id": 0, "path": 1, "size": 1, "format": 1, "modified": 1, "media": 1}
+        )
+        if doc is None:
+            raise HTTPException(status_code=404, detail="Movie not found")
+        if doc.get("media") is None:
+            doc["media"] = await probe_movie(doc)
+            await save_movie_media(doc["path"], doc["media"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        # A NAS timeout has no message of its own
+        reason = str(e) or type(e).__name__
+        logging.error(f"Error reading movie headers for HLS: {reason}")
+        raise HTTPException(status_code=502, detail=f"Failed to read movie headers: {reason}")
+    if not doc["media"].get("duration"):
+        raise HTTPException(status_code=422, detail="Movie duration unknown, cannot build an HLS playlist")
+    return doc
+
+@api_router.get("/hls/{movie_id}/index.m3u8")
+async def get_hls_playlist(movie_id: str):
+    """Get the HLS playlist of a movie"""
+    doc = await get_hls_movie(movie_id)
+    duration = doc["media"]["duration"]
+    version = HLSSegmentCache.stream_key(doc)[:16]
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        f"#EXT-X-TARGETDURATION:{int(-(-HLS_SEGMENT_SECONDS // 1))}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+    ]
+    for segment in range(HLSSegmentCache.segment_count(duration)):
+        length = min(HLS_SEGMENT_SECONDS, duration - segment * HLS_SEGMENT_SECONDS)
+        lines += [f"#EXTINF:{length:.3f},", f"{segment}.ts?v={version}"]
+    lines.append("#EXT-X-ENDLIST")
+    return Response(
+        content="\n".join(lines) + "\n",
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+@api_router.get("/hls/{movie_id}/{segment}.ts")
+async def get_hls_segment(movie_id: str, segment: int, request: Request):
+    """Get one MPEG-TS segment of a movie's HLS stream"""
+    doc = await get_hls_movie(movie_id)
+    if not 0 <= segment < HLSSegmentCache.segment_count(doc["media"]["duration"]):
+        raise HTTPException(status_code=404, detail="Segment not found")
+    try:
+        path = await hls_cache.segment(doc, segment, api_self_url(request))
+        content = await asyncio.to_thread(path.read_bytes)
+    except FFmpegError as e:
+        raise HTTPException(status_code=502, detail=f"Failed to package segment: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error packaging HLS segment: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to package segment: {str(e)}")
+    return Response(content=content, media_type="video/mp2t", headers={"Cache-Control": "public, max-age=86400"})
+
+async def catalog_event_stream(folder, last_event_id=None):
+    """Subscribe to catalog events and yield them as Server-Sent Events until the client leaves"""
+    queue = catalog_events.subscribe(last_event_id)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            if folder and event["folders"] is not None and folder not in event["folders"]:
+                continue
+            yield (
+                f"id: {catalog_events.event_id(event)}\n"
+                f"event: {event['type']}\n"
+                f"data: {json.dumps(event['data'])}\n\n"
+            )
+    finally:
+        catalog_events.unsubscribe(queue)
+
+@api_router.get("/events")
+async def get_events(
+    request: Request,
+    folder: Optional[str] = Query(default=None, description="Only changes inside this folder tree"),
+):
+    """Stream catalog changes (added, updated, removed, resync) as Server-Sent Events"""
+    return StreamingResponse(
+        catalog_event_stream(folder.strip("/") if folder else None, request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@api_router.get("/streams")
+async def get_streams():
+    """Show how the NAS is shared: read slots, bandwidth and the rate of every open stream"""
+    return nas_scheduler.describe()
+
+def update_gauges():
+    """Set the gauges read from state rather than updated as it changes"""
+    CACHE_BYTES.set(chunk_cache.total_bytes, cache="range")
+    CACHE_BYTES.set(thumbnail_cache.total_bytes, cache="thumbnail")
+    CACHE_BYTES.set(hls_cache.total_bytes, cache="hls")
+    SEARCH_INDEX_ENTRIES.set(len(search_index))
+    NAS_UP.set(1 if nas_health["connected"] else 0)
+    NAS_BREAKER_OPEN.set(1 if nas_breaker.state == "open" else 0)
+    WORKER_LEADER.set(1 if leadership.leader else 0)
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Get the metrics of every worker in the Prometheus text format, labelled by worker"""
+    update_gauges()
+    snapshots = await asyncio.to_thread(worker_registry.metrics_snapshots)
+    snapshots[str(os.getpid())] = metrics.snapshot()
+    return Response(content=metrics.render_workers(snapshots), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Include the router in the main app
+app.include_router(api_router)
+
+app.add_middleware(RequestMetricsMiddleware)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_credentials=True,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Workers
+# The workers sharing CACHE_DIR, however many were started, elect one of them
+# through an exclusive flock, which the kernel drops when its holder exits; the
+# others keep trying and one takes over. Only the elected worker probes the NAS,
+# rescans the catalog, probes media and sweeps the caches; the others follow the
+# NAS health and catalog changes it shares, and serve requests. Each worker also
+# holds a flock on a file of its own under CACHE_DIR/workers: the files still
+# locked are the live workers, and the NAS limits are split between them. Next
+# to it each writes a snapshot of its metrics every WORKER_CHECK_INTERVAL, so
+# whichever worker answers /api/metrics renders those of all of them.
+class WorkerLeadership:
+    """Elects one worker among those sharing a lock file"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.leader = False
+        self.file = None
+
+    def try_acquire(self):
+        """Become the elected worker if none is; returns whether this one is"""
+        if self.leader:
+            return True
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        lock_file.truncate(0)
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self.file, self.leader = lock_file, True
+        return True
+
+class WorkerRegistry:
+    """Counts the live workers sharing a directory, each holding the lock of a file of its own"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.file = None
+        self.count = 1
+
+    def register(self):
+        """Add this worker, for as long as it runs"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{os.getpid()}.lock"
+        while True:
+            lock_file = open(path, "a+")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            # Deleted as stale by another worker between open and flock: again
+            lock_file.close()
+        self.file = lock_file
+
+    def refresh(self):
+        """Count the workers whose files are locked, deleting the files of those that exited"""
+        count = 0
+        for path in self.directory.glob("*.lock"):
+            try:
+                lock_file = open(path)
+            except FileNotFoundError:
+                continue
+            with lock_file:
+                try:
+                    # Fails for this worker's own file too: flocks belong to the open file
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    count += 1
+                    continue
+                path.with_suffix(".json").unlink(missing_ok=True)
+                path.unlink(missing_ok=True)
+        self.count = max(1, count)
+        return self.count
+
+    def write_metrics(self, snapshot):
+        path = self.directory / f"{os.getpid()}.json"
+        tmp = path.with_name(f"{path.name}.tmp")
+        tmp.write_text(json.dumps(snapshot))
+        os.replace(tmp, path)
+
+    def metrics_snapshots(self):
+        """Return the last metrics snapshot of every other live worker, by pid"""
+        snapshots = {}
+        for path in self.directory.glob("*.json"):
+            if path.stem == str(os.getpid()) or not path.with_suffix(".lock").exists():
+                continue
+            try:
+                snapshots[path.stem] = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+leadership = WorkerLeadership(CACHE_DIR / "leader.lock")
+worker_registry = WorkerRegistry(CACHE_DIR / "workers")
+leadership_task = None
+workers_task = None
+sweep_task = None
+reconcile_task = None
+
+def touch_cache_files(paths):
+    """Mark cache files as just used; returns their total size, or None when one is gone"""
+    total = 0
+    try:
+        for path in paths:
+            os.utime(path)
+            total += path.stat().st_size
+    except FileNotFoundError:
+        return None
+    return total
+
+def remove_cache_parts(parts, shared, max_age):
+    """Delete files a crash left half-written; with workers sharing them, only those too old to be in progress"""
+    now = time.time()
+    for part in parts:
+        try:
+            if not shared or now - part.stat().st_mtime > 2 * max_age:
+                part.unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
+
+def sweep_cache_directory(directory, max_bytes, pattern):
+    """Delete the least recently used files of a cache until it fits in max_bytes; returns the bytes left"""
+    files, total = [], 0
+    for path in Path(directory).glob(pattern):
+        if ".tmp" in path.name:
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    files.sort()
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+    return total
+
+async def cache_sweep_loop():
+    """Keep the caches every worker writes to within their size limits"""
+    caches = (
+        (chunk_cache, "*.blk"),
+        (thumbnail_cache, "*.jpg"),
+        (hls_cache, "*.ts"),
+    )
+    while True:
+        for cache, pattern in caches:
+            try:
+                await asyncio.to_thread(sweep_cache_directory, cache.directory, cache.max_bytes, pattern)
+            except Exception as e:
+                logging.error(f"Failed to sweep {cache.directory}: {e}")
+        await asyncio.sleep(CACHE_SWEEP_INTERVAL)
+
+async def cache_reconcile_loop():
+    """Keep this worker's range cache index in line with the blocks the sweep leaves"""
+    while True:
+        await asyncio.sleep(CACHE_SWEEP_INTERVAL)
+        try:
+            chunk_cache.reconcile(await asyncio.to_thread(chunk_cache.scan_blocks))
+        except Exception as e:
+            logging.error(f"Failed to rescan {chunk_cache.directory}: {e}")
+
+def start_leader_tasks():
+    """Start the background work only one worker does"""
+    global catalog_task, media_task, media_probe_pool, sweep_task
+    catalog_task = asyncio.create_task(catalog_rescan_loop())
+    if MEDIA_PROBE_WORKERS > 0:
+        # spawn: workers only import media_probe, not a fork of the running app
+        media_probe_pool = ProcessPoolExecutor(
+            max_workers=MEDIA_PROBE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+        media_task = asyncio.create_task(media_probe_loop())
+    sweep_task = asyncio.create_task(cache_sweep_loop())
+
+def share_nas_limits(workers):
+    """Give this worker its part of the NAS read slots and bandwidth"""
+    nas_scheduler.resize(max(1, NAS_MAX_READS // workers), NAS_MAX_BANDWIDTH / workers)
+    LIVE_WORKERS.set(workers)
+
+async def workers_loop():
+    """Follow workers starting and exiting, and share this worker's metrics with them"""
+    while True:
+        await asyncio.sleep(WORKER_CHECK_INTERVAL)
+        try:
+            workers = worker_registry.count
+            if await asyncio.to_thread(worker_registry.refresh) != workers:
+                logger.info(f"{worker_registry.count} workers share {CACHE_DIR}")
+            share_nas_limits(worker_registry.count)
+        except Exception as e:
+            logger.error(f"Failed to count the workers: {e}")
+        update_gauges()
+        try:
+            await asyncio.to_thread(worker_registry.write_metrics, metrics.snapshot())
+        except Exception as e:
+            logger.error(f"Failed to share the metrics: {e}")
+
+async def leadership_loop():
+    """Take over the background work once the elected worker exits"""
+    while not leadership.try_acquire():
+        await asyncio.sleep(LEADER_RETRY_INTERVAL)
+    logger.info(f"Worker {os.getpid()} elected to run the background scans")
+    start_leader_tasks()
+
+@app.on_event("startup")
+async def startup_event():
+    """Initialize NAS connection on startup"""
+    global nas_health_task, progress_task, leadership_task, workers_task, reconcile_task
     logger.info("Starting NAS Movie Streamer...")
-    await init_nas_connection()
+    await asyncio.to_thread(worker_registry.register)
+    share_nas_limits(await asyncio.to_thread(worker_registry.refresh))
+    workers_task = asyncio.create_task(workers_loop())
+    # Joined before the catalog index is first loaded, so no change falls in between
+    await catalog_feed.start()
+    if leadership.try_acquire():
+        await check_nas_health()
+    else:
+        await follow_nas_health()
+    nas_health_task = asyncio.create_task(nas_health_loop())
+    if chunk_cache.enabled:
+        await asyncio.to_thread(chunk_cache.load)
+        reconcile_task = asyncio.create_task(cache_reconcile_loop())
+    await asyncio.to_thread(thumbnail_cache.load)
+    await asyncio.to_thread(hls_cache.load)
+    progress_task = asyncio.create_task(progress_flush_loop())
+    if leadership.leader:
+        logger.info(f"Worker {os.getpid()} elected to run the background scans")
+        start_leader_tasks()
+    else:
+        leadership_task = asyncio.create_task(leadership_loop())
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
     global nas_session
+    if nas_health_task:
+        nas_health_task.cancel()
+    if leadership_task:
+        leadership_task.cancel()
+    if workers_task:
+        workers_task.cancel()
+    if sweep_task:
+        sweep_task.cancel()
+    if reconcile_task:
+        reconcile_task.cancel()
+    catalog_feed.stop()
+    if catalog_task:
+        catalog_task.cancel()
+    if media_task:
+        media_task.cancel()
+    if media_probe_pool:
+        media_probe_pool.shutdown(wait=False, cancel_futures=True)
+    if progress_task:
+        progress_task.cancel()
+    try:
+        await progress_store.flush()
+    except Exception as e:
+        logger.error(f"Failed to write playback progress at shutdown: {e}")
     if nas_session:
         await nas_session.close()
     client.close()
\ No newline at end of file
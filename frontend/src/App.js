@@ -1,12 +1,58 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const PAGE_SIZE = 60;
+const SEARCH_DEBOUNCE_MS = 250;
+const PROGRESS_HEARTBEAT_MS = 10000;
+
+// Anonymous id of this browser, under which playback positions are kept
+const getViewerId = () => {
+  let viewer = localStorage.getItem('viewer');
+  if (!viewer) {
+    viewer = crypto.randomUUID ? crypto.randomUUID() : String(Math.random()).slice(2);
+    localStorage.setItem('viewer', viewer);
+  }
+  return viewer;
+};
+const VIEWER = getViewerId();
+
+// Report where playback stands; keepalive lets the last report outlive the player
+const reportProgress = (movieId, video) => {
+  if (!video || !video.currentTime) return;
+  fetch(`${API}/progress/${movieId}`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      position: video.currentTime,
+      duration: Number.isFinite(video.duration) ? video.duration : null,
+      viewer: VIEWER,
+    }),
+    keepalive: true,
+  }).catch(err => console.error('Progress report failed:', err));
+};
+
+const fetchContinueWatching = async () => {
+  const response = await axios.get(`${API}/progress`, { params: { viewer: VIEWER } });
+  return response.data;
+};
+
+// Fetch one page of the catalog, or of ranked search results
+const fetchMovies = async (search, cursor = null) => {
+  search = search?.trim();
+  const params = { limit: PAGE_SIZE };
+  if (search) params.q = search;
+  if (cursor) params.cursor = cursor;
+  const response = await axios.get(`${API}/${search ? 'search' : 'movies'}`, { params });
+  return response.data;
+};
 
 // Movie Card Component
-const MovieCard = ({ movie, onPlay }) => {
+const MovieCard = ({ movie, onPlay, progress }) => {
+  const [thumbnailFailed, setThumbnailFailed] = useState(false);
+
   const getMovieIcon = (format) => {
     const iconMap = {
       mp4: '🎬',
@@ -19,27 +65,107 @@ const MovieCard = ({ movie, onPlay }) => {
     return iconMap[format?.toLowerCase()] || iconMap.default;
   };
 
+  const formatDuration = (seconds) => {
+    const minutes = Math.round(seconds / 60);
+    return minutes >= 60 ? `${Math.floor(minutes / 60)}h${String(minutes % 60).padStart(2, '0')}` : `${minutes} min`;
+  };
+
+  const mediaDetails = [
+    movie.media?.duration && formatDuration(movie.media.duration),
+    movie.media?.height && `${movie.media.height}p`,
+    movie.media?.video_codec,
+  ].filter(Boolean).join(' · ');
+
   return (
     <div 
       className="movie-card bg-gray-800 rounded-lg p-4 hover:bg-gray-700 transition-all duration-300 cursor-pointer transform hover:scale-105"
       onClick={() => onPlay(movie)}
     >
-      <div className="movie-icon text-6xl mb-3 text-center">
-        {getMovieIcon(movie.format)}
-      </div>
+      {movie.thumbnail && !thumbnailFailed ? (
+        <img
+          className="movie-thumbnail w-full rounded mb-3 object-cover"
+          src={`${BACKEND_URL}${movie.thumbnail}`}
+          alt=""
+          loading="lazy"
+          decoding="async"
+          onError={() => setThumbnailFailed(true)}
+        />
+      ) : (
+        <div className="movie-icon text-6xl mb-3 text-center">
+          {getMovieIcon(movie.format)}
+        </div>
+      )}
+      {progress?.duration && (
+        <div className="movie-progress h-1 bg-gray-600 rounded mb-2">
+          <div className="h-1 bg-red-600 rounded" style={{ width: `${Math.min(100, 100 * progress.position / progress.duration)}%` }} />
+        </div>
+      )}
       <h3 className="movie-title text-white text-sm font-medium text-center truncate">
         {movie.name.replace(/\.[^/.]+$/, "")} {/* Remove extension */}
       </h3>
       <p className="movie-format text-gray-400 text-xs text-center mt-1 uppercase">
         {movie.format}
       </p>
+      {mediaDetails && (
+        <p className="movie-media text-gray-500 text-xs text-center mt-1">
+          {mediaDetails}
+        </p>
+      )}
     </div>
   );
 };
 
 // Video Player Component
+// Containers HTML5 video cannot play directly; served as HLS where the browser supports it
+const HLS_FORMATS = ['mkv', 'avi', 'wmv'];
+
+const getStreamUrl = (movie) => `${API}/stream/by-id/${movie.id}`;
+
+const getVideoUrl = (movie) => {
+  const supportsHls = document.createElement('video').canPlayType('application/vnd.apple.mpegurl') !== '';
+  // The playlist needs the duration from the file headers; unprobed files (media null) are probed on demand
+  const packable = movie.media == null || Boolean(movie.media.duration);
+  if (supportsHls && packable && HLS_FORMATS.includes(movie.format?.toLowerCase())) {
+    return `${API}/hls/${movie.id}/index.m3u8`;
+  }
+  return getStreamUrl(movie);
+};
+
 const VideoPlayer = ({ movie, onClose }) => {
-  const videoUrl = `${API}/stream${movie.path}`;
+  const [videoUrl, setVideoUrl] = useState(() => getVideoUrl(movie));
+  const videoRef = useRef(null);
+  const lastReport = useRef(0);
+
+  // Resume where this viewer stopped, unless they finished the film
+  const handleLoadedMetadata = async () => {
+    try {
+      const response = await axios.get(`${API}/progress/${movie.id}`, { params: { viewer: VIEWER } });
+      if (!response.data.finished && videoRef.current) {
+        videoRef.current.currentTime = response.data.position;
+      }
+    } catch (err) {
+      if (err.response?.status !== 404) console.error('Failed to load progress:', err);
+    }
+  };
+
+  const handleTimeUpdate = () => {
+    const now = Date.now();
+    if (now - lastReport.current < PROGRESS_HEARTBEAT_MS) return;
+    lastReport.current = now;
+    reportProgress(movie.id, videoRef.current);
+  };
+
+  const handlePauseOrEnd = () => reportProgress(movie.id, videoRef.current);
+
+  // A movie that cannot be packaged as HLS is still tried as the raw file
+  const handleError = () => {
+    if (videoUrl !== getStreamUrl(movie)) setVideoUrl(getStreamUrl(movie));
+  };
+
+  useEffect(() => {
+    const video = videoRef.current;
+    return () => reportProgress(movie.id, video);
+  }, [movie.id]);
 
   return (
     <div className="video-player-overlay fixed inset-0 bg-black bg-opacity-95 z-50 flex items-center justify-center">
@@ -60,7 +186,13 @@ const VideoPlayer = ({ movie, onClose }) => {
         {/* Video player */}
         <div className="video-wrapper flex-1 flex items-center justify-center">
           <video
+            ref={videoRef}
             src={videoUrl}
+            onLoadedMetadata={handleLoadedMetadata}
+            onTimeUpdate={handleTimeUpdate}
+            onPause={handlePauseOrEnd}
+            onEnded={handlePauseOrEnd}
+            onError={handleError}
             controls
             autoPlay
             className="w-full h-full max-w-full max-h-full"
@@ -104,11 +236,23 @@ const ErrorMessage = ({ message, onRetry }) => (
 // Main App Component
 function App() {
   const [movies, setMovies] = useState([]);
+  const [totalMovies, setTotalMovies] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [selectedMovie, setSelectedMovie] = useState(null);
   const [nasConnected, setNasConnected] = useState(false);
   const [searchTerm, setSearchTerm] = useState('');
+  const [continueWatching, setContinueWatching] = useState([]);
+
+  const loadContinueWatching = async () => {
+    try {
+      setContinueWatching(await fetchContinueWatching());
+    } catch (err) {
+      console.error('Failed to load continue watching:', err);
+    }
+  };
 
   // Test NAS connection
   const testConnection = async () => {
@@ -135,8 +279,11 @@ function App() {
         throw new Error('Impossible de se connecter au NAS Buffalo LinkStation');
       }
 
-      const response = await axios.get(`${API}/movies`);
-      setMovies(response.data.movies);
+      const data = await fetchMovies(searchTerm);
+      setMovies(data.movies);
+      setTotalMovies(data.total);
+      setNextCursor(data.next_cursor);
+      loadContinueWatching();
     } catch (err) {
       console.error('Error loading movies:', err);
       setError(err.response?.data?.detail || err.message || 'Erreur lors du chargement des films');
@@ -150,6 +297,91 @@ function App() {
     loadMovies();
   }, []);
 
+  // Search on the server once typing pauses
+  const isFirstSearch = useRef(true);
+  useEffect(() => {
+    if (isFirstSearch.current) {
+      isFirstSearch.current = false;
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const data = await fetchMovies(searchTerm);
+        if (!cancelled) {
+          setMovies(data.movies);
+          setTotalMovies(data.total);
+          setNextCursor(data.next_cursor);
+        }
+      } catch (err) {
+        console.error('Search failed:', err);
+      }
+    }, SEARCH_DEBOUNCE_MS);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [searchTerm]);
+
+  // Apply catalog changes pushed by the server
+  const searchRef = useRef(searchTerm);
+  const nextCursorRef = useRef(nextCursor);
+  const moviesRef = useRef(movies);
+  searchRef.current = searchTerm;
+  moviesRef.current = movies;
+  nextCursorRef.current = nextCursor;
+  useEffect(() => {
+    const events = new EventSource(`${API}/events?folder=Films`);
+
+    events.addEventListener('added', (event) => {
+      // Search results are ranked by the server; new entries show up on the next query
+      if (searchRef.current) return;
+      const movie = JSON.parse(event.data);
+      setTotalMovies(total => total + 1);
+      setMovies(current => {
+        const position = current.findIndex(other => other.name.localeCompare(movie.name) > 0);
+        // Past the last loaded page it shows up when that page is fetched
+        if (position === -1) return nextCursorRef.current ? current : [...current, movie];
+        return [...current.slice(0, position), movie, ...current.slice(position)];
+      });
+    });
+    events.addEventListener('updated', (event) => {
+      const movie = JSON.parse(event.data);
+      setMovies(current => current.map(other => (other.id === movie.id ? movie : other)));
+    });
+    events.addEventListener('removed', (event) => {
+      const { id } = JSON.parse(event.data);
+      if (!moviesRef.current.some(movie => movie.id === id)) return;
+      setTotalMovies(total => Math.max(0, total - 1));
+      setMovies(current => current.filter(movie => movie.id !== id));
+    });
+    events.addEventListener('resync', async () => {
+      try {
+        const data = await fetchMovies(searchRef.current);
+        setMovies(data.movies);
+        setTotalMovies(data.total);
+        setNextCursor(data.next_cursor);
+      } catch (err) {
+        console.error('Catalog resync failed:', err);
+      }
+    });
+    return () => events.close();
+  }, []);
+
+  // Load the next page
+  const loadMoreMovies = async () => {
+    try {
+      setLoadingMore(true);
+      const data = await fetchMovies(searchTerm, nextCursor);
+      setMovies(current => [...current, ...data.movies]);
+      setNextCursor(data.next_cursor);
+    } catch (err) {
+      console.error('Error loading more movies:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   // Handle movie play
   const handlePlayMovie = (movie) => {
     setSelectedMovie(movie);
@@ -158,13 +390,10 @@ function App() {
   // Handle close player
   const handleClosePlayer = () => {
     setSelectedMovie(null);
+    // Give the last progress report a moment to land before asking for the list
+    setTimeout(loadContinueWatching, 500);
   };
 
-  // Filter movies based on search
-  const filteredMovies = movies.filter(movie =>
-    movie.name.toLowerCase().includes(searchTerm.toLowerCase())
-  );
-
   // Loading state
   if (loading) {
     return <LoadingSpinner />;
@@ -210,15 +439,32 @@ function App() {
       {/* Main Content */}
       <main className="main-content p-6">
         <div className="max-w-7xl mx-auto">
+          {/* Continue watching */}
+          {!searchTerm && continueWatching.length > 0 && (
+            <div className="continue-watching mb-8">
+              <h2 className="text-xl text-white font-semibold mb-4">Reprendre la lecture</h2>
+              <div className="movies-grid grid grid-cols-2 sm:grid-cols-3 md:grid-cols-4 lg:grid-cols-5 xl:grid-cols-6 gap-6">
+                {continueWatching.map(({ movie, progress }) => (
+                  <MovieCard
+                    key={movie.id}
+                    movie={movie}
+                    progress={progress}
+                    onPlay={handlePlayMovie}
+                  />
+                ))}
+              </div>
+            </div>
+          )}
+
           {/* Movies Count */}
           <div className="movies-count mb-6">
             <h2 className="text-xl text-white font-semibold">
-              {filteredMovies.length} film{filteredMovies.length !== 1 ? 's' : ''} trouvé{filteredMovies.length !== 1 ? 's' : ''}
+              {totalMovies} film{totalMovies !== 1 ? 's' : ''} trouvé{totalMovies !== 1 ? 's' : ''}
             </h2>
           </div>
 
           {/* Movies Grid */}
-          {filteredMovies.length === 0 ? (
+          {movies.length === 0 ? (
             <div className="no-movies text-center py-12">
               <div className="text-gray-500 text-6xl mb-4">🎭</div>
               <h3 className="text-white text-xl mb-2">Aucun film trouvé</h3>
@@ -228,7 +474,7 @@ function App() {
             </div>
           ) : (
             <div className="movies-grid grid grid-cols-2 sm:grid-cols-3 md:grid-cols-4 lg:grid-cols-5 xl:grid-cols-6 gap-6">
-              {filteredMovies.map((movie, index) => (
+              {movies.map((movie, index) => (
                 <MovieCard 
                   key={movie.id || index} 
                   movie={movie} 
@@ -237,6 +483,19 @@ function App() {
               ))}
             </div>
           )}
+
+          {/* Next page */}
+          {nextCursor && (
+            <div className="text-center mt-8">
+              <button
+                onClick={loadMoreMovies}
+                disabled={loadingMore}
+                className="bg-blue-600 hover:bg-blue-700 text-white px-6 py-2 rounded-lg transition-colors disabled:opacity-50"
+              >
+                {loadingMore ? 'Chargement...' : 'Afficher plus de films'}
+              </button>
+            </div>
+          )}
         </div>
       </main>
 
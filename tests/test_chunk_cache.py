@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from server import ChunkCache, ShareStreamResponse, UpstreamScheduler, metered_stream
+
+
+def test_shared_index_follows_the_sweep(tmp_path):
+    cache = ChunkCache(tmp_path, block_size=4, max_bytes=100, shared=True)
+    cache.load()
+    for index in range(3):
+        cache._write_block("mine", index, b"abcd")
+        cache.blocks[("mine", index)] = 4
+        cache.total_bytes += 4
+    # Written by another worker, and half-written by a third
+    cache._write_block("theirs", 0, b"ab")
+    (tmp_path / "other.0.blk.123.tmp").write_bytes(b"partial")
+    # Deleted by the elected worker's sweep
+    cache.block_file("mine", 0).unlink()
+
+    cache.reconcile(cache.scan_blocks())
+    assert list(cache.blocks) == [("mine", 1), ("mine", 2)]
+    assert cache.total_bytes == 10
+
+
+def test_share_closed_when_the_response_ends_before_its_body():
+    scheduler = UpstreamScheduler(max_reads=1, bandwidth=0)
+    share = scheduler.open_share("/Films/a.mkv")
+
+    async def chunks():
+        yield b"never sent"
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        raise OSError("client went away")
+
+    response = ShareStreamResponse(metered_stream(chunks(), "cache", share), share)
+    # Raised as is or wrapped in an ExceptionGroup, depending on the Starlette version
+    with pytest.raises(Exception):
+        asyncio.run(response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send))
+    assert scheduler.shares == {}
@@ -0,0 +1,66 @@
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+
+from server import if_range_matches, make_file_metadata, not_modified, parse_range_header
+
+
+class FakeRequest:
+    def __init__(self, **headers):
+        self.headers = Headers({name.replace("_", "-"): value for name, value in headers.items()})
+
+
+METADATA = make_file_metadata("/Films/a.mkv", 1000, 1700000000)
+LAST_MODIFIED = "Tue, 14 Nov 2023 22:13:20 GMT"  # 1700000000
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("BYTES = 1 - 2", (1, 2)),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [None, "", "items=0-1", "bytes=abc", "bytes=-", "bytes=5-1"])
+def test_parse_range_header_ignores_malformed(header):
+    assert parse_range_header(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=-0", "bytes=0-1,5-6"])
+def test_parse_range_header_unsatisfiable(header):
+    with pytest.raises(HTTPException) as raised:
+        parse_range_header(header, 1000)
+    assert raised.value.status_code == 416
+    assert raised.value.headers["Content-Range"] == "bytes */1000"
+
+
+def test_if_range_without_header():
+    assert if_range_matches(FakeRequest(), METADATA)
+
+
+def test_if_range_etag():
+    assert if_range_matches(FakeRequest(if_range=METADATA["etag"]), METADATA)
+    assert not if_range_matches(FakeRequest(if_range='"other"'), METADATA)
+
+
+def test_if_range_weak_etag_never_matches():
+    weak = make_file_metadata("/Films/a.mkv", 1000, None)
+    assert not if_range_matches(FakeRequest(if_range=weak["etag"]), weak)
+
+
+def test_if_range_date():
+    assert if_range_matches(FakeRequest(if_range=LAST_MODIFIED), METADATA)
+    assert not if_range_matches(FakeRequest(if_range="Wed, 15 Nov 2023 00:00:00 GMT"), METADATA)
+    assert not if_range_matches(FakeRequest(if_range="not a date"), METADATA)
+
+
+def test_not_modified():
+    assert not_modified(FakeRequest(if_none_match=f'"x", {METADATA["etag"]}'), METADATA)
+    assert not not_modified(FakeRequest(if_none_match='"x"'), METADATA)
+    assert not_modified(FakeRequest(if_modified_since=LAST_MODIFIED), METADATA)
+    assert not not_modified(FakeRequest(if_modified_since="Mon, 13 Nov 2023 00:00:00 GMT"), METADATA)
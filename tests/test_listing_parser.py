@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import pytest
+
+from server import LISTING_DETAILS_WINDOW, ListingParser, parse_file_list
+
+
+def listing(count):
+    rows = ['<html><body><table>', '<tr><td><a href="../">Parent</a></td></tr>']
+    for i in range(count):
+        name = f"Movie {i:03d}.mkv"
+        rows.append(
+            f'<tr><td><a href="/share/Films/Movie%20{i:03d}.mkv">{name}</a></td>'
+            f'<td>2023-01-{i % 28 + 1:02d} 10:20</td><td>{i + 1}.5 GB</td></tr>'
+        )
+        if i % 10 == 0:
+            rows.append(f'<tr><td><a href="Folder {i}/">Folder {i}/</a></td><td>-</td></tr>')
+    rows.append('</table></body></html>')
+    return "\n".join(rows)
+
+
+def parse_in_chunks(text, size):
+    parser = ListingParser("Films")
+    streamed = []
+    for start in range(0, len(text), size):
+        streamed += parser.feed(text[start:start + size])
+    movies = parser.close()
+    return parser, streamed, movies
+
+
+def summary(movies):
+    return [(movie.name, movie.path, movie.size, movie.modified) for movie in movies]
+
+
+def test_whole_listing():
+    movies = parse_file_list(listing(3), "Films")
+    assert summary(movies) == [
+        ("Movie 000.mkv", "/Films/Movie 000.mkv", int(1.5 * 1024 ** 3), datetime(2023, 1, 1, 10, 20)),
+        ("Movie 001.mkv", "/Films/Movie 001.mkv", int(2.5 * 1024 ** 3), datetime(2023, 1, 2, 10, 20)),
+        ("Movie 002.mkv", "/Films/Movie 002.mkv", int(3.5 * 1024 ** 3), datetime(2023, 1, 3, 10, 20)),
+    ]
+
+
+@pytest.mark.parametrize("size", [1, 7, 13, 64, LISTING_DETAILS_WINDOW - 1, LISTING_DETAILS_WINDOW + 1, 4096])
+def test_chunk_boundaries(size):
+    text = listing(40)
+    whole, _, expected = parse_in_chunks(text, len(text))
+    parser, streamed, movies = parse_in_chunks(text, size)
+    assert summary(movies) == summary(expected)
+    assert len({movie.path for movie in movies}) == 40
+    assert parser.folders == whole.folders == [f"Folder {i}" for i in range(0, 40, 10)]
+    # Entries are reported as soon as their details are in, and only once
+    assert summary(streamed) == summary(movies[:len(streamed)])
+    assert len(streamed) >= 30
+
+
+def test_entry_split_across_chunks_keeps_details():
+    text = listing(1)
+    cut = text.index("2023-01-01") + 4
+    parser = ListingParser("Films")
+    parser.feed(text[:cut])
+    parser.feed(text[cut:])
+    [movie] = parser.close()
+    assert movie.modified == datetime(2023, 1, 1, 10, 20)
+    assert movie.size == int(1.5 * 1024 ** 3)
+
+
+def test_parent_and_foreign_folders_are_ignored():
+    text = '<a href="../">..</a><a href="/share/Other/Sub/">Sub</a><a href="/share/Films/Sub/">Sub</a>'
+    parser = ListingParser("Films")
+    parser.feed(text)
+    parser.close()
+    assert parser.folders == ["Sub"]
+
+
+def test_root_listing_only_takes_shares():
+    text = (
+        '<a href="/static/">Static</a><a href="https://vendor.example/support/">Support</a>'
+        '<a href="/share/Films/">Films</a><a href="Series/">Series</a><a href="/share/Films/2023/">2023</a>'
+    )
+    parser = ListingParser("")
+    parser.feed(text)
+    parser.close()
+    assert parser.folders == ["Films", "Series"]
+
+
+def test_folder_links_resolve_against_the_listing_root():
+    text = '<a href="/files/Films/Sub%20A/">Sub A</a><a href="/share/Films/Other/">Other</a><a href="B%20C/">B C</a>'
+    parser = ListingParser("Films", "/files")
+    parser.feed(text)
+    parser.close()
+    assert parser.folders == ["Sub A", "B C"]
@@ -0,0 +1,116 @@
+import asyncio
+import errno
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import server
+from server import FolderListing, LocalMountStorage, StorageUnavailable
+
+
+@pytest.fixture
+def mount(tmp_path):
+    films = tmp_path / "Films"
+    (films / "Drames").mkdir(parents=True)
+    (films / "@eaDir").mkdir()
+    (films / "a.mkv").write_bytes(bytes(range(256)) * 4)
+    (films / "b.MP4").write_bytes(b"mp4")
+    (films / "notes.txt").write_text("not a movie")
+    (films / ".hidden.mkv").write_bytes(b"hidden")
+    (tmp_path / "secret.mkv").write_bytes(b"outside the share")
+    server.file_metadata.clear()
+    return LocalMountStorage(tmp_path)
+
+
+def make_request(path, **headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": b"",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8001),
+    })
+
+
+async def body_of(response):
+    sent = []
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+    return b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+
+
+def test_list_folder(mount):
+    listing = asyncio.run(mount.list_folder("Films"))
+    assert sorted(movie.name for movie in listing.movies) == ["a.mkv", "b.MP4"]
+    assert listing.folders == ["Drames"]
+    a = next(movie for movie in listing.movies if movie.name == "a.mkv")
+    assert (a.path, a.format, a.size) == ("/Films/a.mkv", "mkv", 1024)
+
+
+def test_read_range(mount):
+    data, size = asyncio.run(mount.read_range("/Films/a.mkv", 250, 10))
+    assert size == 1024
+    assert data == bytes([250, 251, 252, 253, 254, 255, 0, 1, 2, 3])
+
+
+def test_stream_range(mount):
+    async def run():
+        request = make_request("/api/stream/Films/a.mkv", range="bytes=100-109")
+        response = await server.serve_movie(mount, "Films/a.mkv", request)
+        return response, await body_of(response)
+
+    response, body = asyncio.run(run())
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 100-109/1024"
+    assert response.headers["content-length"] == "10"
+    assert body == bytes(range(100, 110))
+
+
+def test_stream_whole_file(mount):
+    async def run():
+        response = await server.serve_movie(mount, "Films/b.MP4", make_request("/api/stream/Films/b.MP4"))
+        return response, await body_of(response)
+
+    response, body = asyncio.run(run())
+    assert response.status_code == 200
+    assert body == b"mp4"
+
+
+@pytest.mark.parametrize("path", ["Films/../secret.mkv", "../secret.mkv", "Films/./a.mkv", "/Films/missing.mkv"])
+def test_paths_outside_the_mount_are_not_found(mount, path):
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(mount.file_metadata(path))
+    assert raised.value.status_code == 404
+
+
+def test_listing_falls_back_to_http(mount, monkeypatch):
+    def broken(folder_path):
+        raise OSError(errno.EIO, "Input/output error")
+
+    async def http_listing(folder_path):
+        return FolderListing(folder_path, [], ["from-http"])
+
+    monkeypatch.setattr(mount, "_scan", broken)
+    monkeypatch.setattr(server, "mount_storage", mount)
+    monkeypatch.setattr(server.http_storage, "list_folder", http_listing)
+    listing = asyncio.run(server.list_nas_folder("Films"))
+    assert listing.folders == ["from-http"]
+    assert not mount.up
+
+
+def test_failing_mount_raises_storage_unavailable(mount, monkeypatch):
+    def broken(folder_path):
+        raise OSError(errno.EIO, "Input/output error")
+
+    monkeypatch.setattr(mount, "_scan", broken)
+    with pytest.raises(StorageUnavailable):
+        asyncio.run(mount.list_folder("Films"))
@@ -0,0 +1,171 @@
+import struct
+
+import pytest
+
+import media_probe
+from media_probe import asf_guid, probe_media
+
+
+def probe(file_format, data, head=4096, size=-1):
+    """Run probe_media the way probe_movie does, reading the ranges it asks for"""
+    size = len(data) if size == -1 else size
+    windows = {0: data[:head]}
+    for _ in range(10):
+        result = probe_media(file_format, size, windows)
+        if "media" in result:
+            return result["media"]
+        offset, length = result["need"]
+        windows[offset] = data[offset:offset + max(length, 64)]
+    raise AssertionError("probe_media kept asking for more")
+
+
+# MP4
+
+def atom(atom_type, body=b""):
+    return struct.pack(">I4s", 8 + len(body), atom_type) + body
+
+
+def mp4_track(handler, codec, width=0, height=0):
+    entry_body = codec + b"\0" * 24 + struct.pack(">HH", width, height) + b"\0" * 50
+    stsd = atom(b"stsd", b"\0" * 4 + struct.pack(">I", 1) + struct.pack(">I", 4 + len(entry_body)) + entry_body)
+    hdlr = atom(b"hdlr", b"\0" * 8 + handler + b"\0" * 12)
+    return atom(b"trak", atom(b"mdia", hdlr + atom(b"minf", atom(b"stbl", stsd))))
+
+
+def mp4_file(mdat_size=100000, moov_last=True):
+    mvhd = atom(b"mvhd", b"\0" * 12 + struct.pack(">II", 1000, 5400000) + b"\0" * 80)
+    moov = atom(b"moov", mvhd + mp4_track(b"vide", b"avc1", 1920, 800) + mp4_track(b"soun", b"mp4a"))
+    mdat = atom(b"mdat", b"\0" * mdat_size)
+    ftyp = atom(b"ftyp", b"isom\0\0\0\0")
+    return ftyp + (mdat + moov if moov_last else moov + mdat)
+
+
+MP4_MEDIA = {"duration": 5400.0, "video_codec": "h264", "width": 1920, "height": 800, "audio_codec": "aac"}
+
+
+@pytest.mark.parametrize("moov_last", [False, True])
+def test_mp4(moov_last):
+    data = mp4_file(moov_last=moov_last)
+    assert probe("mp4", data) == {**MP4_MEDIA, "bitrate": int(len(data) * 8 / 5400)}
+
+
+def test_mp4_of_unknown_size():
+    assert probe("mp4", mp4_file(), size=None) == MP4_MEDIA
+    # An mdat running to the end of a file of unknown size hides what follows
+    data = atom(b"ftyp", b"isom\0\0\0\0") + struct.pack(">I4s", 0, b"mdat") + b"\0" * 100
+    assert probe("mp4", data, size=None) == {}
+
+
+# Matroska
+
+def element(element_id, body=b""):
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return id_bytes + b"\x01" + len(body).to_bytes(7, "big") + body
+
+
+def uint(element_id, value, length=4):
+    return element(element_id, value.to_bytes(length, "big"))
+
+
+def mkv_tracks():
+    video = element(0xAE, uint(0x83, 1, 1) + element(0x86, b"V_MPEG4/ISO/AVC")
+                    + element(0xE0, uint(0xB0, 1280, 2) + uint(0xBA, 720, 2)))
+    audio = element(0xAE, uint(0x83, 2, 1) + element(0x86, b"A_AC3"))
+    return element(media_probe.EBML_TRACKS, video + audio)
+
+
+def mkv_file(tracks_after_cluster=False):
+    info = element(media_probe.EBML_INFO, uint(0x2AD7B1, 1000000) + element(0x4489, struct.pack(">d", 5400000.0)))
+    cluster = element(media_probe.EBML_CLUSTER, b"\0" * 100000)
+    if not tracks_after_cluster:
+        segment_body = info + mkv_tracks() + cluster
+    else:
+        seek = element(0x4DBB, uint(0x53AB, media_probe.EBML_TRACKS) + uint(0x53AC, 0, 8))
+        seek_head = element(media_probe.EBML_SEEK_HEAD, seek)
+        position = len(seek_head) + len(info) + len(cluster)
+        seek = element(0x4DBB, uint(0x53AB, media_probe.EBML_TRACKS) + uint(0x53AC, position, 8))
+        segment_body = element(media_probe.EBML_SEEK_HEAD, seek) + info + cluster + mkv_tracks()
+    unknown_size = b"\x01" + b"\xff" * 7
+    return element(0x1A45DFA3, element(0x4282, b"matroska")) + bytes.fromhex("18538067") + unknown_size + segment_body
+
+
+MKV_MEDIA = {"duration": 5400.0, "video_codec": "h264", "width": 1280, "height": 720, "audio_codec": "ac3"}
+
+
+@pytest.mark.parametrize("tracks_after_cluster", [False, True])
+def test_matroska(tracks_after_cluster):
+    media = probe("mkv", mkv_file(tracks_after_cluster), size=None)
+    assert media == MKV_MEDIA
+
+
+# AVI
+
+def chunk(fourcc, body):
+    return struct.pack("<4sI", fourcc, len(body)) + body + b"\0" * (len(body) & 1)
+
+
+def riff_list(fourcc, list_type, body):
+    return chunk(fourcc, list_type + body)
+
+
+def avi_file():
+    avih = chunk(b"avih", struct.pack("<I", 40000) + b"\0" * 12 + struct.pack("<I", 135000) + b"\0" * 12
+                 + struct.pack("<II", 720, 304) + b"\0" * 16)
+    video = riff_list(b"LIST", b"strl", chunk(b"strh", b"vidsxvid" + b"\0" * 48)
+                      + chunk(b"strf", b"\0" * 16 + b"XVID" + b"\0" * 20))
+    audio = riff_list(b"LIST", b"strl", chunk(b"strh", b"auds\0\0\0\0" + b"\0" * 48)
+                      + chunk(b"strf", struct.pack("<H", 0x2000) + b"\0" * 16))
+    hdrl = riff_list(b"LIST", b"hdrl", avih + video + audio)
+    return riff_list(b"RIFF", b"AVI ", hdrl + riff_list(b"LIST", b"movi", b"\0" * 1000))
+
+
+def test_avi():
+    media = probe("avi", avi_file(), head=64)
+    assert {key: value for key, value in media.items() if key != "bitrate"} == {
+        "duration": 5400.0, "width": 720, "height": 304, "video_codec": "mpeg4", "audio_codec": "ac3",
+    }
+
+
+# ASF
+
+def asf_object(guid, body):
+    return guid + struct.pack("<Q", 24 + len(body)) + body
+
+
+def asf_stream(stream_type, type_data):
+    return asf_object(media_probe.ASF_STREAM_PROPERTIES, stream_type + b"\0" * 38 + type_data)
+
+
+def asf_file():
+    file_properties = asf_object(
+        media_probe.ASF_FILE_PROPERTIES,
+        b"\0" * 40 + struct.pack("<QQQ", 54030000000, 0, 3000) + b"\0" * 16,
+    )
+    video = asf_stream(media_probe.ASF_VIDEO_MEDIA, struct.pack("<IIBH", 640, 480, 2, 40)
+                       + struct.pack("<IiiHH4s", 40, 640, 480, 1, 24, b"WVC1") + b"\0" * 20)
+    audio = asf_stream(media_probe.ASF_AUDIO_MEDIA, struct.pack("<H", 0x0161) + b"\0" * 16)
+    objects = file_properties + video + audio
+    header = asf_guid("75B22630-668E-11CF-A6D9-00AA0062CE6C") + struct.pack("<QI", 30 + len(objects), 3) + b"\1\2"
+    return header + objects + b"\0" * 1000
+
+
+def test_asf():
+    media = probe("wmv", asf_file(), head=64)
+    assert {key: value for key, value in media.items() if key != "bitrate"} == {
+        "duration": 5400.0, "width": 640, "height": 480, "video_codec": "vc1", "audio_codec": "wmav2",
+    }
+
+
+# Errors
+
+@pytest.mark.parametrize("file_format", ["mp4", "mkv", "avi", "wmv", "flv"])
+def test_garbage_is_unparseable(file_format):
+    assert probe_media(file_format, 64, {0: b"\xff" * 64}) == {"media": {}}
+
+
+def test_unexpected_errors_are_unparseable(monkeypatch):
+    def broken(size, windows):
+        raise RuntimeError("parser bug")
+
+    monkeypatch.setattr(media_probe, "parse_mp4", broken)
+    assert probe_media("mp4", 1000, {0: b"\0" * 64}) == {"media": {}}
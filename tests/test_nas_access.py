@@ -0,0 +1,39 @@
+import asyncio
+
+import server
+
+
+class FakeState:
+    """The shared_state collection, empty: no other worker has discovered anything"""
+
+    async def find_one(self, query):
+        return None
+
+    async def replace_one(self, query, doc, upsert=False):
+        pass
+
+
+def test_concurrent_listings_discover_once(monkeypatch):
+    probes = []
+
+    async def fetch_nas_listing(method, folder_path):
+        probes.append((method, folder_path))
+        await asyncio.sleep(0.01)
+        if method != "share":
+            raise ValueError(f"{method} is not served")
+        return f"listing of {folder_path}"
+
+    monkeypatch.setattr(server, "fetch_nas_listing", fetch_nas_listing)
+    monkeypatch.setattr(server, "shared_state", FakeState())
+    monkeypatch.setattr(server, "nas_access_method", None)
+    monkeypatch.setattr(server, "nas_access_expires", 0.0)
+
+    async def run():
+        monkeypatch.setattr(server, "nas_discovery_lock", asyncio.Lock())
+        folders = ["A", "B", "C", "D"]
+        return await asyncio.gather(*(server.fetch_nas_folder(folder) for folder in folders))
+
+    assert asyncio.run(run()) == ["listing of A", "listing of B", "listing of C", "listing of D"]
+    # One discovery probing every method, then the method found for the others
+    assert len(probes) == len(server.NAS_LISTING_URLS) + 3
+    assert server.nas_access_method == "share"
@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+from pymongo import DeleteOne, UpdateOne
+
+import server
+from server import PROGRESS_MAX_PENDING, ProgressStore
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    async def __aiter__(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    """Just enough of a motor collection for ProgressStore"""
+
+    def __init__(self):
+        self.docs = {}
+        self.batches = []
+        self.finds = 0
+        self.fail = False
+
+    def find(self, query, projection=None):
+        self.finds += 1
+        return FakeCursor([dict(doc) for doc in self.docs.values() if doc["viewer"] == query["viewer"]])
+
+    async def bulk_write(self, operations, ordered=True):
+        if self.fail:
+            raise ConnectionError("MongoDB is down")
+        self.batches.append(operations)
+        for operation in operations:
+            key = (operation._filter["viewer"], operation._filter["movie_id"])
+            if isinstance(operation, DeleteOne):
+                self.docs.pop(key, None)
+            else:
+                self.docs[key] = dict(operation._doc["$set"])
+
+
+@pytest.fixture
+def collection():
+    return FakeCollection()
+
+
+def test_heartbeats_are_written_in_one_batch(collection):
+    async def run():
+        store = ProgressStore(collection)
+        for position in range(100, 200, 10):
+            await store.record("alice", "m1", position, 3600)
+        await store.record("bob", "m1", 500, 3600)
+        assert collection.batches == []
+        assert await store.flush() == 2
+        assert await store.flush() == 0
+
+    asyncio.run(run())
+    [batch] = collection.batches
+    assert all(isinstance(operation, UpdateOne) for operation in batch)
+    assert collection.docs[("alice", "m1")]["position"] == 190
+    assert collection.docs[("bob", "m1")]["position"] == 500
+
+
+def test_forget_is_written_as_a_delete(collection):
+    async def run():
+        store = ProgressStore(collection)
+        await store.record("alice", "m1", 100, 3600)
+        await store.flush()
+        assert await store.forget("alice", "m1")
+        assert not await store.forget("alice", "m1")
+        await store.flush()
+
+    asyncio.run(run())
+    assert isinstance(collection.batches[-1][0], DeleteOne)
+    assert collection.docs == {}
+
+
+def test_enough_pending_changes_ask_for_a_flush(collection):
+    async def run():
+        store = ProgressStore(collection)
+        for i in range(PROGRESS_MAX_PENDING - 1):
+            await store.record("alice", f"m{i}", 100)
+        assert not store.flush_wanted.is_set()
+        await store.record("alice", "last", 100)
+        assert store.flush_wanted.is_set()
+
+    asyncio.run(run())
+
+
+def test_failed_batch_is_retried_without_overwriting_newer_changes(collection):
+    async def run():
+        store = ProgressStore(collection)
+        await store.record("alice", "m1", 100, 3600)
+        await store.record("alice", "m2", 100, 3600)
+        collection.fail = True
+        with pytest.raises(ConnectionError):
+            await store.flush()
+        await store.record("alice", "m1", 300, 3600)
+        collection.fail = False
+        assert await store.flush() == 2
+
+    asyncio.run(run())
+    assert collection.docs[("alice", "m1")]["position"] == 300
+
+
+def test_continue_watching_and_reload(collection):
+    async def run():
+        store = ProgressStore(collection)
+        await store.record("alice", "short", 10, 3600)
+        await store.record("alice", "done", 3500, 3600)
+        await store.record("alice", "first", 600, 3600)
+        await store.record("alice", "second", 900, 3600)
+        watching = [record["movie_id"] for record in await store.continue_watching("alice", 10)]
+        await store.flush()
+        # A fresh worker reads the same list back from MongoDB
+        reloaded = ProgressStore(collection)
+        again = [record["movie_id"] for record in await reloaded.continue_watching("alice", 10)]
+        return watching, again
+
+    watching, again = asyncio.run(run())
+    assert watching == again == ["second", "first"]
+
+
+def test_least_recently_used_viewers_are_dropped_once_written(collection):
+    async def run():
+        store = ProgressStore(collection, max_viewers=2)
+        for viewer in ("alice", "bob", "carol"):
+            await store.record(viewer, "m1", 100, 3600)
+        # Nothing written yet: every viewer stays
+        assert list(store.positions) == ["alice", "bob", "carol"]
+        await store.flush()
+        assert list(store.positions) == ["bob", "carol"]
+        assert set(store.watching) == set(store.loaded_at) == {"bob", "carol"}
+        finds = collection.finds
+        assert (await store.get("alice", "m1"))["position"] == 100
+        assert collection.finds == finds + 1
+        assert list(store.positions) == ["carol", "alice"]
+
+    asyncio.run(run())
+
+
+def test_shared_store_reloads_changes_of_other_workers(collection, monkeypatch):
+    async def run():
+        mine, other = ProgressStore(collection, shared=True), ProgressStore(collection, shared=True)
+        await mine.record("alice", "m1", 100, 3600)
+        await mine.flush()
+        await other.record("alice", "m1", 200, 3600)
+        await other.flush()
+        assert (await mine.get("alice", "m1"))["position"] == 100
+        monkeypatch.setattr(server, "PROGRESS_FLUSH_INTERVAL", -1)
+        return (await mine.get("alice", "m1"))["position"]
+
+    assert asyncio.run(run()) == 200
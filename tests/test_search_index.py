@@ -0,0 +1,49 @@
+from catalog_search import SearchIndex, name_words
+
+
+def build(*names, folder="Films"):
+    index = SearchIndex()
+    for i, name in enumerate(names):
+        index.add({"id": str(i), "name": name, "folders": [folder]})
+    return index
+
+
+def found(index, query, **kwargs):
+    return [index.entries[entry_id].sort_key for entry_id in index.search(query, **kwargs)]
+
+
+def test_name_words_drop_noise_from_the_release_tail():
+    assert name_words("Amélie.2001.FRENCH.1080p.BluRay.x264.mkv") == ["amelie", "2001"]
+    assert name_words("The.French.Connection.1971.1080p.mkv") == ["the", "french", "connection", "1971"]
+    assert name_words("1917.2019.MULTi.2160p.mkv") == ["1917", "2019"]
+
+
+def test_prefix_accents_and_typos():
+    index = build("Astérix.et.Obélix.Mission.Cléopâtre.2002.mkv", "Interstellar.2014.1080p.mkv")
+    assert found(index, "ast") == ["asterix.et.obelix.mission.cleopatre.2002.mkv"]
+    assert found(index, "CLEOPATRE") == ["asterix.et.obelix.mission.cleopatre.2002.mkv"]
+    assert found(index, "intersteller") == ["interstellar.2014.1080p.mkv"]
+    assert found(index, "mission inter") == []
+
+
+def test_titles_starting_with_the_query_rank_first():
+    index = build("Le.Retour.du.Jedi.mkv", "Retour.vers.le.Futur.mkv")
+    assert index.search("retour") == ["1", "0"]
+
+
+def test_noise_words_are_optional_unless_alone():
+    index = build("Amelie.2001.FRENCH.1080p.mkv", "The.French.Connection.1971.mkv", "Web.of.Lies.2010.WEB.mkv")
+    assert index.search("amelie french") == ["0"]
+    assert index.search("french") == ["1"]
+    assert index.search("web") == ["2"]
+    assert index.search("1080p") == []
+
+
+def test_folder_filter_and_remove():
+    index = build("Matrix.1999.mkv")
+    index.add({"id": "series", "name": "Matrix.Animatrix.mkv", "folders": ["Series"]})
+    assert found(index, "matrix", folder="Series") == ["matrix.animatrix.mkv"]
+    index.remove("series")
+    assert index.search("animatrix") == []
+    assert len(index) == 1
+    assert "animatrix" not in index.postings
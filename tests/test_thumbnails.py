@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+import server
+from server import ThumbnailCache, ThumbnailError
+
+
+def test_missing_ffmpeg_is_remembered_as_a_failure(tmp_path, monkeypatch):
+    spawned = []
+    spawn = asyncio.create_subprocess_exec
+
+    async def create_subprocess_exec(*args, **kwargs):
+        spawned.append(args[0])
+        return await spawn(*args, **kwargs)
+
+    async def movie_ffmpeg_input(movie_path, api_url):
+        return f"{api_url}/api/stream/by-id/1?background=true"
+
+    monkeypatch.setattr(server, "FFMPEG_PATH", str(tmp_path / "no-ffmpeg"))
+    monkeypatch.setattr(server, "movie_ffmpeg_input", movie_ffmpeg_input)
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", create_subprocess_exec)
+    doc = {"path": "/Films/a.mkv", "size": 1000, "modified": None, "media": None}
+
+    async def run():
+        cache = ThumbnailCache(tmp_path / "thumbnails")
+        with pytest.raises(server.FFmpegError, match="Cannot run"):
+            await cache.get(doc, "small", "http://127.0.0.1:8001")
+        await asyncio.sleep(0)
+        attempts = len(spawned)
+        # Answered from the failure without spawning ffmpeg again
+        with pytest.raises(ThumbnailError):
+            await cache.get(doc, "small", "http://127.0.0.1:8001")
+        return attempts
+
+    attempts = asyncio.run(run())
+    assert attempts == len(spawned) > 0
@@ -0,0 +1,110 @@
+import asyncio
+
+from server import NAS_STARTUP_BYTES, UpstreamScheduler
+
+
+async def grant_order(scheduler, reads):
+    """Queue reads behind a held slot, release it and return the names in the order they got it"""
+    holder = scheduler.read(scheduler.open_share("holder"))
+    await scheduler.acquire_read(holder)
+    order = []
+
+    async def wait(name, read):
+        async with scheduler.reading(read):
+            order.append(name)
+
+    tasks = [asyncio.create_task(wait(name, read)) for name, read in reads]
+    await asyncio.sleep(0)
+    scheduler.release_read()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def playing_share(scheduler, label, finish_tag=0.0):
+    share = scheduler.open_share(label)
+    share.bytes = NAS_STARTUP_BYTES
+    share.finish_tag = finish_tag
+    return share
+
+
+def test_startup_then_playback_then_readahead():
+    async def run():
+        scheduler = UpstreamScheduler(max_reads=1, bandwidth=0)
+        return await grant_order(scheduler, [
+            ("readahead", scheduler.read(playing_share(scheduler, "a"), readahead=True)),
+            ("background", scheduler.read()),
+            ("playback", scheduler.read(playing_share(scheduler, "b"))),
+            ("startup", scheduler.read(scheduler.open_share("c"))),
+            ("ffmpeg", scheduler.read(scheduler.open_share("d", background=True))),
+        ])
+
+    assert asyncio.run(run()) == ["startup", "playback", "readahead", "background", "ffmpeg"]
+
+
+def test_fair_queueing_within_a_class():
+    async def run():
+        scheduler = UpstreamScheduler(max_reads=1, bandwidth=0)
+        return await grant_order(scheduler, [
+            ("greedy", scheduler.read(playing_share(scheduler, "greedy", finish_tag=5e6))),
+            ("behind", scheduler.read(playing_share(scheduler, "behind", finish_tag=1e6))),
+        ])
+
+    assert asyncio.run(run()) == ["behind", "greedy"]
+
+
+def test_waited_on_readahead_is_promoted():
+    async def run():
+        scheduler = UpstreamScheduler(max_reads=1, bandwidth=0)
+        promoted = scheduler.read(playing_share(scheduler, "a"), readahead=True)
+        holder = scheduler.read(scheduler.open_share("holder"))
+        await scheduler.acquire_read(holder)
+        order = []
+
+        async def wait(name, read):
+            async with scheduler.reading(read):
+                order.append(name)
+
+        tasks = [
+            asyncio.create_task(wait("other readahead", scheduler.read(playing_share(scheduler, "b"), readahead=True))),
+            asyncio.create_task(wait("promoted", promoted)),
+        ]
+        await asyncio.sleep(0)
+        promoted.readahead = False
+        scheduler.release_read()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["promoted", "other readahead"]
+
+
+def test_resize_grants_waiting_reads():
+    async def run():
+        scheduler = UpstreamScheduler(max_reads=1, bandwidth=0)
+        first = scheduler.read(scheduler.open_share("a"))
+        await scheduler.acquire_read(first)
+        waiting = asyncio.create_task(scheduler.acquire_read(scheduler.read(scheduler.open_share("b"))))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        scheduler.resize(2, 0)
+        await asyncio.wait_for(waiting, 1)
+        return scheduler.reads
+
+    assert asyncio.run(run()) == 2
+
+
+def test_bandwidth_goes_to_the_share_behind():
+    async def run():
+        scheduler = UpstreamScheduler(max_reads=4, bandwidth=1e6, burst=0)
+        greedy, behind = playing_share(scheduler, "greedy"), playing_share(scheduler, "behind")
+        # The greedy share has already been given a turn
+        await scheduler.transfer(scheduler.read(greedy), 50000)
+        order = []
+
+        async def transfer(name, share):
+            await scheduler.transfer(scheduler.read(share), 50000)
+            order.append(name)
+
+        await asyncio.gather(transfer("greedy", greedy), transfer("behind", behind))
+        return order
+
+    assert asyncio.run(run()) == ["behind", "greedy"]